@@ -1,3 +1,12 @@
 # This file marks this directory as a Python module
 
-from .cpcli import cli
+# The cli (whose import loads the configuration and registers all of the
+# commands) is only imported when it is first used, so that the other
+# cpcli modules (cpcli.standin, cpcli.benchmark, ...) can be imported on
+# their own by the scripts, the tests and any (spawned) worker processes.
+#
+def __getattr__(anAttr) :
+  if anAttr == 'cli' :
+    from cpcli.cpcli import cli
+    return cli
+  raise AttributeError(f"module 'cpcli' has no attribute '{anAttr}'")
@@ -0,0 +1,55 @@
+"""Maintain the local index of the project paths which cprsyncctl allows.
+
+cprsyncctl runs once for every incoming rsync ssh session. Rather than
+asking the MajorDomo for the full list of projects each time, it reads
+this index, which cpcli rewrites (from one 'GET /projects') whenever it
+adds, updates or removes projects.
+
+The index is a small text file, by default 'cprsyncAllowedPaths' in the
+same directory as the MajorDomo's socket (so that cprsyncctl can find it
+from its '--socket'). Its first line is a header:
+
+    cprsyncAllowedPaths<TAB>1<TAB><written (epoch seconds)><TAB><socketPath>
+
+followed by one '<projectPath><TAB><projectName>' line for each project,
+sorted by path (see cprsync.writeAllowedPathsIndex). cprsyncctl only
+trusts the index if it is younger than its maximum age ('--maxindexage',
+by default only 10 seconds, so that a stale index can not allow a
+removed project for long), the MajorDomo's socket has not been recreated
+(the MajorDomo restarted), and none of the files given using
+'--indexwatch' (such as the MajorDomo's record of its projects) has
+changed, since the index was written. Otherwise cprsyncctl asks the
+MajorDomo, and then rewrites the index itself, so that a burst of rsync
+sessions only asks the MajorDomo once every '--maxindexage' seconds. """
+
+import os
+import sys
+
+def allowedPathsIndexPath(config) :
+  """Return the path of the allowed paths index for the configured
+  MajorDomo."""
+
+  cprsyncConfig = config.get('cprsync', { })
+  if isinstance(cprsyncConfig, dict) and 'indexPath' in cprsyncConfig :
+    return os.path.abspath(os.path.expanduser(cprsyncConfig['indexPath']))
+  return os.path.join(
+    os.path.dirname(config['socketPath']), 'cprsyncAllowedPaths'
+  )
+
+def refreshAllowedPathsIndex(config) :
+  """Rewrite the allowed paths index from the MajorDomo's current list
+  of projects. Any failure is reported (when verbose) but is otherwise
+  ignored, since cprsyncctl falls back to asking the MajorDomo."""
+
+  # (cprsync, which reads the index, also writes it)
+  from cprsync import writeAllowedPathsIndex
+  from cpcli.utils import getDataFromMajorDomo
+  indexPath = allowedPathsIndexPath(config)
+  try :
+    projects = getDataFromMajorDomo('/projects')
+    if not isinstance(projects, dict) :
+      raise ValueError("the MajorDomo did not return a list of projects")
+    writeAllowedPathsIndex(indexPath, config['socketPath'], projects)
+  except Exception as err :
+    if 0 < config.get('verbosity', 0) :
+      sys.stderr.write(f"Could not update [{indexPath}]\n  {repr(err)}\n")
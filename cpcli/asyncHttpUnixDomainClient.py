@@ -0,0 +1,150 @@
+"""A minimal asyncio based HTTP/1.1 client for Unix domain sockets.
+
+This allows asyncio based commands and tests (which are also listening to
+NATS subjects) to make (many concurrent) requests of the MajorDomo without
+blocking the event loop. """
+
+import asyncio
+import os
+
+from cpcli.httpUnixDomainClient import idempotentMethods
+
+class AsyncHTTPUnixDomainClient :
+  """An asyncio HTTP/1.1 client with a bounded pool of keep-alive
+  connections to one Unix domain socket.
+
+  Up to maxConnections requests may be in flight at any one time. If the
+  server has closed an idle connection, the request is transparently
+  retried (once) on a new connection, so long as the request could not
+  have been acted upon (it was idempotent, or could not be sent). """
+
+  def __init__(self, socketPath, maxConnections=8) :
+    self.socketPath     = os.path.abspath(os.path.expanduser(socketPath))
+    self.idle           = []
+    self.semaphore      = asyncio.Semaphore(maxConnections)
+    self.requestCount   = 0
+    self.connectCount   = 0
+    self.reconnectCount = 0
+
+  async def connect(self) :
+    self.connectCount = self.connectCount + 1
+    return await asyncio.open_unix_connection(self.socketPath)
+
+  async def sendRequest(self, writer, method, url, body, headers) :
+    requestLines = [
+      f"{method.upper()} {url} HTTP/1.1",
+      "Host: localhost",
+      f"Content-Length: {len(body)}"
+    ]
+    for aHeader, aValue in headers.items() :
+      requestLines.append(f"{aHeader}: {aValue}")
+    requestLines.append("")
+    requestLines.append("")
+    writer.write("\r\n".join(requestLines).encode('latin-1') + body)
+    await writer.drain()
+
+  async def readResponse(self, reader, method) :
+    """Read one response, returning (status, headers, body, willClose).
+    Raises ConnectionResetError if the server has closed the connection
+    before sending a response."""
+
+    statusLine = await reader.readline()
+    if not statusLine :
+      raise ConnectionResetError("Remote end closed connection without response")
+    statusParts = statusLine.decode('latin-1').split(None, 2)
+    if len(statusParts) < 2 or not statusParts[0].startswith('HTTP/') :
+      raise ConnectionError(f"Bad status line: {statusLine!r}")
+    status = int(statusParts[1])
+
+    headers = { }
+    while True :
+      aLine = await reader.readline()
+      if aLine in (b'\r\n', b'\n', b'') : break
+      aHeader, _, aValue = aLine.decode('latin-1').partition(':')
+      headers[aHeader.strip().lower()] = aValue.strip()
+
+    willClose = headers.get('connection', '').lower() == 'close' \
+      or statusParts[0] == 'HTTP/1.0'
+
+    body = b''
+    if method.upper() == 'HEAD' or status in (204, 304) or status < 200 :
+      pass
+    elif headers.get('transfer-encoding', '').lower() == 'chunked' :
+      chunks = []
+      while True :
+        chunkSize = int((await reader.readline()).split(b';')[0], 16)
+        if chunkSize == 0 :
+          # skip any trailers
+          while (await reader.readline()) not in (b'\r\n', b'\n', b'') :
+            pass
+          break
+        chunks.append(await reader.readexactly(chunkSize))
+        await reader.readline()
+      body = b''.join(chunks)
+    elif 'content-length' in headers :
+      body = await reader.readexactly(int(headers['content-length']))
+    else :
+      body = await reader.read()
+      willClose = True
+    return status, headers, body, willClose
+
+  async def request(self, method, url, body=b'', headers=None) :
+    """Make an HTTP request and return the (status, headers, body) of the
+    response. The header names are lower cased."""
+
+    if isinstance(body, str) : body = body.encode('utf-8')
+    if body is None : body = b''
+    if headers is None : headers = { }
+    async with self.semaphore :
+      self.requestCount = self.requestCount + 1
+      # (discarding any idle connections the server has already closed)
+      while self.idle and self.idle[-1][0].at_eof() :
+        self.idle.pop()[1].close()
+      reused = bool(self.idle)
+      if reused : reader, writer = self.idle.pop()
+      else      : reader, writer = await self.connect()
+      while True :
+        sent = False
+        try :
+          await self.sendRequest(writer, method, url, body, headers)
+          sent = True
+          status, respHeaders, respBody, willClose = \
+            await self.readResponse(reader, method)
+          break
+        except (ConnectionError, asyncio.IncompleteReadError) :
+          writer.close()
+          if not reused : raise
+          if sent and method.upper() not in idempotentMethods : raise
+          # the server closed this idle connection... so try again (once)
+          # on a new connection
+          self.reconnectCount = self.reconnectCount + 1
+          reader, writer = await self.connect()
+          reused = False
+        except BaseException :
+          writer.close()
+          raise
+
+      if willClose : writer.close()
+      else         : self.idle.append((reader, writer))
+    return status, respHeaders, respBody
+
+  async def close(self) :
+    """Close all idle connections."""
+
+    idle, self.idle = self.idle, []
+    for _, writer in idle :
+      writer.close()
+      try :
+        await writer.wait_closed()
+      except Exception :
+        pass
+
+  def stats(self) :
+    """Return the diagnostic counts for this client."""
+
+    return {
+      'socketPath' : self.socketPath,
+      'requests'   : self.requestCount,
+      'connects'   : self.connectCount,
+      'reconnects' : self.reconnectCount
+    }
@@ -0,0 +1,127 @@
+"""Use the requests of yaml tests to load test a MajorDomo.
+
+The 'bench' (tester mode) command repeatedly makes the requests of the
+selected yaml tests (in turn) from 'concurrency' concurrent workers,
+over a pool of keep-alive connections to the MajorDomo at
+config['socketPath'], for a given duration or number of requests. It
+reports the throughput, the p50/p95/p99 latencies and the error rates,
+both overall and for each test. A request fails if it raises an
+exception or its response has a status of 400 or more. """
+
+import json
+import time
+
+# The methods of the MajorDomo's interface
+#
+supportedMethods = ('GET', 'POST')
+
+def yamlTestRequest(yamlTest) :
+  """Return the (method, url, body) of a yaml test's request, or None if
+  the yaml test has no (usable) request. A POST request's 'data' is sent
+  as its (JSON) body. Raises a ValueError if the request's method is not
+  supported."""
+
+  if not isinstance(yamlTest, dict) : return None
+  request = yamlTest.get('request')
+  if not isinstance(request, dict) : return None
+  if 'method' not in request or 'url' not in request : return None
+  method = str(request['method']).upper()
+  if method not in supportedMethods :
+    raise ValueError("the request of [{}] uses the unsupported method {} (use one of {})".format(
+      yamlTest.get('testName', '?'), method, ", ".join(supportedMethods)
+    ))
+  body   = None
+  if 'data' in request : body = json.dumps(request['data'])
+  return method, request['url'], body
+
+def percentile(sortedTimes, aFraction) :
+  """Return the (nearest rank) aFraction percentile of some sorted times,
+  or None if there are no times. (Also used by the build monitor's
+  timings.)"""
+
+  if not sortedTimes : return None
+  return sortedTimes[min(len(sortedTimes)-1, int(aFraction * len(sortedTimes)))]
+
+def latencyStats(someTimes, elapsed, errors) :
+  """Summarise the latencies (in milliseconds), throughput and error rate
+  of some requests."""
+
+  someTimes = sorted(someTimes)
+  numRequests = len(someTimes)
+  def ms(aTime) :
+    return None if aTime is None else round(aTime * 1000, 3)
+  return {
+    'requests'   : numRequests,
+    'errors'     : errors,
+    'errorRate'  : round(errors / numRequests, 4) if numRequests else None,
+    'throughput' : round(numRequests / elapsed, 1) if 0 < elapsed else None,
+    'latencyMs'  : {
+      'min' : ms(someTimes[0] if someTimes else None),
+      'p50' : ms(percentile(someTimes, 0.50)),
+      'p95' : ms(percentile(someTimes, 0.95)),
+      'p99' : ms(percentile(someTimes, 0.99)),
+      'max' : ms(someTimes[-1] if someTimes else None),
+    }
+  }
+
+async def runBenchmark(requests, socketPath, concurrency=8, duration=10.0,
+  count=None) :
+  """Make the requests (a list of (testName, (method, url, body)) pairs)
+  in turn from concurrency workers, until count requests have been made
+  or duration seconds have passed. Returns the benchmark statistics."""
+
+  import asyncio
+  from cpcli.asyncHttpUnixDomainClient import AsyncHTTPUnixDomainClient
+
+  concurrency = max(1, concurrency)
+  client      = AsyncHTTPUnixDomainClient(socketPath, maxConnections=concurrency)
+  latencies   = { aTestName : [ ] for aTestName, aRequest in requests }
+  errors      = { aTestName : 0   for aTestName, aRequest in requests }
+  errorKinds  = { }
+  nextRequest = 0
+  startTime   = time.monotonic()
+  endTime     = startTime + duration
+
+  def takeRequest() :
+    nonlocal nextRequest
+    if count is not None :
+      if count <= nextRequest : return None
+    elif endTime <= time.monotonic() : return None
+    aRequest    = requests[nextRequest % len(requests)]
+    nextRequest = nextRequest + 1
+    return aRequest
+
+  async def worker() :
+    while True :
+      aRequest = takeRequest()
+      if aRequest is None : return
+      testName, (method, url, body) = aRequest
+      requestStart = time.monotonic()
+      errorKind    = None
+      try :
+        status, headers, respBody = await client.request(method, url, body)
+        if 400 <= status : errorKind = f"HTTP {status}"
+      except Exception as err :
+        errorKind = type(err).__name__
+      latencies[testName].append(time.monotonic() - requestStart)
+      if errorKind :
+        errors[testName] = errors[testName] + 1
+        errorKinds[errorKind] = errorKinds.get(errorKind, 0) + 1
+
+  try :
+    await asyncio.gather(*[ worker() for aWorker in range(concurrency) ])
+  finally :
+    await client.close()
+  elapsed = time.monotonic() - startTime
+
+  allLatencies = [ ]
+  for someLatencies in latencies.values() : allLatencies.extend(someLatencies)
+  benchStats = latencyStats(allLatencies, elapsed, sum(errors.values()))
+  benchStats['elapsed']     = round(elapsed, 3)
+  benchStats['concurrency'] = concurrency
+  benchStats['errorKinds']  = errorKinds
+  benchStats['tests']       = {
+    aTestName : latencyStats(latencies[aTestName], elapsed, errors[aTestName])
+      for aTestName, aRequest in requests
+  }
+  return benchStats
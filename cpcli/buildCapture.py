@@ -0,0 +1,220 @@
+"""Capture (and replay) the NATS messages of monitored builds.
+
+A capture file is an append-only sequence of blocks. Each block holds a
+batch of (timestamp, subject, message) records, compressed (with zlib)
+as a whole, preceded by a small header:
+
+    magic (4 bytes) | metaLen (uint32) | dataLen (uint32)
+    meta (JSON: count, first and last timestamps, subjects)
+    data (zlib compressed JSON lines)
+
+The meta data of every block is also appended (together with the block's
+offset) to a '<captureFile>.idx' index file, so that replay can find the
+blocks which overlap a time range and contain a subject without reading
+(or decompressing) the others. If the index is missing or incomplete it
+is rebuilt by scanning the block headers. A block which was only partly
+written (because the capture was killed) is ignored. """
+
+import json
+import os
+import struct
+import time
+import zlib
+
+blockMagic  = b'CPMC'
+blockHeader = struct.Struct('>4sII')
+
+def subjectMatches(aPattern, theSubject) :
+  """Does theSubject match the NATS subject aPattern ('*' matches one
+  token, '>' matches all remaining tokens)?"""
+
+  patternTokens = aPattern.split('.')
+  subjectTokens = theSubject.split('.')
+  for tokenIndex, aToken in enumerate(patternTokens) :
+    if aToken == '>' : return tokenIndex < len(subjectTokens)
+    if len(subjectTokens) <= tokenIndex : return False
+    if aToken != '*' and aToken != subjectTokens[tokenIndex] : return False
+  return len(patternTokens) == len(subjectTokens)
+
+def anySubjectMatches(subjectPatterns, theSubject) :
+  if not subjectPatterns : return True
+  for aPattern in subjectPatterns :
+    if subjectMatches(aPattern, theSubject) : return True
+  return False
+
+def parseCaptureTime(aTime, captureStart) :
+  """Parse a replay time, which is either a number of seconds since the
+  epoch, an ISO 8601 date/time, or '+<seconds>' relative to the start of
+  the capture (captureStart)."""
+
+  if aTime is None : return None
+  if aTime.startswith('+') : return (captureStart or 0) + float(aTime[1:])
+  try :
+    return float(aTime)
+  except ValueError :
+    pass
+  import datetime
+  return datetime.datetime.fromisoformat(aTime).timestamp()
+
+class CaptureWriter :
+  """Append the messages of a build to a capture file, one compressed
+  block at a time. A block is written once it holds blockSize records or
+  its first record is older than flushInterval seconds."""
+
+  def __init__(self, capturePath, blockSize=512, flushInterval=1.0) :
+    self.capturePath   = capturePath
+    self.blockSize     = blockSize
+    self.flushInterval = flushInterval
+    self.captureFile   = open(capturePath, 'ab')
+    self.indexFile     = open(capturePath+'.idx', 'a')
+    self.records       = [ ]
+    self.subjects      = set()
+    self.firstTime     = None
+    self.lastTime      = None
+    self.messages      = 0
+    self.blocks        = 0
+
+  def append(self, theSubject, theMsg, timestamp=None) :
+    if timestamp is None : timestamp = time.time()
+    if not self.records : self.firstTime = timestamp
+    self.lastTime = timestamp
+    self.records.append(json.dumps([ timestamp, theSubject, theMsg ]))
+    self.subjects.add(theSubject)
+    self.messages = self.messages + 1
+    if self.blockSize <= len(self.records) or \
+      self.flushInterval <= timestamp - self.firstTime :
+      self.flush()
+
+  def flush(self) :
+    """Write the current block (if any) and its index entry."""
+
+    if not self.records : return
+    meta = {
+      'count'    : len(self.records),
+      'first'    : self.firstTime,
+      'last'     : self.lastTime,
+      'subjects' : sorted(self.subjects)
+    }
+    metaBytes = json.dumps(meta).encode('utf-8')
+    dataBytes = zlib.compress(
+      "\n".join(self.records).encode('utf-8'), 6
+    )
+    offset = self.captureFile.seek(0, os.SEEK_END)
+    self.captureFile.write(
+      blockHeader.pack(blockMagic, len(metaBytes), len(dataBytes)) + \
+      metaBytes + dataBytes
+    )
+    self.captureFile.flush()
+    meta['offset'] = offset
+    self.indexFile.write(json.dumps(meta)+"\n")
+    self.indexFile.flush()
+    self.records  = [ ]
+    self.subjects = set()
+    self.blocks   = self.blocks + 1
+
+  def flushIfDue(self) :
+    """Write the current block if it has been waiting for (at least)
+    flushInterval seconds (so that quiet builds are captured promptly)."""
+
+    if self.records and self.flushInterval <= time.time() - self.firstTime :
+      self.flush()
+
+  def close(self) :
+    self.flush()
+    self.captureFile.close()
+    self.indexFile.close()
+
+def scanBlocks(captureFile, offset=0) :
+  """Return the meta data (and offsets) of the complete blocks found by
+  scanning the block headers of a capture file from offset."""
+
+  blocks   = [ ]
+  fileSize = captureFile.seek(0, os.SEEK_END)
+  while offset + blockHeader.size <= fileSize :
+    captureFile.seek(offset)
+    magic, metaLen, dataLen = blockHeader.unpack(
+      captureFile.read(blockHeader.size)
+    )
+    blockEnd = offset + blockHeader.size + metaLen + dataLen
+    if magic != blockMagic or fileSize < blockEnd : break
+    meta = json.loads(captureFile.read(metaLen))
+    meta['offset'] = offset
+    blocks.append(meta)
+    offset = blockEnd
+  return blocks
+
+class CaptureReader :
+  """Read the messages (selected by time and subject) from a capture
+  file."""
+
+  def __init__(self, capturePath) :
+    self.capturePath = capturePath
+    self.captureFile = open(capturePath, 'rb')
+    self.blocks      = self.loadIndex()
+
+  def loadIndex(self) :
+    """Load the block index, rebuilding (any missing part of) it from the
+    block headers."""
+
+    blocks = [ ]
+    try :
+      with open(self.capturePath+'.idx') as indexFile :
+        for aLine in indexFile :
+          try :
+            blocks.append(json.loads(aLine))
+          except ValueError :
+            break
+    except FileNotFoundError :
+      pass
+    offset = 0
+    if blocks :
+      self.captureFile.seek(blocks[-1]['offset'])
+      try :
+        magic, metaLen, dataLen = blockHeader.unpack(
+          self.captureFile.read(blockHeader.size)
+        )
+      except struct.error :
+        magic = None
+      if magic != blockMagic : return scanBlocks(self.captureFile)
+      offset = blocks[-1]['offset'] + blockHeader.size + metaLen + dataLen
+    blocks.extend(scanBlocks(self.captureFile, offset))
+    return blocks
+
+  def startTime(self) :
+    """The timestamp of the first captured message (if any)."""
+
+    if not self.blocks : return None
+    return self.blocks[0]['first']
+
+  def selectBlocks(self, since=None, until=None, subjectPatterns=None) :
+    selected = [ ]
+    for aBlock in self.blocks :
+      if since is not None and aBlock['last']  < since : continue
+      if until is not None and until < aBlock['first'] : continue
+      if subjectPatterns and not any(
+        anySubjectMatches(subjectPatterns, aSubject)
+          for aSubject in aBlock['subjects']
+      ) : continue
+      selected.append(aBlock)
+    return selected
+
+  def messages(self, since=None, until=None, subjectPatterns=None) :
+    """Yield the selected (timestamp, subject, message) records in the
+    order in which they were captured."""
+
+    for aBlock in self.selectBlocks(since, until, subjectPatterns) :
+      self.captureFile.seek(aBlock['offset'])
+      magic, metaLen, dataLen = blockHeader.unpack(
+        self.captureFile.read(blockHeader.size)
+      )
+      self.captureFile.seek(metaLen, os.SEEK_CUR)
+      dataBytes = zlib.decompress(self.captureFile.read(dataLen))
+      for aLine in dataBytes.split(b"\n") :
+        timestamp, theSubject, theMsg = json.loads(aLine)
+        if since is not None and timestamp < since : continue
+        if until is not None and until < timestamp : continue
+        if not anySubjectMatches(subjectPatterns, theSubject) : continue
+        yield timestamp, theSubject, theMsg
+
+  def close(self) :
+    self.captureFile.close()
@@ -0,0 +1,382 @@
+"""Monitor the builds of (many) project targets using NATS messages.
+
+The logs of a build of a project's target are published on the
+'logger.<project>.<target>' subject, and the build's progress on the
+'*.build.from.*.<project>.<target>' subjects. A dict message with a
+'retCode' signals that the build of that target has completed.
+
+A BuildMonitor subscribes (over one NATS connection) to the subjects of
+any number of targets (NATS wildcards may be used for the project or
+target names), prefixes each message it echoes with its project and
+target, and records the completion of each target. The messages can also
+be captured (see cpcli.buildCapture) to be replayed later.
+
+The BuildTimings record when the messages of each target arrive, in
+order to summarise where the time of each build is spent.
+
+The OutputQueue decouples the NATS callbacks from the (possibly slow)
+terminal or pipe to which the messages are echoed. """
+
+import collections
+import sys
+import time
+
+separator = "\n--------------------------------------------------------------------------------\n"
+
+def subjectTarget(theSubject) :
+  """Return the (project, target) pair of a logger or build subject."""
+
+  subjectParts = theSubject.split('.')
+  if subjectParts[0] == 'logger' and 3 <= len(subjectParts) :
+    return subjectParts[1], subjectParts[2]
+  if 2 <= len(subjectParts) :
+    return subjectParts[-2], subjectParts[-1]
+  return theSubject, ''
+
+def formatNatsMessage(theMsg) :
+  """Return the lines to be echoed for a build or logger message (if
+  any), together with the message's retCode (if any)."""
+
+  if isinstance(theMsg, str) and 1 < len(theMsg) and theMsg[1] != 'D' :
+    return [ theMsg.strip("\"") ], None
+  elif isinstance(theMsg, dict) :
+    if 'retCode' in theMsg :
+      return [
+        f"completed with code: {theMsg['retCode']}", separator
+      ], theMsg['retCode']
+  return [], None
+
+def parseTargets(targetArgs, allTargets=False) :
+  """Parse the command line description of the targets to be monitored.
+
+  Each argument is either 'project:target' (either of which may be a NATS
+  '*' wildcard) or a project name which matches all of its targets. For
+  compatibility with the original 'project target' arguments, exactly two
+  arguments without any ':' are taken to be one project and its target
+  (so two whole projects must be given as 'project1: project2:').
+  Otherwise each argument is parsed on its own. Returns a list of
+  (project, target) pairs."""
+
+  if allTargets : return [ ('*', '*') ]
+  if len(targetArgs) == 2 and not any(':' in anArg for anArg in targetArgs) :
+    return [ (targetArgs[0], targetArgs[1]) ]
+  targets = []
+  for anArg in targetArgs :
+    aProject, _, aTarget = anArg.partition(':')
+    aProjectTarget = (aProject or '*', aTarget or '*')
+    if aProjectTarget not in targets : targets.append(aProjectTarget)
+  return targets
+
+class BuildMonitor :
+  """Echo (and record the completion of) the build messages of a
+  collection of (project, target) pairs."""
+
+  def __init__(self, targets, prefixOutput=None, capture=None,
+    output=None, timings=None) :
+    self.targets   = targets
+    self.capture   = capture
+    self.output    = output
+    self.timings   = timings
+    self.wildcards = any(
+      '*' in aProject or '*' in aTarget for aProject, aTarget in targets
+    )
+    if prefixOutput is None :
+      prefixOutput = self.wildcards or 1 < len(targets)
+    self.prefixOutput = prefixOutput
+    self.completed    = { }
+    self.seen         = set()
+    self.lastMessage  = None
+
+  def subjects(self) :
+    """Return the NATS subjects needed to monitor all of the targets."""
+
+    subjects = []
+    for aProject, aTarget in self.targets :
+      subjects.append(f"logger.{aProject}.{aTarget}")
+      subjects.append(f"*.build.from.*.{aProject}.{aTarget}")
+    return subjects
+
+  def formatMessage(self, theSubject, theMsg, linePrefix="") :
+    """Return the (project, target), the text to be echoed and the retCode
+    (if any) of one message, recording the message in the capture (if
+    any) and the completion of its target."""
+
+    if self.capture is not None : self.capture.append(theSubject, theMsg)
+    msgLines, retCode = formatNatsMessage(theMsg)
+    projectTarget = subjectTarget(theSubject)
+    self.seen.add(projectTarget)
+    self.lastMessage = time.monotonic()
+    if self.timings is not None :
+      self.timings.record(projectTarget, theSubject, retCode)
+    prefix = linePrefix
+    if self.prefixOutput : prefix = prefix+"[{}/{}] ".format(*projectTarget)
+    msgText = ""
+    for aLine in msgLines :
+      if aLine is separator : msgText = msgText+aLine+"\n"
+      else                  : msgText = msgText+prefix+aLine+"\n"
+    if retCode is not None :
+      self.completed[projectTarget] = retCode
+    return projectTarget, msgText, retCode
+
+  def handleMessage(self, theSubject, theMsg, linePrefix="") :
+    """Echo (and record the completion of) one message."""
+
+    projectTarget, msgText, retCode = \
+      self.formatMessage(theSubject, theMsg, linePrefix)
+    if msgText : sys.stdout.write(msgText)
+
+  async def echoMessage(self, aSubject, theSubject, theMsg) :
+    """The NATS callback used for all of the monitored subjects. If there
+    is an output queue, the message is queued for its writer task (so that
+    a slow terminal or pipe does not stall the NATS callbacks)."""
+
+    if self.output is None :
+      self.handleMessage(theSubject, theMsg)
+      return
+    projectTarget, msgText, retCode = self.formatMessage(theSubject, theMsg)
+    if msgText :
+      await self.output.put(projectTarget, msgText, retCode is not None)
+
+  def allCompleted(self, idleTimeout=None) :
+    """Have all of the (explicitly named) targets completed? When any
+    wildcards are being monitored, this is only true (given an
+    idleTimeout) once every target seen so far has completed, and no
+    message has arrived for idleTimeout seconds."""
+
+    if self.wildcards :
+      if idleTimeout is None or self.lastMessage is None : return False
+      if time.monotonic() - self.lastMessage < idleTimeout : return False
+      return all(aTarget in self.completed for aTarget in self.seen)
+    return all(aTarget in self.completed for aTarget in self.targets)
+
+  def reportCompletion(self) :
+    """Report the completion code (if any) of each target."""
+
+    print("Completion:")
+    reported = set()
+    for aProjectTarget in self.targets :
+      if '*' in aProjectTarget[0] or '*' in aProjectTarget[1] : continue
+      reported.add(aProjectTarget)
+      if aProjectTarget in self.completed :
+        print("  {}/{}: completed with code: {}".format(
+          *aProjectTarget, self.completed[aProjectTarget]
+        ))
+      else :
+        print("  {}/{}: not completed".format(*aProjectTarget))
+    for aProjectTarget, retCode in self.completed.items() :
+      if aProjectTarget in reported : continue
+      print("  {}/{}: completed with code: {}".format(*aProjectTarget, retCode))
+
+class OutputQueue :
+  """A bounded queue of the text to be echoed, which is written (in
+  batches) by a writer task using its own thread.
+
+  When the queue is full, the 'block' policy makes the NATS callback wait
+  for space, 'drop-oldest' discards the oldest queued message, and
+  'summarise' discards the new message, counting (per target) the
+  messages coalesced into a summary line (see cpcli.output's
+  outputPolicies). Completion messages are always queued."""
+
+  def __init__(self, maxSize=10000, policy='block', batchSize=1024, out=None) :
+    from concurrent.futures import ThreadPoolExecutor
+
+    self.maxSize   = max(1, maxSize)
+    self.policy    = policy
+    self.batchSize = batchSize
+    self.out       = out if out is not None else sys.stdout
+    self.entries   = collections.deque()
+    self.coalesced = { }
+    self.executor  = ThreadPoolExecutor(max_workers=1)
+    self.queued    = 0
+    self.dropped   = 0
+    self.coalescedTotal = 0
+    self.blocked   = 0
+    self.batches   = 0
+    self.itemsAvailable = None
+    self.spaceAvailable = None
+
+  def events(self) :
+    # the events must be created in the running event loop
+    if self.itemsAvailable is None :
+      import asyncio
+      self.itemsAvailable = asyncio.Event()
+      self.spaceAvailable = asyncio.Event()
+    return self.itemsAvailable, self.spaceAvailable
+
+  async def put(self, projectTarget, msgText, important=False) :
+    itemsAvailable, spaceAvailable = self.events()
+    if self.maxSize <= len(self.entries) and not important :
+      if self.policy == 'summarise' :
+        self.coalesced[projectTarget] = \
+          self.coalesced.get(projectTarget, 0) + 1
+        self.coalescedTotal = self.coalescedTotal + 1
+        return
+      elif self.policy == 'drop-oldest' :
+        for entryIndex, anEntry in enumerate(self.entries) :
+          if not anEntry[1] :
+            del self.entries[entryIndex]
+            self.dropped = self.dropped + 1
+            break
+      else :
+        self.blocked = self.blocked + 1
+        while self.maxSize <= len(self.entries) :
+          spaceAvailable.clear()
+          await spaceAvailable.wait()
+    self.entries.append((msgText, important))
+    self.queued = self.queued + 1
+    itemsAvailable.set()
+
+  def takeBatch(self) :
+    """Remove (and return the text of) the next batch of queued messages,
+    followed by the summary of any coalesced messages."""
+
+    batch = [ ]
+    while self.entries and len(batch) < self.batchSize :
+      batch.append(self.entries.popleft()[0])
+    if self.coalesced and not self.entries :
+      for aProjectTarget, aCount in self.coalesced.items() :
+        batch.append("[{}/{}] ... {} messages coalesced ...\n".format(
+          *aProjectTarget, aCount
+        ))
+      self.coalesced = { }
+    return "".join(batch)
+
+  def writeText(self, text) :
+    self.out.write(text)
+    self.out.flush()
+
+  async def writer(self) :
+    """The writer task: write the queued messages (in batches) until
+    cancelled."""
+
+    import asyncio
+
+    itemsAvailable, spaceAvailable = self.events()
+    loop = asyncio.get_running_loop()
+    while True :
+      await itemsAvailable.wait()
+      itemsAvailable.clear()
+      while self.entries or self.coalesced :
+        text = self.takeBatch()
+        spaceAvailable.set()
+        self.batches = self.batches + 1
+        await loop.run_in_executor(self.executor, self.writeText, text)
+
+  def drain(self) :
+    """Write everything still queued (once the event loop has stopped)."""
+
+    while self.entries or self.coalesced :
+      text = self.takeBatch()
+      self.batches = self.batches + 1
+      self.executor.submit(self.writeText, text)
+    self.executor.shutdown(wait=True)
+
+  def report(self) :
+    """Report how many messages were written, dropped or coalesced."""
+
+    if not (self.dropped or self.coalescedTotal or self.blocked) : return
+    print("Output: {} messages queued in {} batches, {} dropped, {} coalesced, blocked {} times".format(
+      self.queued, self.batches,
+      self.dropped, self.coalescedTotal, self.blocked
+    ))
+
+def latencySummary(someTimes) :
+  """Return the min, median (p50), p95 and max of some times."""
+
+  from cpcli.benchmark import percentile
+  if not someTimes : return { }
+  someTimes = sorted(someTimes)
+  return {
+    'min' : round(someTimes[0], 3),
+    'p50' : round(percentile(someTimes, 0.50), 3),
+    'p95' : round(percentile(someTimes, 0.95), 3),
+    'max' : round(someTimes[-1], 3),
+  }
+
+class BuildTimings :
+  """Record the arrival times of the messages of each monitored target.
+
+  The build subjects ('<phase>.build.from.<source>.<project>.<target>')
+  name the phase of the build each message belongs to. A phase lasts
+  from its first message until the first message of the next phase (or
+  the completion of the build)."""
+
+  def __init__(self) :
+    import time
+    self.clock     = time.monotonic
+    self.startTime = self.clock()
+    self.targets   = { }
+
+  def record(self, projectTarget, theSubject, retCode=None) :
+    now = self.clock()
+    if projectTarget not in self.targets :
+      self.targets[projectTarget] = {
+        'first'    : now,
+        'last'     : now,
+        'messages' : 0,
+        'logLines' : 0,
+        'phases'   : { },
+        'completed': None,
+        'retCode'  : None,
+      }
+    targetTimings = self.targets[projectTarget]
+    targetTimings['last']     = now
+    targetTimings['messages'] = targetTimings['messages'] + 1
+    if theSubject.startswith('logger.') :
+      targetTimings['logLines'] = targetTimings['logLines'] + 1
+    else :
+      aPhase = theSubject.split('.', 1)[0]
+      phases = targetTimings['phases']
+      if aPhase not in phases : phases[aPhase] = { 'start' : now, 'messages' : 0 }
+      phases[aPhase]['messages'] = phases[aPhase]['messages'] + 1
+    if retCode is not None and targetTimings['completed'] is None :
+      targetTimings['completed'] = now
+      targetTimings['retCode']   = retCode
+
+  def summary(self) :
+    """Return the timings of each target (in seconds), together with a
+    latency summary over all of the targets."""
+
+    now = self.clock()
+    targetSummaries  = { }
+    firstMessages    = [ ]
+    buildTimes       = [ ]
+    for aProjectTarget, targetTimings in self.targets.items() :
+      endTime = targetTimings['completed'] or targetTimings['last']
+      firstMessage = targetTimings['first'] - self.startTime
+      firstMessages.append(firstMessage)
+      elapsed = endTime - targetTimings['first']
+      aSummary = {
+        'timeToFirstMessage' : round(firstMessage, 3),
+        'messages'           : targetTimings['messages'],
+        'logLines'           : targetTimings['logLines'],
+        'messagesPerSecond'  : round(
+          targetTimings['messages'] / elapsed, 1
+        ) if 0 < elapsed else None,
+      }
+      if targetTimings['completed'] is not None :
+        aSummary['buildTime'] = round(elapsed, 3)
+        aSummary['retCode']   = targetTimings['retCode']
+        buildTimes.append(elapsed)
+      else :
+        aSummary['buildTime'] = None
+      phases      = sorted(
+        targetTimings['phases'].items(), key=lambda aPhase : aPhase[1]['start']
+      )
+      phaseEnds   = [ aPhase[1]['start'] for aPhase in phases[1:] ] + [ endTime ]
+      aSummary['phases'] = {
+        aPhase : {
+          'start'    : round(phaseTimings['start'] - targetTimings['first'], 3),
+          'duration' : round(phaseEnd - phaseTimings['start'], 3),
+          'messages' : phaseTimings['messages'],
+        } for (aPhase, phaseTimings), phaseEnd in zip(phases, phaseEnds)
+      }
+      targetSummaries["{}/{}".format(*aProjectTarget)] = aSummary
+    return {
+      'elapsed' : round(now - self.startTime, 3),
+      'targets' : targetSummaries,
+      'latency' : {
+        'timeToFirstMessage' : latencySummary(firstMessages),
+        'buildTime'          : latencySummary(buildTimes),
+      }
+    }
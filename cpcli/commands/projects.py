@@ -1,15 +1,15 @@
 # This file contains the projects command which interacts with the
 # MajorDomo's projects interface.
 
-import asyncio
 import click
 import os
 import platform
-import yaml
+import sys
+import time
 
-import cputils.yamlLoader
+from cpcli.output import getRenderer, outputPolicies
 from cpcli.utils import runCommandWithNatsServer, \
-  getDataFromMajorDomo, postDataToMajorDomo
+  getDataFromMajorDomo, postDataToMajorDomo, streamDataFromMajorDomo
 
 def fixUpProjDir(configData, yamlPath, newYamlData) :
   if 'projects' not in newYamlData : return
@@ -21,6 +21,34 @@ def fixUpProjDir(configData, yamlPath, newYamlData) :
     if 'projectDir' not in defaults :
       defaults['projectDir'] = str(yamlPath.parent)
 
+def loadProjects(ctx, projectDir) :
+  """Load all of the project descriptions (.PYML files) found below
+  projectDir. Only new or changed files are parsed, all others are reused
+  from the persistent project index."""
+
+  from cpcli.projectIndex import loadYamlFrom
+  projects = {}
+  index = loadYamlFrom(projects, projectDir, [ '.PYML' ], fixUpProjDir)
+  if 0 < ctx.obj['config'].get('verbosity', 0) :
+    print(f"Parsed {index.parsed} and reused {index.reused} project descriptions")
+  return projects
+
+def printStreamedData(ctx, header, url) :
+  """Print the response from the MajorDomo, using the selected output
+  format, one top level entry at a time as soon as each entry has been
+  received."""
+
+  renderer = getRenderer(ctx.obj['config'])
+  renderer.message(header+"\n")
+  try :
+    renderer.renderStream(streamDataFromMajorDomo(url))
+  except ValueError as err :
+    sys.stderr.write("\nERROR: Invalid response from the MajorDomo\n")
+    sys.stderr.write("  {}\n".format(repr(err)))
+    return
+  renderer.message("\n")
+  renderer.flush()
+
 @click.group(
   short_help="Manage MajorDomo projects.",
   help="Manage MajorDomo projects."
@@ -42,11 +70,105 @@ def registerCommands(theCli) :
 )
 @click.pass_context
 def list(ctx) :
-  print("Listing projects...")
-  data = getDataFromMajorDomo('/projects')
-  print("")
-  print(yaml.dump(data))
-  print("")
+  printStreamedData(ctx, "Listing projects...",
+    '/projects'
+  )
+
+def selectProjects(projects, projectNames, projectDir) :
+  """Return the (selected) project descriptions, ready to be POSTed to
+  the MajorDomo, in the order in which they were found."""
+
+  rsyncHost = platform.node()
+  rsyncUser = os.getlogin()
+  projectsToPost = []
+  if 'projects' in projects :
+    for aProjectName, aProjectDesc in projects['projects'].items() :
+      if projectNames and aProjectName not in projectNames : continue
+      projectsToPost.append({
+        'rsyncHost'   : rsyncHost,
+        'rsyncUser'   : rsyncUser,
+        'projectName' : aProjectName,
+        'projectDir'  : projectDir,
+        'projectDesc' : aProjectDesc
+      })
+  return projectsToPost
+
+def renderPostResults(renderer, postedProjects) :
+  """Render the results of a list of (project, future) pairs in order,
+  as each result becomes available. Returns the number of successes and
+  the list of the names of the projects which failed (a POST fails if
+  its result is None, that is if the request failed or the MajorDomo
+  responded with an error status)."""
+
+  successes = 0
+  failures  = []
+
+  def results() :
+    nonlocal successes
+    for aProject, aFuture in postedProjects :
+      result = aFuture.result()
+      if result is None : failures.append(aProject['projectName'])
+      else              : successes = successes + 1
+      yield result
+
+  renderer.renderEach(results())
+  return successes, failures
+
+def reportPostSummary(renderer, successes, failures, startTime, jobs) :
+  """Report a summary of some concurrent POSTs, but only if more than one
+  job was used or something failed."""
+
+  if jobs <= 1 and not failures : return
+  renderer.message("{} succeeded, {} failed, in {:.2f} seconds (jobs: {})".format(
+    successes, len(failures), time.monotonic() - startTime, max(1, jobs)
+  ))
+  if failures : renderer.message("  Failed: [{}]".format(", ".join(failures)))
+  renderer.flush()
+
+def postProjects(ctx, url, projects, projectNames, projectDir, jobs) :
+  """POST each of the (selected) project descriptions to the MajorDomo,
+  using at most jobs concurrent requests. The results are printed (using
+  the selected output format) in the order in which the projects were
+  found, followed by a summary. Returns False if no projects were
+  found, and exits (with a non-zero status) if any of the POSTs failed."""
+
+  projectsToPost = selectProjects(projects, projectNames, projectDir)
+  if not projectsToPost : return False
+  renderer = getRenderer(ctx.obj['config'])
+
+  from concurrent.futures import ThreadPoolExecutor
+  startTime = time.monotonic()
+  with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor :
+    successes, failures = renderPostResults(renderer, [
+      (aProject, executor.submit(postDataToMajorDomo, url, aProject, True))
+      for aProject in projectsToPost
+    ])
+
+  reportPostSummary(renderer, successes, failures, startTime, jobs)
+  if successes :
+    from cpcli.allowedPaths import refreshAllowedPathsIndex
+    refreshAllowedPathsIndex(ctx.obj['config'])
+  if failures : sys.exit(1)
+  return True
+
+def scanProjectDir(projectDir) :
+  """Load the project descriptions found below projectDir. This is run
+  in a separate process by the setup command, so it returns everything
+  (including any error) in one (picklable) dict."""
+
+  if not os.path.isdir(projectDir) :
+    return { 'error' : "Project directory not found:\n  {}".format(projectDir) }
+
+  from cpcli.projectIndex import loadYamlFrom
+  projects = {}
+  index = loadYamlFrom(projects, projectDir, [ '.PYML' ], fixUpProjDir)
+  return {
+    'projects' : projects,
+    'parsed'   : index.parsed,
+    'reused'   : index.reused
+  }
+
+jobsOptionHelp = "the number of concurrent MajorDomo requests [default: 1]"
 
 @projects.command(
     short_help="add a project.",
@@ -58,35 +180,19 @@ def list(ctx) :
 @click.option('-d', '--projectDir', default=os.getcwd(),
   help="a directory containing a project description yaml file (.pyaml)"
 )
+@click.option('-j', '--jobs', type=int, default=1, help=jobsOptionHelp)
 @click.pass_context
-def add(ctx, projectnames, projectdir) :
+def add(ctx, projectnames, projectdir, jobs) :
 
   if not os.path.isdir(projectdir) :
     print("Project directory not found:\n  {}".format(projectdir))
     return
 
-  projects = {}
-  cputils.yamlLoader.loadYamlFrom(
-    projects, projectdir, [ '.PYML'], fixUpProjDir
-  )
-
-  projectsFound = False
-  if 'projects' in projects :
-    for aProjectName, aProjectDesc in projects['projects'].items() :
-      if projectnames and aProjectName not in projectnames : continue
-      projectsFound = True
-      result = postDataToMajorDomo('/project/add', {
-        'rsyncHost'   : platform.node(),
-        'rsyncUser'   : os.getlogin(),
-        'projectName' : aProjectName,
-        'projectDir'  : projectdir,
-        'projectDesc' : aProjectDesc
-      })
+  projects = loadProjects(ctx, projectdir)
 
-      print("---------------------------------------------------------")
-      print(yaml.dump(result))
-      print("---------------------------------------------------------")
-  if not projectsFound :
+  if not postProjects(ctx,
+    '/project/add', projects, projectnames, projectdir, jobs
+  ) :
     print("No projects found in the directory.")
     if projectnames : print("  Projects:  [{}]".format(projectnames))
     print("  Directory: {}".format(projectdir))
@@ -98,32 +204,16 @@ def add(ctx, projectnames, projectdir) :
 @click.option('-p', '--projectName', multiple=True,
   help="a project name to be updated (default: update all found)"
 )
+@click.option('-j', '--jobs', type=int, default=1, help=jobsOptionHelp)
 @click.pass_context
-def update(ctx, projectname) :
+def update(ctx, projectname, jobs) :
   aProjectDir = os.getcwd()
 
-  projects = {}
-  cputils.yamlLoader.loadYamlFrom(
-    projects, aProjectDir, [ '.PYML'], fixUpProjDir
-  )
-
-  projectsFound = False
-  if 'projects' in projects :
-    for aProjectName, aProjectDesc in projects['projects'].items() :
-      if projectname and aProjectName not in projectname : continue
-      projectsFound = True
-      result = postDataToMajorDomo('/project/update', {
-        'rsyncHost'   : platform.node(),
-        'rsyncUser'   : os.getlogin(),
-        'projectName' : aProjectName,
-        'projectDir'  : aProjectDir,
-        'projectDesc' : aProjectDesc
-      })
+  projects = loadProjects(ctx, aProjectDir)
 
-      print("---------------------------------------------------------")
-      print(yaml.dump(result))
-      print("---------------------------------------------------------")
-  if not projectsFound :
+  if not postProjects(ctx,
+    '/project/update', projects, projectname, aProjectDir, jobs
+  ) :
     print("None of the listed projects have descriptions in this directory.")
 
 @projects.command(
@@ -133,33 +223,113 @@ def update(ctx, projectname) :
 @click.option('-p', '--projectName', multiple=True,
   help="a project name to be updated (default: update all found)"
 )
+@click.option('-j', '--jobs', type=int, default=1, help=jobsOptionHelp)
 @click.pass_context
-def remove(ctx, projectname) :
+def remove(ctx, projectname, jobs) :
   aProjectDir  = os.getcwd()
 
-  projects = {}
-  cputils.yamlLoader.loadYamlFrom(
-    projects, aProjectDir, [ '.PYML'], fixUpProjDir
+  projects = loadProjects(ctx, aProjectDir)
+
+  if not postProjects(ctx,
+    '/project/remove', projects, projectname, aProjectDir, jobs
+  ) :
+    print("None of the listed projects have descriptions in this directory.")
+
+def syncChangedProjects(ctx, renderer, projectDir, knownProjects, jobs) :
+  """Reload the project descriptions below projectDir and POST any new
+  (/project/add) or changed (/project/update) projects to the MajorDomo.
+  knownProjects (project name -> last successfully POSTed project) is
+  updated, so that any failed POSTs are retried on the next scan."""
+
+  projectsToPost = selectProjects(
+    loadProjects(ctx, projectDir), None, projectDir
   )
+  changedProjects = []
+  foundNames      = set()
+  for aProject in projectsToPost :
+    aProjectName = aProject['projectName']
+    foundNames.add(aProjectName)
+    if aProjectName not in knownProjects :
+      changedProjects.append(('/project/add', aProject))
+    elif knownProjects[aProjectName] != aProject :
+      changedProjects.append(('/project/update', aProject))
+  for aProjectName in tuple(knownProjects.keys()) :
+    if aProjectName not in foundNames :
+      renderer.message(f"Project [{aProjectName}] no longer has a description in {projectDir}")
+      del knownProjects[aProjectName]
 
-  projectsFound = False
-  if 'projects' in projects :
-    for aProjectName, aProjectDesc in projects['projects'].items() :
-      if projectname and aProjectName not in projectname : continue
-      projectsFound = True
-      result = postDataToMajorDomo('/project/remove', {
-        'rsyncHost'   : platform.node(),
-        'rsyncUser'   : os.getlogin(),
-        'projectName' : aProjectName,
-        'projectDir'  : aProjectDir,
-        'projectDesc' : aProjectDesc
-      })
+  if not changedProjects : return
+  for aUrl, aProject in changedProjects :
+    renderer.message(f"{aUrl} {aProject['projectName']}")
+  from concurrent.futures import ThreadPoolExecutor
+  startTime = time.monotonic()
+  with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor :
+    successes, failures = renderPostResults(renderer, [
+      (aProject, executor.submit(postDataToMajorDomo, aUrl, aProject, True))
+      for aUrl, aProject in changedProjects
+    ])
+  reportPostSummary(renderer, successes, failures, startTime, jobs)
+  for aUrl, aProject in changedProjects :
+    if aProject['projectName'] not in failures :
+      knownProjects[aProject['projectName']] = aProject
+  if successes :
+    from cpcli.allowedPaths import refreshAllowedPathsIndex
+    refreshAllowedPathsIndex(ctx.obj['config'])
 
-      print("---------------------------------------------------------")
-      print(yaml.dump(result))
-      print("---------------------------------------------------------")
-  if not projectsFound :
-    print("None of the listed projects have descriptions in this directory.")
+@projects.command(
+    short_help="watch project descriptions, updating any which change.",
+    help="Watch the project descriptions below one or more directories, and post any new or changed projects to the MajorDomo."
+)
+@click.option('-d', '--projectDir', multiple=True,
+  help="a directory to watch (default: the current directory)"
+)
+@click.option('--debounce', type=float, default=0.5,
+  help="the seconds to wait for a burst of changes to finish [default: 0.5]"
+)
+@click.option('--poll', is_flag=True, default=False,
+  help="poll for changes rather than using inotify [default: False]"
+)
+@click.option('--interval', type=float, default=2.0,
+  help="the seconds between polls (when polling) [default: 2.0]"
+)
+@click.option('-j', '--jobs', type=int, default=1, help=jobsOptionHelp)
+@click.pass_context
+def watch(ctx, projectdir, debounce, poll, interval, jobs) :
+  from cpcli.fileWatcher import getWatcher
+
+  projectDirs = [ os.path.abspath(aDir) for aDir in projectdir ]
+  if not projectDirs : projectDirs = [ os.getcwd() ]
+  for aDir in projectDirs :
+    if not os.path.isdir(aDir) :
+      print("Project directory not found:\n  {}".format(aDir))
+      return
+
+  renderer = getRenderer(ctx.obj['config'])
+
+  # start with the projects as they are now (use 'projects update' to
+  # make sure the MajorDomo agrees)
+  #
+  knownProjects = { }
+  for aDir in projectDirs :
+    knownProjects[aDir] = { }
+    for aProject in selectProjects(loadProjects(ctx, aDir), None, aDir) :
+      knownProjects[aDir][aProject['projectName']] = aProject
+
+  watcher = getWatcher(projectDirs, [ '.PYML' ],
+    poll=poll, interval=interval, debounce=debounce
+  )
+  renderer.message("Watching ({}) for changes in:\n  {}".format(
+    type(watcher).__name__, "\n  ".join(projectDirs)
+  ))
+  try :
+    while True :
+      for aDir in sorted(watcher.waitForChanges()) :
+        syncChangedProjects(ctx, renderer, aDir, knownProjects[aDir], jobs)
+  except KeyboardInterrupt :
+    print("")
+  finally :
+    watcher.close()
+  print("Done!")
 
 @projects.command(
     short_help="list targets for an existing project.",
@@ -168,11 +338,9 @@ def remove(ctx, projectname) :
 @click.argument('projectName')
 @click.pass_context
 def targets(ctx, projectname) :
-  print("Listing targets...")
-  data = getDataFromMajorDomo(f'/project/targets/{projectname}')
-  print("")
-  print(yaml.dump(data))
-  print("")
+  printStreamedData(ctx, "Listing targets...",
+    f'/project/targets/{projectname}'
+  )
 
 @projects.command(
     short_help="return the definition for an existing project.",
@@ -181,11 +349,9 @@ def targets(ctx, projectname) :
 @click.argument('projectName')
 @click.pass_context
 def definition(ctx, projectname) :
-  print("Project definition...")
-  data = getDataFromMajorDomo(f'/project/definition/{projectname}')
-  print("")
-  print(yaml.dump(data))
-  print("")
+  printStreamedData(ctx, "Project definition...",
+    f'/project/definition/{projectname}'
+  )
 
 @projects.command(
     short_help="build definition for the target of an existing project.",
@@ -195,45 +361,169 @@ def definition(ctx, projectname) :
 @click.argument('target')
 @click.pass_context
 def build(ctx, projectname, target) :
-  print(f"Target build definition... ({projectname}, {target})")
-  data = getDataFromMajorDomo(f'/project/buildTarget/{projectname}/{target}')
-  print("")
-  print(yaml.dump(data))
-  print("")
+  printStreamedData(ctx, f"Target build definition... ({projectname}, {target})",
+    f'/project/buildTarget/{projectname}/{target}'
+  )
 
 async def echoNatsMessages(aSubject, theSubject, theMsg) :
-  if isinstance(theMsg, str) and theMsg[1] != 'D' :
-    print(theMsg.strip("\""))
-  elif isinstance(theMsg, dict) :
-    if 'retCode' in theMsg :
-      print(f"completed with code: {theMsg['retCode']}")
-      print("\n--------------------------------------------------------------------------------\n")
+  from cpcli.buildMonitor import formatNatsMessage
+  msgLines, retCode = formatNatsMessage(theMsg)
+  for aLine in msgLines : print(aLine)
 
 async def monitorBuild(data, config, natsClient) :
-  projectName = data['projectName']
-  target      = data['target']
+  import asyncio
+  buildMonitor = data['monitor']
 
-  await natsClient.listenToSubject(
-    f"logger.{projectName}.{target}", echoNatsMessages
-  )
-  await natsClient.listenToSubject(
-    f"*.build.from.*.{projectName}.{target}", echoNatsMessages
-  )
+  if buildMonitor.output is not None :
+    asyncio.ensure_future(buildMonitor.output.writer())
+
+  for aSubject in buildMonitor.subjects() :
+    await natsClient.listenToSubject(aSubject, buildMonitor.echoMessage)
 
-  waitIndefinitely = asyncio.Event()
-  await waitIndefinitely.wait()
+  capture           = buildMonitor.capture
+  exitWhenCompleted = data.get('exitWhenCompleted', False)
+  if capture is None and not exitWhenCompleted :
+    waitIndefinitely = asyncio.Event()
+    await waitIndefinitely.wait()
+  idleTimeout       = data.get('idleTimeout')
+  while not (exitWhenCompleted and buildMonitor.allCompleted(idleTimeout)) :
+    await asyncio.sleep(0.25)
+    if capture is not None : capture.flushIfDue()
 
 @projects.command(
-    short_help="monitor the build of a target of an existing project.",
-    help="Monitor the build of a target of an existing project"
+    short_help="monitor the builds of targets of existing projects.",
+    help="""Monitor the builds of targets of existing projects.
+
+    Each TARGETS is either 'projectName:target' or a projectName (which
+    monitors all of that project's targets); '*' may be used as a
+    wildcard for either part. For compatibility, exactly two TARGETS
+    without a ':' are taken to be 'projectName target' (use
+    'projectName1: projectName2:' to monitor two whole projects). All
+    targets are monitored over one NATS connection."""
+)
+@click.argument('targets', nargs=-1)
+@click.option('-a', '--all', 'alltargets', is_flag=True, default=False,
+  help="monitor the builds of all targets of all projects"
+)
+@click.option('--capture', 'capturepath', default=None,
+  help="append all of the messages received to this capture file (see 'projects replay')"
+)
+@click.option('--queueSize', type=int, default=10000,
+  help="the number of messages waiting to be echoed before the --whenFull policy applies [default: 10000]"
+)
+@click.option('--whenFull', type=click.Choice(outputPolicies), default='block',
+  help="what to do with a new message when the queue of messages to be echoed is full [default: block]"
+)
+@click.option('--timings', is_flag=True, default=False,
+  help="summarise the timings of each build (on stderr), and stop once all of the targets have completed (see --idle for wildcard targets)"
+)
+@click.option('--idle', type=float, default=30.0,
+  help="with --timings and any wildcard targets, stop once every target seen so far has completed and no message has arrived for this many seconds [default: 30]"
+)
+@click.option('--timingsPath', 'timingspath', default=None,
+  type=click.Path(dir_okay=False, writable=True),
+  help="write the summary of the timings to this file rather than to stderr (implies --timings)"
 )
-@click.argument('projectName')
-@click.argument('target')
 @click.pass_context
-def monitor(ctx, projectname, target) :
-  print(f"Monitoriing the building of... ({projectname}, {target})")
-  runCommandWithNatsServer(
-    { 'projectName' : projectname, 'target' : target},
-    monitorBuild
+def monitor(ctx, targets, alltargets, capturepath, queuesize, whenfull,
+  timings, idle, timingspath) :
+  if not targets and not alltargets :
+    raise click.UsageError("Please provide some targets (or use --all)")
+  from cpcli.buildMonitor import BuildMonitor, BuildTimings, OutputQueue, \
+    parseTargets
+  someTargets  = parseTargets(targets, alltargets)
+  capture      = None
+  if capturepath :
+    from cpcli.buildCapture import CaptureWriter
+    capture = CaptureWriter(capturepath)
+  if timingspath : timings = True
+  buildTimings = None
+  if timings : buildTimings = BuildTimings()
+  output       = OutputQueue(maxSize=queuesize, policy=whenfull)
+  buildMonitor = BuildMonitor(
+    someTargets, capture=capture, output=output, timings=buildTimings
   )
+  print("Monitoriing the building of... {}".format(", ".join(
+    "({}, {})".format(*aTarget) for aTarget in someTargets
+  )))
+  try :
+    runCommandWithNatsServer({
+      'monitor'           : buildMonitor,
+      'exitWhenCompleted' : timings,
+      'idleTimeout'       : idle
+    }, monitorBuild)
+  finally :
+    output.drain()
+    if capture is not None :
+      capture.close()
+      print("Captured {} messages in {} blocks to {}".format(
+        capture.messages, capture.blocks, capturepath
+      ))
+    buildMonitor.reportCompletion()
+    output.report()
+    if buildTimings is not None :
+      # (kept apart from the monitored messages, so that it can be parsed)
+      if timingspath :
+        with open(timingspath, 'w') as timingsFile :
+          getRenderer(ctx.obj['config'], timingsFile).render(buildTimings.summary())
+        print(f"Timings written to {timingspath}")
+      else :
+        sys.stdout.flush()
+        sys.stderr.write("Timings:\n")
+        getRenderer(ctx.obj['config'], sys.stderr).render(buildTimings.summary())
   print("Done!")
+
+@projects.command(
+    short_help="replay the messages captured by 'projects monitor --capture'.",
+    help="""Replay the messages captured by 'projects monitor --capture'.
+
+    Messages are rendered exactly as 'projects monitor' renders them.
+    Times are seconds since the epoch, ISO 8601 date/times, or
+    '+<seconds>' from the start of the capture. Subjects are NATS
+    subjects (which may contain the '*' and '>' wildcards)."""
+)
+@click.argument('capturePath', type=click.Path(exists=True, dir_okay=False))
+@click.option('-s', '--subject', 'subjects', multiple=True,
+  help="only replay messages on this subject (may be repeated)"
+)
+@click.option('--since', default=None,
+  help="only replay messages received at or after this time"
+)
+@click.option('--until', default=None,
+  help="only replay messages received at or before this time"
+)
+@click.option('--timestamps', is_flag=True, default=False,
+  help="prefix each message with the time it was received"
+)
+@click.pass_context
+def replay(ctx, capturepath, subjects, since, until, timestamps) :
+  from cpcli.buildCapture import CaptureReader, anySubjectMatches, \
+    parseCaptureTime
+  from cpcli.buildMonitor import BuildMonitor, subjectTarget
+
+  reader = CaptureReader(capturepath)
+  try :
+    since = parseCaptureTime(since, reader.startTime())
+    until = parseCaptureTime(until, reader.startTime())
+  except ValueError as err :
+    raise click.BadParameter(str(err))
+
+  # prefix the output with each message's project/target exactly when
+  # 'projects monitor' would have done
+  projectTargets = set()
+  for aBlock in reader.selectBlocks(since, until, subjects) :
+    for aSubject in aBlock['subjects'] :
+      if anySubjectMatches(subjects, aSubject) :
+        projectTargets.add(subjectTarget(aSubject))
+  buildMonitor = BuildMonitor(
+    sorted(projectTargets), prefixOutput=(1 < len(projectTargets))
+  )
+  for timestamp, theSubject, theMsg in reader.messages(since, until, subjects) :
+    linePrefix = ""
+    if timestamps :
+      linePrefix = time.strftime(
+        "%Y-%m-%d %H:%M:%S", time.localtime(timestamp)
+      ) + ".{:03d} ".format(int((timestamp % 1) * 1000))
+    buildMonitor.handleMessage(theSubject, theMsg, linePrefix)
+  reader.close()
+  buildMonitor.reportCompletion()
@@ -1,20 +1,52 @@
 # This file contains commands to setup the MajorDomo.
 
-import asyncio
 import click
 import os
-import platform
-import yaml
+import sys
+import time
 
-from cpcli.utils import getDataFromMajorDomo, postDataToMajorDomo
-from cpcli.commands.projects import add
+from cpcli.allowedPaths import refreshAllowedPathsIndex
+from cpcli.output import getRenderer
+from cpcli.utils import postDataToMajorDomo
+from cpcli.commands.projects import scanProjectDir, selectProjects, \
+  renderPostResults, reportPostSummary
+
+def scanExecutor(numDirs, scanJobs) :
+  """Return the executor used to scan the project directories. Scanning
+  (walking and parsing) is CPU bound, so (when there is more than one
+  directory) we use a pool of processes.
+
+  The pool's workers are started while other threads (the pool's own
+  manager thread and the MajorDomo posters) are running, so they are
+  never forked from this process. They are forked from a (single
+  threaded) forkserver which has preloaded the scanning code, or (where
+  there is no forkserver) spawned."""
+
+  from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+  import multiprocessing
+
+  if scanJobs is None : scanJobs = os.cpu_count() or 1
+  scanJobs = min(numDirs, scanJobs)
+  if scanJobs < 2 : return ThreadPoolExecutor(max_workers=1)
+  if 'forkserver' in multiprocessing.get_all_start_methods() :
+    mpContext = multiprocessing.get_context('forkserver')
+    mpContext.set_forkserver_preload([ 'cpcli.commands.projects' ])
+  else :
+    mpContext = multiprocessing.get_context('spawn')
+  return ProcessPoolExecutor(max_workers=scanJobs, mp_context=mpContext)
 
 @click.command(
   short_help="Setup your MajorDomo.",
   help="Setup your MajorDomo."
 )
+@click.option('-j', '--jobs', type=int, default=4,
+  help="the number of concurrent MajorDomo requests [default: 4]"
+)
+@click.option('-s', '--scanJobs', type=int, default=None,
+  help="the number of processes used to scan the project directories [default: number of cpus]"
+)
 @click.pass_context
-def setup(ctx) :
+def setup(ctx, jobs, scanjobs) :
   """Setup your MajorDomo."""
 
   config = ctx.obj
@@ -26,6 +58,61 @@ def setup(ctx) :
   if 'projects' not in setup : setup['projects'] = {}
   projects = setup['projects']
 
-  for aProjDir in projects :
-    print("\nAdding projects in {}".format(aProjDir))
-    ctx.invoke(add, projectnames=None, projectdir=aProjDir)
+  # Scan all of the project directories in parallel, and POST the
+  # projects found in each directory as soon as its scan has completed.
+  #
+  from concurrent.futures import ThreadPoolExecutor, as_completed
+
+  projectDirs = [ aProjDir for aProjDir in projects ]
+  if not projectDirs : return
+  renderer  = getRenderer(config)
+  startTime = time.monotonic()
+  scans     = [ None ] * len(projectDirs)
+  posted    = [ [] for aProjDir in projectDirs ]
+  with scanExecutor(len(projectDirs), scanjobs) as scanners, \
+    ThreadPoolExecutor(max_workers=max(1, jobs)) as posters :
+    scanFutures = { }
+    for dirIndex, aProjDir in enumerate(projectDirs) :
+      scanFutures[scanners.submit(scanProjectDir, aProjDir)] = dirIndex
+    for aFuture in as_completed(scanFutures) :
+      dirIndex = scanFutures[aFuture]
+      aProjDir = projectDirs[dirIndex]
+      try :
+        scans[dirIndex] = aFuture.result()
+      except Exception as err :
+        scans[dirIndex] = { 'error' : repr(err) }
+      if 'error' in scans[dirIndex] : continue
+      for aProject in selectProjects(
+        scans[dirIndex]['projects'], None, aProjDir
+      ) :
+        posted[dirIndex].append((aProject,
+          posters.submit(postDataToMajorDomo, '/project/add', aProject, True)
+        ))
+
+    # Now report the results in the order of the configured directories
+    #
+    successes = 0
+    failures  = []
+    for dirIndex, aProjDir in enumerate(projectDirs) :
+      renderer.message("\nAdding projects in {}".format(aProjDir))
+      aScan = scans[dirIndex]
+      if 'error' in aScan :
+        renderer.message(aScan['error'])
+        continue
+      if 0 < config.get('verbosity', 0) :
+        renderer.message("Parsed {} and reused {} project descriptions".format(
+          aScan['parsed'], aScan['reused']
+        ))
+      if not posted[dirIndex] :
+        renderer.message("No projects found in the directory.")
+        renderer.message("  Directory: {}".format(aProjDir))
+        continue
+      someSuccesses, someFailures = \
+        renderPostResults(renderer, posted[dirIndex])
+      successes = successes + someSuccesses
+      failures.extend(someFailures)
+
+  renderer.message("")
+  reportPostSummary(renderer, successes, failures, startTime, jobs)
+  if successes : refreshAllowedPathsIndex(config)
+  if failures : sys.exit(1)
@@ -0,0 +1,24 @@
+# This file contains the shell command which runs an interactive cpcli
+# shell.
+
+import click
+
+@click.command(
+  short_help="Run an interactive cpcli shell.",
+  help="""Run an interactive cpcli shell, in which any cpcli command can
+  be typed (without the 'cpcli'). The configuration and commands are only
+  loaded once, and the connections to the MajorDomo and the NATS server
+  are kept open for the whole session, so running many commands costs one
+  cpcli startup. Type 'help' for the list of commands, and 'exit' (or
+  Control-D) to leave the shell."""
+)
+@click.pass_context
+def shell(ctx) :
+  from cpcli.shell import runShell
+  rootCtx = ctx.find_root()
+  runShell(rootCtx.command, rootCtx, ctx.obj['config'])
+
+def registerCommands(theCli) :
+  """Register the shell command with the main cli click group command."""
+
+  theCli.add_command(shell)
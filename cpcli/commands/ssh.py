@@ -4,7 +4,6 @@ import asyncio
 import click
 import os
 import platform
-import yaml
 
 from cputils.rsyncFileTransporter import RsyncFileTransporter
 from cpcli.utils import getDataFromMajorDomo, postDataToMajorDomo
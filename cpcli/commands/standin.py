@@ -0,0 +1,88 @@
+# This file contains the standin command which serves a stand-in for a
+# MajorDomo (from recorded fixtures) or records those fixtures.
+
+import click
+import sys
+
+from cpcli.utils import SignalException
+
+defaultStandinSocket = '~/.local/cpmd/standin.socket'
+
+@click.group(
+  short_help="Serve (or record) a stand-in MajorDomo.",
+  help="""Serve a stand-in for a MajorDomo (on a Unix domain socket) from
+  recorded fixtures, or record those fixtures by proxying a real
+  MajorDomo. Point cpcli (using 'socketPath' in a configuration file) or
+  cprsyncctl (using '--socket') at the stand-in's socket to benchmark or
+  test them without the rest of the ComputePods."""
+)
+def standin() :
+  """Click group command used to collect all of the stand-in commands."""
+
+  pass
+
+def registerCommands(theCli) :
+  """Register the standin command with the main cli click group command."""
+
+  theCli.add_command(standin)
+
+def makeServer(*args, **kwargs) :
+  from cpcli.standin import StandinServer
+  try :
+    return StandinServer(*args, **kwargs)
+  except FileExistsError as err :
+    raise click.ClickException(str(err))
+
+def serveForever(server, description) :
+  print(f"{description} on [{server.socketPath}] (Control-C to stop)")
+  sys.stdout.flush()
+  try :
+    server.serve_forever()
+  except (KeyboardInterrupt, SignalException) :
+    pass
+  finally :
+    server.server_close()
+  print(f"\nServed {server.requests} requests")
+
+@standin.command(
+  short_help="serve a stand-in MajorDomo from fixtures.",
+  help="""Serve a stand-in MajorDomo from the FIXTURES file (see the
+  cpcli.standin module for its format)."""
+)
+@click.argument('fixtures', type=click.Path(exists=True, dir_okay=False))
+@click.option('-s', '--socket', 'socketpath', default=defaultStandinSocket,
+  help=f"the Unix domain socket to listen on [default: {defaultStandinSocket}]"
+)
+@click.option('-l', '--latency', type=float, default=None,
+  help="the latency (in seconds) of every response, overriding the fixtures"
+)
+@click.option('-f', '--force', is_flag=True, default=False,
+  help="replace any existing socket (which must NOT be a real MajorDomo's)"
+)
+def serve(fixtures, socketpath, latency, force) :
+  server = makeServer(socketpath, fixtures, latency=latency, force=force)
+  serveForever(server, "Serving {} endpoints from [{}]".format(
+    len(server.exact) + len(server.prefixes), fixtures
+  ))
+
+@standin.command(
+  short_help="record fixtures by proxying a real MajorDomo.",
+  help="""Proxy all requests to the real MajorDomo (at the configured
+  socketPath), recording each request's response (and latency) in the
+  FIXTURES file (which is written when the stand-in stops)."""
+)
+@click.argument('fixtures', type=click.Path(dir_okay=False))
+@click.option('-s', '--socket', 'socketpath', default=defaultStandinSocket,
+  help=f"the Unix domain socket to listen on [default: {defaultStandinSocket}]"
+)
+@click.option('-f', '--force', is_flag=True, default=False,
+  help="replace any existing socket (which must NOT be a real MajorDomo's)"
+)
+@click.pass_context
+def record(ctx, fixtures, socketpath, force) :
+  import os
+  upstream = ctx.obj['config']['socketPath']
+  if os.path.abspath(os.path.expanduser(socketpath)) == upstream :
+    raise click.UsageError("The stand-in can not listen on the MajorDomo's own socket")
+  server   = makeServer(socketpath, fixtures, upstream=upstream, force=force)
+  serveForever(server, f"Recording [{upstream}] into [{fixtures}]")
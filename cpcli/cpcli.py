@@ -3,7 +3,6 @@
 
 import click
 import sys
-import yaml
 
 #######################################################################
 # start by monkey patching click to allow aliased commands
@@ -35,6 +34,8 @@ click.Group.resolve_command = aliased_resolve_command
 
 #######################################################################
 
+from cpcli.lazyGroup import LazyGroup
+from cpcli.output import outputFormats
 from cpcli.utils import loadConfiguration, importCommands
 
 config = loadConfiguration()
@@ -45,7 +46,7 @@ contextSettings = dict(
    }
 )
 
-@click.group(context_settings=contextSettings)
+@click.group(cls=LazyGroup, context_settings=contextSettings)
 @click.option('-c', '--config',
   help="path to an additional configuration file [default: ./cpcli.conf]"
 )
@@ -55,7 +56,11 @@ contextSettings = dict(
 @click.option('-v', '--verbose', count=True,
   help="increase the verbosity [default: 0]"
 )
-def cli(verbose, tester, config) :
-  pass
+@click.option('-o', '--output', type=click.Choice(outputFormats),
+  help="the format used to output results [default: yaml]"
+)
+@click.pass_context
+def cli(ctx, verbose, tester, config, output) :
+  if output : ctx.obj['config']['output'] = output
 
 importCommands(cli)
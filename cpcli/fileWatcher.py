@@ -0,0 +1,175 @@
+"""Watch directory trees for changes to files with given extensions.
+
+On Linux the InotifyWatcher uses the kernel's inotify interface (through
+ctypes, so there are no additional dependencies), which costs nothing
+while nothing changes. Elsewhere (or if inotify is not available) the
+PollingWatcher periodically compares the mtimes and sizes of the files.
+
+Both watchers debounce bursts of changes: waitForChanges only returns
+once no further changes have been seen for 'debounce' seconds. It
+returns the set of (root) directories in which something changed. """
+
+import os
+import select
+import struct
+import time
+
+class PollingWatcher :
+  """Watch directory trees by periodically scanning them."""
+
+  def __init__(self, rootDirs, extensions, interval=2.0, debounce=0.5) :
+    self.rootDirs   = [ os.path.abspath(aDir) for aDir in rootDirs ]
+    self.extensions = extensions
+    self.interval   = interval
+    self.debounce   = debounce
+    self.signatures = { aDir : self.signature(aDir) for aDir in self.rootDirs }
+
+  def signature(self, rootDir) :
+    signature = { }
+    for aRoot, someDirs, someFiles in os.walk(rootDir) :
+      for aFile in someFiles :
+        if os.path.splitext(aFile)[1] not in self.extensions : continue
+        aPath = os.path.join(aRoot, aFile)
+        try :
+          aStat = os.stat(aPath)
+        except FileNotFoundError :
+          continue
+        signature[aPath] = (aStat.st_mtime_ns, aStat.st_size)
+    return signature
+
+  def changedDirs(self) :
+    changed = set()
+    for aDir in self.rootDirs :
+      newSignature = self.signature(aDir)
+      if newSignature != self.signatures[aDir] :
+        self.signatures[aDir] = newSignature
+        changed.add(aDir)
+    return changed
+
+  def waitForChanges(self) :
+    while True :
+      time.sleep(self.interval)
+      changed = self.changedDirs()
+      if not changed : continue
+      # debounce: wait until the changes stop
+      while True :
+        time.sleep(self.debounce)
+        moreChanges = self.changedDirs()
+        if not moreChanges : return changed
+        changed.update(moreChanges)
+
+  def close(self) :
+    pass
+
+# The inotify constants (from <sys/inotify.h>)
+#
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ISDIR       = 0x40000000
+
+watchMask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE \
+  | IN_DELETE | IN_DELETE_SELF | IN_ATTRIB
+
+eventHeader = struct.Struct('iIII')
+
+class InotifyWatcher :
+  """Watch directory trees using the Linux inotify interface."""
+
+  def __init__(self, rootDirs, extensions, debounce=0.5) :
+    import ctypes
+    import ctypes.util
+
+    self.libc = ctypes.CDLL(
+      ctypes.util.find_library('c') or 'libc.so.6', use_errno=True
+    )
+    self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self.fd < 0 :
+      raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+    self.rootDirs   = [ os.path.abspath(aDir) for aDir in rootDirs ]
+    self.extensions = extensions
+    self.debounce   = debounce
+    self.watches    = { }
+    for aDir in self.rootDirs : self.addWatches(aDir, aDir)
+
+  def addWatches(self, aDir, rootDir) :
+    """Watch aDir and (recursively) all of its sub-directories."""
+
+    for aRoot, someDirs, someFiles in os.walk(aDir) :
+      wd = self.libc.inotify_add_watch(
+        self.fd, os.fsencode(aRoot), watchMask
+      )
+      if 0 <= wd : self.watches[wd] = (aRoot, rootDir)
+
+  def readEvents(self, timeout) :
+    """Read the available events (waiting at most timeout seconds, or
+    forever if timeout is None) and return the set of root directories
+    in which a relevant change has occurred."""
+
+    changed = set()
+    readable, _, _ = select.select([ self.fd ], [], [], timeout)
+    if not readable : return changed
+    try :
+      eventData = os.read(self.fd, 65536)
+    except BlockingIOError :
+      return changed
+    offset = 0
+    while offset < len(eventData) :
+      wd, mask, cookie, nameLen = eventHeader.unpack_from(eventData, offset)
+      offset = offset + eventHeader.size
+      aName  = os.fsdecode(
+        eventData[offset:offset+nameLen].rstrip(b'\0')
+      )
+      offset = offset + nameLen
+      if mask & IN_Q_OVERFLOW :
+        # we lost some events... so assume everything has changed
+        changed.update(self.rootDirs)
+        continue
+      if wd not in self.watches : continue
+      aDir, rootDir = self.watches[wd]
+      if mask & IN_IGNORED :
+        del self.watches[wd]
+        continue
+      if mask & IN_ISDIR :
+        if mask & (IN_CREATE | IN_MOVED_TO) :
+          self.addWatches(os.path.join(aDir, aName), rootDir)
+        changed.add(rootDir)
+      elif os.path.splitext(aName)[1] in self.extensions :
+        changed.add(rootDir)
+    return changed
+
+  def waitForChanges(self) :
+    changed = set()
+    while not changed :
+      changed = self.readEvents(None)
+    # debounce: wait until the changes stop
+    while True :
+      startTime   = time.monotonic()
+      moreChanges = set()
+      while time.monotonic() - startTime < self.debounce :
+        moreChanges.update(self.readEvents(self.debounce))
+      if not moreChanges : return changed
+      changed.update(moreChanges)
+
+  def close(self) :
+    os.close(self.fd)
+
+def getWatcher(rootDirs, extensions, poll=False, interval=2.0, debounce=0.5) :
+  """Return an inotify based watcher if possible (and not asked to
+  poll), otherwise a polling watcher."""
+
+  if not poll :
+    try :
+      return InotifyWatcher(rootDirs, extensions, debounce=debounce)
+    except Exception :
+      pass
+  return PollingWatcher(
+    rootDirs, extensions, interval=interval, debounce=debounce
+  )
@@ -1,11 +1,13 @@
 """Subclass the standard http.client.HTTPConnection class to allow
-connections to Unix domain sockets. """
+connections to Unix domain sockets, and provide a pool of keep-alive
+connections to reuse for multiple requests. """
 
 import os
 import socket
 import sys
+import threading
 
-from http.client import HTTPConnection
+from http.client import HTTPConnection, BadStatusLine, CannotSendRequest
 
 class HTTPUnixDomainConnection(HTTPConnection) :
   """Subclass the standard http.client.HTTPConnection class to allow
@@ -25,3 +27,158 @@ class HTTPUnixDomainConnection(HTTPConnection) :
 
     self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
     self.sock.connect(self.socketPath)
+
+# The exceptions which signal that a (reused) keep-alive connection has
+# been closed by the server.
+#
+staleConnectionErrors = (ConnectionError, BadStatusLine, CannotSendRequest)
+
+# Only these requests may be retried once they have been sent, since the
+# server might already have acted on them
+#
+idempotentMethods = ('GET', 'HEAD')
+
+def isClosedByServer(http) :
+  """An idle keep-alive connection should have nothing to read, so if it
+  is readable the server has closed it (or it is otherwise unusable)."""
+
+  import select
+  if http.sock is None : return True
+  try :
+    readable, _, _ = select.select([ http.sock ], [], [], 0)
+  except (OSError, ValueError) :
+    return True
+  return bool(readable)
+
+class HTTPUnixDomainPool :
+  """A (thread safe) pool of keep-alive HTTP/1.1 connections to one Unix
+  domain socket.
+
+  Idle connections are reused for subsequent requests. If the server has
+  closed an idle connection, the request is transparently retried (once)
+  on a new connection, so long as the server can not have acted upon it
+  (it is idempotent, or it could not be sent). The numbers of requests,
+  connections and reconnections are kept for diagnostics. """
+
+  def __init__(self, socketPath, maxIdle=8) :
+    self.socketPath     = os.path.abspath(os.path.expanduser(socketPath))
+    self.maxIdle        = maxIdle
+    self.idle           = []
+    self.lock           = threading.Lock()
+    self.requestCount   = 0
+    self.connectCount   = 0
+    self.reconnectCount = 0
+
+  def acquire(self) :
+    """Return an idle connection (and True) if there is one, otherwise a
+    new connection (and False). Idle connections which the server has
+    already closed are discarded."""
+
+    while True :
+      with self.lock :
+        if not self.idle :
+          self.connectCount = self.connectCount + 1
+          return HTTPUnixDomainConnection(self.socketPath), False
+        http = self.idle.pop()
+      if not isClosedByServer(http) : return http, True
+      http.close()
+
+  def release(self, http) :
+    """Return a connection to the pool (or close it if the pool is full)."""
+
+    with self.lock :
+      if http.sock is not None and len(self.idle) < self.maxIdle :
+        self.idle.append(http)
+        return
+    http.close()
+
+  def sendRequest(self, method, url, body, headers) :
+    """Send an HTTP request and return the connection used together with
+    the (as yet unread) response."""
+
+    with self.lock :
+      self.requestCount = self.requestCount + 1
+    method = method.upper()
+    http, reused = self.acquire()
+    while True :
+      sent = False
+      try :
+        http.request(method, url, body=body, headers=headers)
+        sent = True
+        return http, http.getresponse()
+      except staleConnectionErrors :
+        http.close()
+        if not reused : raise
+        if sent and method not in idempotentMethods : raise
+        # the server closed this idle connection... so try again (once)
+        # on a new connection
+        with self.lock :
+          self.reconnectCount = self.reconnectCount + 1
+          self.connectCount   = self.connectCount + 1
+        http, reused = HTTPUnixDomainConnection(self.socketPath), False
+      except Exception :
+        http.close()
+        raise
+
+  def finishResponse(self, http, response) :
+    if response.will_close : http.close()
+    else                   : self.release(http)
+
+  def request(self, method, url, body=None, headers=None) :
+    """Make an HTTP request and return the response together with its
+    (completely read) body."""
+
+    http, response = self.sendRequest(method, url, body, headers or {})
+    try :
+      responseBody = response.read()
+    except Exception :
+      http.close()
+      raise
+    self.finishResponse(http, response)
+    return response, responseBody
+
+  def stream(self, method, url, body=None, headers=None, chunkSize=65536) :
+    """Make an HTTP request and yield the response body in chunks as they
+    arrive. The connection is only returned to the pool once the whole
+    body has been read."""
+
+    http, response = self.sendRequest(method, url, body, headers or {})
+    try :
+      while True :
+        aChunk = response.read(chunkSize)
+        if not aChunk : break
+        yield aChunk
+    except BaseException :
+      http.close()
+      raise
+    self.finishResponse(http, response)
+
+  def close(self) :
+    """Close all idle connections."""
+
+    with self.lock :
+      idle, self.idle = self.idle, []
+    for http in idle : http.close()
+
+  def stats(self) :
+    """Return the diagnostic counts for this pool."""
+
+    return {
+      'socketPath'     : self.socketPath,
+      'requests'       : self.requestCount,
+      'connects'       : self.connectCount,
+      'reconnects'     : self.reconnectCount,
+      'idleConnections': len(self.idle)
+    }
+
+pools = { }
+poolsLock = threading.Lock()
+
+def getPool(socketPath) :
+  """Return the (per-process) connection pool for socketPath."""
+
+  socketPath = os.path.abspath(os.path.expanduser(socketPath))
+  with poolsLock :
+    if socketPath not in pools :
+      pools[socketPath] = HTTPUnixDomainPool(socketPath)
+    return pools[socketPath]
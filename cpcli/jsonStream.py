@@ -0,0 +1,112 @@
+"""Incrementally decode the top level entries of a (large) JSON document.
+
+MajorDomo responses can be tens of MB of JSON. Rather than reading and
+decoding the whole response in one go, a JsonEntryStream reads the
+response in chunks and yields each top level entry (each key/value pair
+of an object, or each item of an array) as soon as it has been completely
+received. So at most one top level entry (plus one chunk) is held in
+memory at any time. """
+
+import codecs
+import json
+import re
+
+# the characters which matter when scanning JSON text
+#
+inStringChars = re.compile(r'["\\]')
+nestedChars   = re.compile(r'[\[\]{}"]')
+topLevelChars = re.compile(r'[\[\]{}",]')
+
+class JsonEntryStream :
+  """Iterate over the top level entries of a JSON document which arrives
+  as an iterable of (bytes) chunks.
+
+  Iterating yields (key, value) pairs. For a JSON object the keys are the
+  object's keys, for a JSON array the keys are the (integer) indices, and
+  for any other JSON value the one (and only) key is None. Once iteration
+  has started, 'kind' is one of 'object', 'array' or 'scalar' (it remains
+  None if there was no JSON document at all). Malformed JSON raises a
+  ValueError. """
+
+  def __init__(self, chunks) :
+    self.chunks = chunks
+    self.kind   = None
+
+  def __iter__(self) :
+    # The text of the current (incomplete) top level entry which arrived
+    # in earlier chunks is kept as a list of pieces, which are only joined
+    # once the entry is complete, and each chunk is only scanned once, so
+    # decoding is linear in the size of the document (however the chunks
+    # and the entries line up).
+    decoder  = codecs.getincrementaldecoder('utf-8')()
+    pieces   = []
+    depth    = 0
+    inString = False
+    escaped  = False
+    started  = False
+    index    = 0
+    for aChunk in self.chunks :
+      text = decoder.decode(aChunk)
+      if not started :
+        text = text.lstrip()
+        if not text : continue
+        started = True
+        if text[0] == '{'   : self.kind = 'object'
+        elif text[0] == '[' : self.kind = 'array'
+        else                : self.kind = 'scalar'
+        if self.kind != 'scalar' :
+          text  = text[1:]
+          depth = 1
+
+      scanPos    = 0
+      entryStart = 0
+      if escaped and text :
+        # skip the character escaped at the end of the previous chunk
+        scanPos = 1
+        escaped = False
+      while depth and self.kind != 'scalar' :
+        if inString  : pattern = inStringChars
+        elif 1 < depth : pattern = nestedChars
+        else         : pattern = topLevelChars
+        aMatch = pattern.search(text, scanPos)
+        if aMatch is None : break
+        aChar   = aMatch.group()
+        scanPos = aMatch.end()
+        if inString :
+          if aChar == '\\' :
+            if len(text) <= scanPos :
+              # the escaped character is in the next chunk
+              escaped = True
+              break
+            scanPos = scanPos + 1
+          else : inString = False
+        elif aChar == '"' : inString = True
+        elif aChar in '[{' : depth = depth + 1
+        elif aChar in ']}' or aChar == ',' :
+          if aChar != ',' : depth = depth - 1
+          if depth < 1 or aChar == ',' :
+            pieces.append(text[entryStart:scanPos-1])
+            entryText  = ''.join(pieces)
+            pieces     = []
+            entryStart = scanPos
+            if entryText.strip() :
+              yield self.decodeEntry(entryText, index)
+              index = index + 1
+      if entryStart < len(text) : pieces.append(text[entryStart:])
+
+    pieces.append(decoder.decode(b'', final=True))
+    remainder = ''.join(pieces)
+    if self.kind == 'scalar' :
+      yield None, json.loads(remainder)
+    elif not started :
+      # an empty (or failed) response... leave kind as None
+      return
+    elif depth :
+      raise ValueError("Incomplete JSON document")
+    elif remainder.strip() :
+      raise ValueError("Extra data after the JSON document")
+
+  def decodeEntry(self, entryText, index) :
+    if self.kind == 'object' :
+      return next(iter(json.loads('{'+entryText+'}').items()))
+    return index, json.loads(entryText)
@@ -0,0 +1,139 @@
+""" A click group which only imports the python modules providing its
+commands when those commands are actually dispatched.
+
+The names and help of each command found in a commands directory are
+recorded in a small json manifest (under ~/.cache/computePods). So long as
+the python files in that directory have not changed (name, mtime and size),
+the manifest is used instead of importing every module. """
+
+import click
+import json
+import os
+
+from cpcli.yamlCache import cacheDir
+
+manifestDir = os.path.join(cacheDir, 'commandManifests')
+
+class LazyGroup(click.Group) :
+  """A click group which knows the names and short help of its lazily
+  loaded commands up front, but only imports the module which provides a
+  command when that command is requested.
+
+  The (monkey patched) aliased_get_command uses list_commands and
+  orig_get_command, so prefix aliasing continues to work with lazily
+  loaded commands. """
+
+  def __init__(self, *args, **kwargs) :
+    super().__init__(*args, **kwargs)
+    self.lazyCommands = { }
+
+  def addLazyCommand(self, cmdName, cmdHelp, cmdShortHelp, loader) :
+    """Record a command which will be provided by calling the (zero
+    argument) loader the first time the command is requested."""
+
+    self.lazyCommands[cmdName] = {
+      'help'      : cmdHelp,
+      'shortHelp' : cmdShortHelp,
+      'loader'    : loader
+    }
+
+  def loadLazyCommand(self, cmdName) :
+    """Run the loader for a lazy command, and then forget about any lazy
+    commands which the loader has now registered."""
+
+    lazyCmd = self.lazyCommands.pop(cmdName)
+    lazyCmd['loader']()
+    for aCmdName in list(self.lazyCommands.keys()) :
+      if aCmdName in self.commands :
+        del self.lazyCommands[aCmdName]
+
+  def list_commands(self, ctx) :
+    return sorted(set(self.commands.keys()) | set(self.lazyCommands.keys()))
+
+  def orig_get_command(self, ctx, cmdName) :
+    if cmdName not in self.commands and cmdName in self.lazyCommands :
+      self.loadLazyCommand(cmdName)
+    return self.commands.get(cmdName)
+
+  def format_commands(self, ctx, formatter) :
+    """List all commands (and their short help) WITHOUT importing any of
+    the lazily loaded commands."""
+
+    commands = []
+    for aCmdName in self.list_commands(ctx) :
+      if aCmdName in self.commands :
+        aCmd = self.commands[aCmdName]
+      else :
+        lazyCmd = self.lazyCommands[aCmdName]
+        aCmd = click.Command(aCmdName,
+          help=lazyCmd['help'], short_help=lazyCmd['shortHelp']
+        )
+      if aCmd.hidden : continue
+      commands.append((aCmdName, aCmd))
+
+    if commands :
+      limit = formatter.width - 6 - max(len(aCmd[0]) for aCmd in commands)
+      rows = []
+      for aCmdName, aCmd in commands :
+        rows.append((aCmdName, aCmd.get_short_help_str(limit)))
+      with formatter.section("Commands") :
+        formatter.write_dl(rows)
+
+def commandDirSignature(aCommandDir) :
+  """Compute the (name, mtime, size) signature of all of the python
+  modules (and packages) found in aCommandDir."""
+
+  signature = []
+  for anEntry in sorted(os.scandir(aCommandDir), key=lambda e: e.name) :
+    aPath = anEntry.path
+    if anEntry.is_dir() :
+      aPath = os.path.join(aPath, '__init__.py')
+      if not os.path.exists(aPath) : continue
+    elif not anEntry.name.endswith('.py') :
+      continue
+    aStat = os.stat(aPath)
+    signature.append([anEntry.name, aStat.st_mtime_ns, aStat.st_size])
+  return signature
+
+def manifestPathFor(aCommandDir, aPkgPath) :
+  # (we avoid hashlib since it is (relatively) slow to import)
+  manifestKey = f"{aCommandDir}:{aPkgPath}".replace(os.sep, '%')
+  return os.path.join(
+    os.path.expanduser(manifestDir), manifestKey+'.json'
+  )
+
+def loadCommandManifest(aCommandDir, aPkgPath) :
+  """Load the manifest for aCommandDir, returning None if there is no
+  manifest or if the modules in aCommandDir have changed."""
+
+  try :
+    with open(manifestPathFor(aCommandDir, aPkgPath)) as manifestFile :
+      manifest = json.load(manifestFile)
+  except Exception :
+    return None
+  if manifest.get('commandDir') != aCommandDir \
+    or manifest.get('pkgPath') != aPkgPath :
+    return None
+  if manifest.get('signature') != commandDirSignature(aCommandDir) :
+    return None
+  return manifest
+
+def saveCommandManifest(aCommandDir, aPkgPath, modules) :
+  """Save the manifest for aCommandDir. Any failure to write the manifest
+  is ignored, we will simply rebuild it next time."""
+
+  manifest = {
+    'commandDir' : aCommandDir,
+    'pkgPath'    : aPkgPath,
+    'signature'  : commandDirSignature(aCommandDir),
+    'modules'    : modules
+  }
+  manifestPath = manifestPathFor(aCommandDir, aPkgPath)
+  try :
+    os.makedirs(os.path.dirname(manifestPath), exist_ok=True)
+    tmpPath = manifestPath+'.'+str(os.getpid())
+    with open(tmpPath, 'w') as manifestFile :
+      json.dump(manifest, manifestFile)
+    os.replace(tmpPath, manifestPath)
+  except Exception :
+    pass
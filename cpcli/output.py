@@ -0,0 +1,242 @@
+"""The shared output (rendering) layer for cpcli commands.
+
+Results can be rendered as yaml (the default), json, ndjson or a simple
+table, selected using the global '--output' option (or the 'output' key
+in the configuration file). Renderers work on a stream of top level
+entries (see cpcli.jsonStream) so that large results can be rendered as
+they arrive, and write to stdout in large buffered chunks. """
+
+import json
+import sys
+
+outputFormats = [ 'yaml', 'json', 'ndjson', 'table' ]
+
+# The policies for echoing monitored build messages when the queue of
+# messages waiting to be echoed is full (see cpcli.buildMonitor)
+#
+outputPolicies = [ 'block', 'drop-oldest', 'summarise' ]
+
+flushSize = 65536
+
+class Renderer :
+  """The base class of all renderers.
+
+  A renderer is given the kind ('object', 'array', 'scalar' or None if
+  there was no result at all) and the top level entries of a result. The
+  begin, entry and end methods are implemented by each subclass. """
+
+  def __init__(self, out=None) :
+    self.out         = out if out is not None else sys.stdout
+    self.pending     = []
+    self.pendingSize = 0
+
+  def write(self, text) :
+    """Buffer some text, writing it out in large chunks."""
+
+    self.pending.append(text)
+    self.pendingSize = self.pendingSize + len(text)
+    if flushSize <= self.pendingSize : self.flush()
+
+  def flush(self) :
+    if self.pending :
+      self.out.write(''.join(self.pending))
+      self.pending     = []
+      self.pendingSize = 0
+    self.out.flush()
+
+  def message(self, text) :
+    """Print an informational message. These are part of the output for
+    (human readable) yaml, but go to stderr for all other formats so that
+    the output remains machine readable."""
+
+    self.flush()
+    if text.strip() : sys.stderr.write(text+"\n")
+
+  def renderStream(self, entries) :
+    """Render a JsonEntryStream. A ValueError raised by the stream (for
+    malformed JSON) is passed on to the caller."""
+
+    numEntries = 0
+    started    = False
+    try :
+      for aKey, aValue in entries :
+        if not started :
+          self.begin(entries.kind)
+          started = True
+        self.entry(entries.kind, aKey, aValue, numEntries)
+        numEntries = numEntries + 1
+      if not started : self.begin(entries.kind)
+      self.end(entries.kind, numEntries)
+    finally :
+      self.flush()
+
+  def render(self, data) :
+    """Render a complete (already decoded) result."""
+
+    if isinstance(data, dict) :
+      kind, entries = 'object', data.items()
+    elif isinstance(data, list) :
+      kind, entries = 'array', enumerate(data)
+    elif data is None :
+      kind, entries = None, []
+    else :
+      kind, entries = 'scalar', [ (None, data) ]
+
+    self.begin(kind)
+    numEntries = 0
+    for aKey, aValue in entries :
+      self.entry(kind, aKey, aValue, numEntries)
+      numEntries = numEntries + 1
+    self.end(kind, numEntries)
+    self.flush()
+
+  def renderEach(self, results) :
+    """Render each of an iterable of (complete) results, as soon as each
+    is available, as one array."""
+
+    self.begin('array')
+    numEntries = 0
+    for aResult in results :
+      self.entry('array', numEntries, aResult, numEntries)
+      numEntries = numEntries + 1
+      if self.pending : self.flush()
+    self.end('array', numEntries)
+    self.flush()
+
+  def begin(self, kind) :
+    pass
+
+  def entry(self, kind, aKey, aValue, index) :
+    pass
+
+  def end(self, kind, numEntries) :
+    pass
+
+class YamlRenderer(Renderer) :
+  """Render the result using (exactly) the same yaml.dump as cpcli always
+  has. Since yaml.dump sorts the keys of a mapping, the entries of an
+  object are collected and dumped together at its end, while the entries
+  of an array are each dumped as soon as they arrive."""
+
+  def __init__(self, out=None) :
+    super().__init__(out)
+    import yaml
+    self.yaml    = yaml
+    self.entries = None
+
+  def dump(self, data) :
+    self.write(self.yaml.dump(data))
+
+  def message(self, text) :
+    self.write(text+"\n")
+    self.flush()
+
+  def render(self, data) :
+    self.dump(data)
+    self.flush()
+
+  def renderEach(self, results) :
+    for aResult in results :
+      self.write("---------------------------------------------------------\n")
+      self.dump(aResult)
+      self.write("\n---------------------------------------------------------\n")
+      self.flush()
+
+  def begin(self, kind) :
+    self.entries = { }
+
+  def entry(self, kind, aKey, aValue, index) :
+    if kind == 'object'  : self.entries[aKey] = aValue
+    elif kind == 'array' : self.dump([ aValue ])
+    else                 : self.dump(aValue)
+
+  def end(self, kind, numEntries) :
+    if kind == 'object'  : self.dump(self.entries)
+    elif 0 < numEntries  : pass
+    elif kind == 'array' : self.dump([])
+    elif kind is None    : self.dump(None)
+    self.entries = None
+
+class JsonRenderer(Renderer) :
+  """Render the result as one JSON document (without using yaml)."""
+
+  def begin(self, kind) :
+    if kind == 'object'  : self.write('{')
+    elif kind == 'array' : self.write('[')
+
+  def entry(self, kind, aKey, aValue, index) :
+    if 0 < index : self.write(',')
+    if kind == 'object' :
+      self.write("\n"+json.dumps(aKey)+": "+json.dumps(aValue))
+    elif kind == 'array' :
+      self.write("\n"+json.dumps(aValue))
+    else :
+      self.write(json.dumps(aValue))
+
+  def end(self, kind, numEntries) :
+    if kind == 'object'  : self.write("\n}\n" if numEntries else "}\n")
+    elif kind == 'array' : self.write("\n]\n" if numEntries else "]\n")
+    elif kind is None    : self.write("null\n")
+    else                 : self.write("\n")
+
+class NdjsonRenderer(Renderer) :
+  """Render each top level entry as one line of JSON."""
+
+  def entry(self, kind, aKey, aValue, index) :
+    if kind == 'object' : self.write(json.dumps({ aKey : aValue })+"\n")
+    else                : self.write(json.dumps(aValue)+"\n")
+
+class TableRenderer(Renderer) :
+  """Render the top level entries as a simple text table. If every entry
+  is an object, its keys become the table's columns, otherwise the table
+  has one 'value' column. (Since the column widths depend upon all of the
+  entries, a table can not be rendered incrementally.)"""
+
+  def begin(self, kind) :
+    self.rows = []
+
+  def entry(self, kind, aKey, aValue, index) :
+    self.rows.append((aKey, aValue))
+
+  def cell(self, aValue) :
+    if aValue is None : return ''
+    if isinstance(aValue, (dict, list)) :
+      return json.dumps(aValue, separators=(',', ':'))
+    return str(aValue)
+
+  def end(self, kind, numEntries) :
+    if not self.rows : return
+    columns = [ 'value' ]
+    if all(isinstance(aValue, dict) for _, aValue in self.rows) :
+      columns = []
+      for _, aValue in self.rows :
+        for aColumn in aValue.keys() :
+          if aColumn not in columns : columns.append(aColumn)
+      table = [ [ self.cell(aKey) ] + [ self.cell(aValue.get(aColumn))
+        for aColumn in columns ] for aKey, aValue in self.rows ]
+    else :
+      table = [ [ self.cell(aKey), self.cell(aValue) ]
+        for aKey, aValue in self.rows ]
+    keyHeading = 'name' if kind == 'object' else ''
+    table.insert(0, [ keyHeading ] + columns)
+    widths = [ max(len(aRow[i]) for aRow in table)
+      for i in range(len(table[0])) ]
+    for aRow in table :
+      self.write("  ".join(
+        aCell.ljust(aWidth) for aCell, aWidth in zip(aRow, widths)
+      ).rstrip()+"\n")
+
+renderers = {
+  'yaml'   : YamlRenderer,
+  'json'   : JsonRenderer,
+  'ndjson' : NdjsonRenderer,
+  'table'  : TableRenderer,
+}
+
+def getRenderer(config, out=None) :
+  """Return a renderer for the output format selected in the config
+  (default: yaml)."""
+
+  outputFormat = config.get('output', 'yaml')
+  if outputFormat not in renderers : outputFormat = 'yaml'
+  return renderers[outputFormat](out)
@@ -0,0 +1,149 @@
+"""A persistent, incremental index of the project description files found
+in a directory tree.
+
+The projects add, update and remove commands (and setup) load every
+project description (.PYML) file below a directory. In large trees,
+walking and parsing these files dominates the run time. The index keeps
+the parsed (and fixed up) contents of each file, keyed by the file's
+path, mtime, size and content hash, so that only new or modified files
+are parsed again. There is one index (pickle) file per directory, under
+~/.cache/computePods/projectIndex. """
+
+import hashlib
+import os
+import pickle
+import sys
+from pathlib import Path
+from urllib.parse import quote
+
+from cpcli.yamlCache import cacheDir, parseYaml
+
+indexDir = os.path.join(cacheDir, 'projectIndex')
+
+def mergeYamlData(yamlData, newYamlData) :
+  """Deep merge newYamlData into yamlData. Dictionaries are merged key by
+  key, lists are extended and any other value is replaced."""
+
+  for aKey, aValue in newYamlData.items() :
+    if aKey in yamlData :
+      if isinstance(yamlData[aKey], dict) and isinstance(aValue, dict) :
+        mergeYamlData(yamlData[aKey], aValue)
+        continue
+      if isinstance(yamlData[aKey], list) and isinstance(aValue, list) :
+        yamlData[aKey].extend(aValue)
+        continue
+    yamlData[aKey] = aValue
+
+class ProjectIndex :
+  """The persistent index of the yaml files found below one directory."""
+
+  def __init__(self, yamlDir, fixUpName) :
+    self.yamlDir   = os.path.abspath(os.path.expanduser(yamlDir))
+    self.fixUpName = fixUpName
+    self.indexPath = os.path.join(
+      os.path.expanduser(indexDir), quote(self.yamlDir, safe='')+'.pickle'
+    )
+    self.entries   = { }
+    self.dirty     = False
+    self.parsed    = 0
+    self.reused    = 0
+    try :
+      with open(self.indexPath, 'rb') as indexFile :
+        index = pickle.load(indexFile)
+      if index.get('fixUp') == fixUpName :
+        self.entries = index['entries']
+    except Exception :
+      pass
+
+  def load(self, yamlPath, fixUpFunc, yamlData) :
+    """Return the (fixed up) contents of one yaml file, reparsing it only
+    if it has changed since it was last indexed."""
+
+    yamlStat = os.stat(yamlPath)
+    anEntry  = self.entries.get(yamlPath)
+    if anEntry is not None \
+      and anEntry['mtime'] == yamlStat.st_mtime_ns \
+      and anEntry['size']  == yamlStat.st_size :
+      self.reused = self.reused + 1
+      return pickle.loads(anEntry['data'])
+
+    with open(yamlPath, 'rb') as yamlFile :
+      yamlBytes = yamlFile.read()
+    contentHash = hashlib.sha256(yamlBytes).hexdigest()
+    if anEntry is not None and anEntry['hash'] == contentHash :
+      # the file has been touched but NOT changed
+      newYamlData = pickle.loads(anEntry['data'])
+      self.reused = self.reused + 1
+    else :
+      newYamlData = parseYaml(yamlBytes.decode('utf-8'))
+      if not isinstance(newYamlData, dict) : newYamlData = { }
+      if fixUpFunc : fixUpFunc(yamlData, Path(yamlPath), newYamlData)
+      self.parsed = self.parsed + 1
+    self.entries[yamlPath] = {
+      'mtime' : yamlStat.st_mtime_ns,
+      'size'  : yamlStat.st_size,
+      'hash'  : contentHash,
+      'data'  : pickle.dumps(newYamlData)
+    }
+    self.dirty = True
+    return newYamlData
+
+  def prune(self, foundPaths) :
+    """Forget any files which no longer exist."""
+
+    for aPath in list(self.entries.keys()) :
+      if aPath not in foundPaths :
+        del self.entries[aPath]
+        self.dirty = True
+
+  def save(self) :
+    """Save the index (if it has changed). Any failure is ignored."""
+
+    if not self.dirty : return
+    try :
+      os.makedirs(os.path.dirname(self.indexPath), mode=0o700, exist_ok=True)
+      tmpPath = self.indexPath+'.'+str(os.getpid())
+      with open(tmpPath, 'wb') as indexFile :
+        pickle.dump({
+          'fixUp'   : self.fixUpName,
+          'entries' : self.entries
+        }, indexFile, pickle.HIGHEST_PROTOCOL)
+      os.replace(tmpPath, self.indexPath)
+      self.dirty = False
+    except Exception :
+      pass
+
+def findYamlFiles(yamlDir, yamlExtensions) :
+  """Return the (sorted) paths of all files below yamlDir which have one
+  of the yamlExtensions."""
+
+  yamlPaths = []
+  for aRoot, someDirs, someFiles in os.walk(yamlDir) :
+    someDirs.sort()
+    for aFile in sorted(someFiles) :
+      if os.path.splitext(aFile)[1] in yamlExtensions :
+        yamlPaths.append(os.path.join(aRoot, aFile))
+  return yamlPaths
+
+def loadYamlFrom(yamlData, yamlDir, yamlExtensions, fixUpFunc=None) :
+  """Load (and merge into yamlData) all of the yaml files below yamlDir
+  which have one of the yamlExtensions, using (and updating) the
+  persistent index for yamlDir.
+
+  This has the same signature as cputils.yamlLoader.loadYamlFrom, and
+  calls fixUpFunc in the same way, but only when a file is (re)parsed.
+  Returns the ProjectIndex used (so that callers can report on it)."""
+
+  fixUpName = None
+  if fixUpFunc :
+    fixUpName = fixUpFunc.__module__+'.'+fixUpFunc.__qualname__
+  index = ProjectIndex(yamlDir, fixUpName)
+  yamlPaths = findYamlFiles(index.yamlDir, yamlExtensions)
+  for aYamlPath in yamlPaths :
+    try :
+      mergeYamlData(yamlData, index.load(aYamlPath, fixUpFunc, yamlData))
+    except Exception as err :
+      sys.stderr.write(f"Could not load [{aYamlPath}]\n  {repr(err)}\n")
+  index.prune(set(yamlPaths))
+  index.save()
+  return index
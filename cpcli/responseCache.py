@@ -0,0 +1,180 @@
+"""An (opt-in) client side cache of MajorDomo GET responses.
+
+Tools which call 'cpcli projects list' (or targets or definition) in
+tight loops would otherwise make a full round trip (and JSON decode) for
+each call. The cache is enabled by adding a 'responseCache' section to
+the configuration:
+
+    responseCache:
+      ttl: 5                # seconds a response is used without asking
+      versionUrl: /version  # (optional) a cheap MajorDomo version probe
+      maxSize: 16777216     # (optional) the largest response to cache
+
+Responses are kept (one file per url) under
+~/.cache/computePods/responses/<socketPath>/. Once a response is older
+than the ttl it is revalidated, either by comparing the (cheap) version
+probe's response, or by asking the MajorDomo with an If-None-Match
+request (if the response had an ETag). Writes made through
+postDataToMajorDomo invalidate the affected entries. """
+
+import os
+import pickle
+import time
+from urllib.parse import quote
+
+from cpcli.yamlCache import cacheDir
+
+defaultMaxSize = 16*1024*1024
+
+class ResponseCache :
+  """A persistent cache of the GET responses from one MajorDomo."""
+
+  def __init__(self, socketPath, ttl=0, versionUrl=None, maxSize=None) :
+    self.socketPath = socketPath
+    self.ttl        = ttl
+    self.versionUrl = versionUrl
+    self.maxSize    = maxSize if maxSize is not None else defaultMaxSize
+    self.version    = None
+    self.cachePath  = os.path.join(
+      os.path.expanduser(cacheDir), 'responses', quote(socketPath, safe='')
+    )
+
+  def entryPath(self, url) :
+    return os.path.join(self.cachePath, quote(url, safe=''))
+
+  def load(self, url) :
+    try :
+      with open(self.entryPath(url), 'rb') as entryFile :
+        return pickle.load(entryFile)
+    except Exception :
+      return None
+
+  def reusable(self, etag, version) :
+    """Could a response with this etag and version ever be used again
+    (without being fetched again in full)?"""
+
+    return 0 < self.ttl or bool(etag) or version is not None
+
+  def store(self, url, etag, version, body) :
+    """Store a response (if it could ever be reused). Any failure to
+    store it is ignored."""
+
+    if not self.reusable(etag, version) : return
+    entryPath = self.entryPath(url)
+    try :
+      os.makedirs(self.cachePath, mode=0o700, exist_ok=True)
+      tmpPath = entryPath+'.'+str(os.getpid())
+      with open(tmpPath, 'wb') as entryFile :
+        pickle.dump({
+          'storedAt' : time.time(),
+          'etag'     : etag,
+          'version'  : version,
+          'body'     : body
+        }, entryFile, pickle.HIGHEST_PROTOCOL)
+      os.replace(tmpPath, entryPath)
+    except Exception :
+      pass
+
+  def invalidate(self, urlPrefixes) :
+    """Remove all cached responses whose urls start with any of the
+    urlPrefixes."""
+
+    self.version   = None
+    quotedPrefixes = tuple(quote(aPrefix, safe='') for aPrefix in urlPrefixes)
+    try :
+      entryNames = os.listdir(self.cachePath)
+    except FileNotFoundError :
+      return
+    for anEntryName in entryNames :
+      if anEntryName.startswith(quotedPrefixes) :
+        try :
+          os.unlink(os.path.join(self.cachePath, anEntryName))
+        except FileNotFoundError :
+          pass
+
+  def currentVersion(self, pool) :
+    """Return the response of the version probe (at most once per
+    process, or per command in the cpcli shell), or None if there is no
+    version probe."""
+
+    if self.versionUrl is None : return None
+    if self.version is None :
+      response, body = pool.request('GET', self.versionUrl)
+      if response.status == 200 : self.version = body
+    return self.version
+
+  def stream(self, pool, url, chunkSize=65536) :
+    """Yield the body of the response to a GET of url in chunks, using
+    (or revalidating) the cached response where possible. Responses which
+    are larger than maxSize are streamed but not cached."""
+
+    entry = self.load(url)
+    if entry is not None and time.time() - entry['storedAt'] < self.ttl :
+      yield entry['body']
+      return
+
+    version = self.currentVersion(pool)
+    if entry is not None and version is not None \
+      and entry['version'] == version :
+      # (restarting the ttl)
+      if 0 < self.ttl : self.store(url, entry['etag'], version, entry['body'])
+      yield entry['body']
+      return
+
+    headers = { }
+    if entry is not None and entry['etag'] :
+      headers['If-None-Match'] = entry['etag']
+    http, response = pool.sendRequest('GET', url, None, headers)
+    if response.status == 304 and entry is not None :
+      try :
+        response.read()
+      except Exception :
+        http.close()
+        raise
+      pool.finishResponse(http, response)
+      if 0 < self.ttl or entry['version'] != version :
+        self.store(url, entry['etag'], version, entry['body'])
+      yield entry['body']
+      return
+
+    try :
+      etag      = response.getheader('ETag')
+      cacheable = response.status == 200 and self.reusable(etag, version)
+      chunks    = [ ]
+      size      = 0
+      while True :
+        aChunk = response.read(chunkSize)
+        if not aChunk : break
+        if cacheable :
+          size = size + len(aChunk)
+          if self.maxSize < size :
+            cacheable = False
+            chunks    = [ ]
+          else : chunks.append(aChunk)
+        yield aChunk
+    except BaseException :
+      http.close()
+      raise
+    pool.finishResponse(http, response)
+    if cacheable :
+      self.store(url, etag, version, b''.join(chunks))
+
+  def get(self, pool, url) :
+    """Return the (complete) body of the response to a GET of url."""
+
+    return b''.join(self.stream(pool, url))
+
+def projectUrlPrefixes(projectName) :
+  """The url prefixes of all cached responses which might change when a
+  project is added, updated or removed."""
+
+  prefixes = [ '/projects' ]
+  if projectName :
+    prefixes.extend([
+      f'/project/targets/{projectName}',
+      f'/project/definition/{projectName}',
+      f'/project/buildTarget/{projectName}/',
+    ])
+  else :
+    prefixes.append('/project/')
+  return prefixes
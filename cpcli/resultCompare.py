@@ -0,0 +1,146 @@
+"""Compare the result of a yaml test with its expected result.
+
+Expected results (for example build definitions) can be many megabytes,
+and DeepDiff is very slow (and memory hungry) on such values, even when
+they are identical. So the (normalised) values are first compared using
+a (much faster) structural equality which also requires the types to
+match (so 1, 1.0 and True all differ). Only if they differ are the
+differing subtrees located, and DeepDiff is then only run on those
+(small) subtrees, so the verdict is always DeepDiff's: the results only
+differ if DeepDiff finds some difference.
+
+A yaml test can control the comparison using:
+
+    ignorePaths:    # parts of the result which are not compared
+      - projects.*.lastBuilt
+    ignoreOrder: true   # (or a list of paths) lists compared as sets
+
+A path is a dot separated list of keys (or list indices); '*' matches
+any key or index. """
+
+import json
+
+maxDifferences = 20
+
+def splitPath(aPath) :
+  if isinstance(aPath, (list, tuple)) : return [ str(aPart) for aPart in aPath ]
+  return [ aPart for aPart in str(aPath).split('.') if aPart ]
+
+def childPatterns(patterns, aKey) :
+  """Return the remainders of the (non empty) patterns whose first part
+  matches aKey."""
+
+  return [ aPattern[1:] for aPattern in patterns
+    if aPattern and (aPattern[0] == '*' or aPattern[0] == aKey) ]
+
+def canonicalKey(aValue) :
+  """The key used to sort order insensitive lists (which may contain a
+  mixture of types)."""
+
+  if isinstance(aValue, (str, int, float)) :
+    return (type(aValue).__name__, aValue)
+  return ('~', json.dumps(aValue, sort_keys=True, default=repr))
+
+class UnorderedList(list) :
+  """A (normalised) order insensitive list, which (like DeepDiff with
+  ignore_order) compares its items strictly, by both type and value."""
+
+def normalise(aValue, ignorePaths, orderPaths, ignoreAllOrder=False) :
+  """Return aValue without the ignored paths, and with the lists which are
+  order insensitive sorted (canonically) into UnorderedLists. The paths
+  are relative to aValue, and only the parts of aValue which they (might)
+  match are copied."""
+
+  if not (ignorePaths or orderPaths or ignoreAllOrder) : return aValue
+  if isinstance(aValue, dict) :
+    keyValues = aValue.items()
+  elif isinstance(aValue, list) :
+    keyValues = enumerate(aValue)
+  else :
+    return aValue
+  normalised = [ ]
+  for aKey, aSubValue in keyValues :
+    subIgnorePaths = childPatterns(ignorePaths, str(aKey))
+    if [] in subIgnorePaths : continue
+    normalised.append((aKey, normalise(
+      aSubValue, subIgnorePaths,
+      childPatterns(orderPaths, str(aKey)), ignoreAllOrder
+    )))
+  if isinstance(aValue, dict) : return dict(normalised)
+  normalised = [ aSubValue for aKey, aSubValue in normalised ]
+  if ignoreAllOrder or [] in orderPaths :
+    normalised = UnorderedList(sorted(normalised, key=canonicalKey))
+  return normalised
+
+def strictlyEqual(result, expected) :
+  """Structural equality in which the types (of scalars, as well as of
+  containers) must also be equal."""
+
+  if type(result) is not type(expected) : return False
+  if isinstance(result, dict) :
+    if result.keys() != expected.keys() : return False
+    for aKey, aValue in result.items() :
+      if not strictlyEqual(aValue, expected[aKey]) : return False
+    return True
+  if isinstance(result, list) :
+    if len(result) != len(expected) : return False
+    for aValue, anExpected in zip(result, expected) :
+      if not strictlyEqual(aValue, anExpected) : return False
+    return True
+  return result == expected
+
+def differingSubtrees(result, expected, path=(), differences=None) :
+  """Return the (path, result, expected) of (at most maxDifferences of)
+  the smallest subtrees in which result and expected differ."""
+
+  if differences is None : differences = [ ]
+  if maxDifferences <= len(differences) : return differences
+  if isinstance(result, dict) and isinstance(expected, dict) \
+    and result.keys() == expected.keys() :
+    for aKey, aValue in result.items() :
+      if not strictlyEqual(aValue, expected[aKey]) :
+        differingSubtrees(aValue, expected[aKey], path + (str(aKey),), differences)
+    return differences
+  if isinstance(result, list) and isinstance(expected, list) \
+    and len(result) == len(expected) \
+    and not isinstance(result, UnorderedList) :
+    differingItems = [ (anIndex, aValue, expected[anIndex])
+      for anIndex, aValue in enumerate(result)
+      if not strictlyEqual(aValue, expected[anIndex]) ]
+    # DeepDiff compares the scalar items of a list by equality (so, unlike
+    # scalars anywhere else, 1, 1.0 and True are the same list item), so a
+    # list with any differing scalar items is compared as a whole
+    if all(isinstance(aValue, (dict, list)) and isinstance(anExpected, (dict, list))
+      for anIndex, aValue, anExpected in differingItems) :
+      for anIndex, aValue, anExpected in differingItems :
+        differingSubtrees(aValue, anExpected, path + (str(anIndex),), differences)
+      return differences
+  differences.append((path, result, expected))
+  return differences
+
+def compareResults(result, expected, ignorePaths=None, ignoreOrder=None) :
+  """Compare a result with its expected value. Returns a (possibly empty)
+  list of (path, DeepDiff) pairs, one for each subtree in which DeepDiff
+  finds a difference."""
+
+  ignorePaths    = [ splitPath(aPath) for aPath in (ignorePaths or []) ]
+  ignoreAllOrder = ignoreOrder is True
+  orderPaths     = [ ]
+  if ignoreOrder and not ignoreAllOrder :
+    if isinstance(ignoreOrder, str) : ignoreOrder = [ ignoreOrder ]
+    orderPaths = [ splitPath(aPath) for aPath in ignoreOrder ]
+  if ignorePaths or orderPaths or ignoreAllOrder :
+    result   = normalise(result,   ignorePaths, orderPaths, ignoreAllOrder)
+    expected = normalise(expected, ignorePaths, orderPaths, ignoreAllOrder)
+
+  # the fast path...
+  if strictlyEqual(result, expected) : return [ ]
+
+  from deepdiff import DeepDiff
+  diffs = [ ]
+  for aPath, aResult, anExpected in differingSubtrees(result, expected) :
+    aDiff = DeepDiff(aResult, anExpected,
+      ignore_order=(ignoreAllOrder or isinstance(aResult, UnorderedList))
+    )
+    if aDiff : diffs.append(('.'.join(aPath) or '(root)', aDiff))
+  return diffs
@@ -0,0 +1,324 @@
+"""An interactive cpcli shell.
+
+The shell loads the configuration and the commands once, and then
+dispatches each typed command line through the same (root) click group
+as 'cpcli' itself. Everything a command would otherwise have to
+(re)create on each run is kept for the whole session:
+
+  - the (per-process) pool of keep-alive connections to the MajorDomo,
+
+  - one asyncio event loop (running in its own thread), in which all
+    asyncio commands (and tests) are run, together with its asyncio
+    MajorDomo client, and
+
+  - one NATS connection, made the first time a command needs it.
+
+When a command finishes (or is interrupted using Control-C), it is
+unsubscribed from all of its NATS subjects, and any tasks it started are
+cancelled. (If the NATS client can not remove a subscription, the
+connection is closed, and remade by the next command which needs it.)
+
+Lines are edited (with history and tab completion of commands and
+options) using readline, when it is available. """
+
+import os
+import shlex
+import sys
+import threading
+
+from cpcli.yamlCache import cacheDir
+
+historyPath = os.path.join(cacheDir, 'cpcliShellHistory')
+historyLength = 1000
+
+class CommandNatsClient :
+  """Wraps the session's NatsClient for one command, keeping track of the
+  subscriptions the command makes, so that they can all be removed once
+  the command has finished."""
+
+  def __init__(self, natsClient) :
+    self.natsClient    = natsClient
+    self.subscriptions = [ ]
+    self.finished      = False
+
+  async def listenToSubject(self, aSubject, aCallback) :
+    async def commandCallback(*args, **kwargs) :
+      if self.finished : return
+      await aCallback(*args, **kwargs)
+    aSubscription = \
+      await self.natsClient.listenToSubject(aSubject, commandCallback)
+    self.subscriptions.append((aSubject, aSubscription))
+    return aSubscription
+
+  async def unsubscribeAll(self) :
+    """Unsubscribe from all of the command's subjects. Returns False if
+    some subscription could not be removed (in which case the connection
+    itself must be closed to remove it)."""
+
+    self.finished = True
+    allRemoved = True
+    subscriptions, self.subscriptions = self.subscriptions, [ ]
+    for aSubject, aSubscription in subscriptions :
+      if not hasattr(aSubscription, 'unsubscribe') :
+        allRemoved = False
+        continue
+      try :
+        await aSubscription.unsubscribe()
+      except Exception as err :
+        sys.stderr.write(f"Could not unsubscribe from [{aSubject}]: {repr(err)}\n")
+        allRemoved = False
+    return allRemoved
+
+  async def closeConnection(self) :
+    # the session's connection is closed when the session ends
+    pass
+
+  def __getattr__(self, anAttr) :
+    return getattr(self.natsClient, anAttr)
+
+class ShellSession :
+  """The event loop, and the connections, shared by all of the commands
+  run in one shell session."""
+
+  def __init__(self) :
+    import asyncio
+    self.loop        = asyncio.new_event_loop()
+    self.loopThread  = threading.Thread(target=self.loop.run_forever, daemon=True)
+    self.loopThread.start()
+    self.natsClient  = None
+    self.natsLock    = None
+    self.sessionTasks = set()
+
+  async def getNatsClient(self) :
+    """Return the session's NATS connection (connecting if needed)."""
+
+    import asyncio
+    from cpcli.utils import connectToNatsServer
+    if self.natsLock is None : self.natsLock = asyncio.Lock()
+    async with self.natsLock :
+      if self.natsClient is None :
+        tasksBefore = asyncio.all_tasks()
+        self.natsClient = await connectToNatsServer()
+        # the connection's own tasks must outlive this command
+        self.sessionTasks.update(asyncio.all_tasks() - tasksBefore)
+    return self.natsClient
+
+  async def runInLoop(self, aCoroutine, commandDone) :
+    import asyncio
+    tasksBefore = asyncio.all_tasks()
+    try :
+      return await aCoroutine
+    finally :
+      # cancel any tasks the command left running
+      # (as asyncio.run would when its loop closes)
+      newTasks = asyncio.all_tasks() - tasksBefore - self.sessionTasks
+      for aTask in newTasks : aTask.cancel()
+      if newTasks : await asyncio.gather(*newTasks, return_exceptions=True)
+      commandDone.set()
+
+  def run(self, aCoroutine) :
+    """Run aCoroutine in the session's event loop (in place of
+    asyncio.run), returning its result. A KeyboardInterrupt cancels the
+    coroutine (waiting for it to finish) before being re-raised."""
+
+    import asyncio
+    commandDone = threading.Event()
+    future = asyncio.run_coroutine_threadsafe(
+      self.runInLoop(aCoroutine, commandDone), self.loop
+    )
+    try :
+      return future.result()
+    except KeyboardInterrupt :
+      future.cancel()
+      # (a coroutine cancelled before it started never sets commandDone)
+      commandDone.wait(10)
+      raise
+
+  def runNatsCommand(self, data, config, commandMethod) :
+    """Run an asyncio (NATS) command, using the session's NATS
+    connection."""
+
+    async def runCommand() :
+      natsClient = CommandNatsClient(await self.getNatsClient())
+      try :
+        await commandMethod(data, config, natsClient)
+      finally :
+        if not await natsClient.unsubscribeAll() :
+          # the only way to remove these subscriptions is to reconnect
+          # (the next time a command needs NATS)
+          await self.closeNatsClient()
+    self.run(runCommand())
+
+  async def closeNatsClient(self) :
+    import asyncio
+    natsClient, self.natsClient = self.natsClient, None
+    if natsClient is not None : await natsClient.closeConnection()
+    sessionTasks, self.sessionTasks = self.sessionTasks, set()
+    for aTask in sessionTasks : aTask.cancel()
+    if sessionTasks : await asyncio.gather(*sessionTasks, return_exceptions=True)
+
+  def close(self) :
+    """Close the session's connections and stop its event loop."""
+
+    import asyncio
+    from cpcli.httpUnixDomainClient import pools
+    from cpcli.utils import closeAsyncMajorDomoClient
+
+    async def closeConnections() :
+      await closeAsyncMajorDomoClient()
+      await self.closeNatsClient()
+      otherTasks = asyncio.all_tasks() - { asyncio.current_task() }
+      for aTask in otherTasks : aTask.cancel()
+      if otherTasks : await asyncio.gather(*otherTasks, return_exceptions=True)
+    try :
+      asyncio.run_coroutine_threadsafe(closeConnections(), self.loop).result(10)
+    except Exception as err :
+      sys.stderr.write(f"Could not close the session's connections: {repr(err)}\n")
+    self.loop.call_soon_threadsafe(self.loop.stop)
+    self.loopThread.join(10)
+    for aPool in pools.values() : aPool.close()
+
+def commandCompletions(rootCommand, ctx, words, incomplete) :
+  """Return the sub-commands (or, for an incomplete word starting with
+  '-', the options) of the command named by words which start with
+  incomplete. Lazily loaded sub-commands are only imported once they
+  have been typed in full."""
+
+  import click
+  aCommand = rootCommand
+  for aWord in words :
+    if aWord.startswith('-') or not isinstance(aCommand, click.Group) : continue
+    subCommand = aCommand.get_command(ctx, aWord)
+    if subCommand is None : break
+    aCommand = subCommand
+  if incomplete.startswith('-') :
+    candidates = [ '--help' ]
+    for aParam in aCommand.params :
+      if isinstance(aParam, click.Option) :
+        candidates.extend(aParam.opts + aParam.secondary_opts)
+  elif isinstance(aCommand, click.Group) :
+    candidates = aCommand.list_commands(ctx)
+  else :
+    return [ ]
+  return sorted(set(
+    aCandidate for aCandidate in candidates if aCandidate.startswith(incomplete)
+  ))
+
+def setupReadline(rootCommand, ctx) :
+  """Setup (if possible) the shell's history and completion. Returns the
+  readline module (or None if it is not available)."""
+
+  try :
+    import readline
+  except ImportError :
+    return None
+
+  matches = [ ]
+  def completer(incomplete, state) :
+    nonlocal matches
+    if state == 0 :
+      lineSoFar = readline.get_line_buffer()[:readline.get_begidx()]
+      try :
+        matches = commandCompletions(
+          rootCommand, ctx, shlex.split(lineSoFar), incomplete
+        )
+      except Exception :
+        matches = [ ]
+    if state < len(matches) : return matches[state]+' '
+    return None
+
+  readline.set_completer(completer)
+  readline.set_completer_delims(" \t\n")
+  if 'libedit' in (readline.__doc__ or '') :
+    readline.parse_and_bind("bind ^I rl_complete")
+  else :
+    readline.parse_and_bind("tab: complete")
+  readline.set_history_length(historyLength)
+  try :
+    readline.read_history_file(os.path.expanduser(historyPath))
+  except OSError :
+    pass
+  return readline
+
+def saveHistory(readline) :
+  if readline is None : return
+  try :
+    os.makedirs(os.path.dirname(os.path.expanduser(historyPath)), exist_ok=True)
+    readline.write_history_file(os.path.expanduser(historyPath))
+  except OSError as err :
+    sys.stderr.write(f"Could not save the shell's history: {repr(err)}\n")
+
+def runCommandLine(rootCommand, config, cmdArgs) :
+  """Dispatch one (split) command line through the root click group, as
+  if it had been typed after 'cpcli'. Returns the command's exit code."""
+
+  import click
+  import copy
+  from cpcli import utils
+
+  # each command gets its own (deep) copy of the configuration, which is
+  # also (temporarily) the configuration used by cpcli.utils, so that
+  # options such as '--output' only apply to that command
+  commandConfig = copy.deepcopy(config)
+  sessionConfig, utils.config = utils.config, commandConfig
+  # (re)probe the MajorDomo's version before trusting any cached responses
+  if utils.responseCache is not None : utils.responseCache.version = None
+  try :
+    rootCommand.main(
+      args=cmdArgs, prog_name='cpcli', standalone_mode=False,
+      obj={ 'config' : commandConfig }
+    )
+  except click.exceptions.ClickException as err :
+    err.show()
+    return err.exit_code
+  except click.exceptions.Abort :
+    print("Aborted!")
+    return 1
+  except SystemExit as err :
+    return err.code if isinstance(err.code, int) else 1
+  finally :
+    utils.config = sessionConfig
+  return 0
+
+def runShell(rootCommand, ctx, config) :
+  """Read and dispatch command lines until 'exit', 'quit' or end of
+  file."""
+
+  from cpcli import utils
+
+  session = ShellSession()
+  utils.shellSession = session
+  readline = setupReadline(rootCommand, ctx)
+  print("cpcli shell: type a cpcli command (without 'cpcli'), 'help' or 'exit'")
+  try :
+    while True :
+      try :
+        aLine = input('cpcli> ')
+      except EOFError :
+        print("")
+        break
+      except KeyboardInterrupt :
+        print("")
+        continue
+      try :
+        cmdArgs = shlex.split(aLine)
+      except ValueError as err :
+        print(f"Could not parse the command: {err}")
+        continue
+      if not cmdArgs : continue
+      if cmdArgs[0] in [ 'exit', 'quit' ] : break
+      if cmdArgs[0] == 'help' : cmdArgs = cmdArgs[1:] + [ '--help' ]
+      if cmdArgs[0] == 'shell' :
+        print("You are already in the cpcli shell")
+        continue
+      try :
+        exitCode = runCommandLine(rootCommand, config, cmdArgs)
+        if exitCode : print(f"(exit code {exitCode})")
+      except KeyboardInterrupt :
+        print("\nInterrupted")
+      except Exception as err :
+        print(f"The command failed: {repr(err)}")
+  finally :
+    saveHistory(readline)
+    utils.shellSession = None
+    session.close()
@@ -0,0 +1,248 @@
+"""A stand-in for a MajorDomo, served (over a Unix domain socket) from
+recorded fixtures.
+
+The fixtures file (yaml, or JSON if its name ends in '.json') lists the
+responses to serve:
+
+    defaultLatency: 0.002      # (optional) seconds added to each response
+    endpoints:
+      - method: GET
+        url: /projects         # a url ending in '*' matches any suffix
+        status: 200
+        body: { ... }          # the (JSON) body of the response
+        latency: 0.010         # (optional) overrides defaultLatency
+        payloadSize: 1048576   # (optional) pad the body to (about) this
+                               # many bytes
+
+A dict body is padded with synthetic 'standin-NNNNNNN' entries (so a
+padded '/projects' response simply lists more projects), and a list body
+by repeating its elements. Requests which match no endpoint get a 404.
+
+In recording mode the stand-in forwards every request to a real
+MajorDomo, and records (or updates) the endpoint for each request. The
+fixtures file is written when the stand-in is shut down.
+
+The stand-in refuses to replace an existing socket (which might be the
+real MajorDomo's), unless it is forced to. """
+
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+def loadFixtures(fixturesPath) :
+  """Load a fixtures file, returning an empty set of fixtures if it does
+  not (yet) exist."""
+
+  fixturesPath = os.path.abspath(os.path.expanduser(fixturesPath))
+  if not os.path.exists(fixturesPath) : return { 'endpoints' : [ ] }
+  if fixturesPath.endswith('.json') :
+    with open(fixturesPath) as fixturesFile :
+      fixtures = json.load(fixturesFile)
+  else :
+    from cpcli.yamlCache import loadYamlFile
+    fixtures = loadYamlFile(fixturesPath)
+  if not isinstance(fixtures, dict) : fixtures = { }
+  if not isinstance(fixtures.get('endpoints'), list) :
+    fixtures['endpoints'] = [ ]
+  return fixtures
+
+def saveFixtures(fixturesPath, fixtures) :
+  """Save (atomically) a fixtures file."""
+
+  fixturesPath = os.path.abspath(os.path.expanduser(fixturesPath))
+  tmpPath = fixturesPath+'.'+str(os.getpid())
+  with open(tmpPath, 'w') as fixturesFile :
+    if fixturesPath.endswith('.json') :
+      json.dump(fixtures, fixturesFile, indent=2)
+    else :
+      import yaml
+      yaml.dump(fixtures, fixturesFile,
+        Dumper=getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+      )
+  os.replace(tmpPath, fixturesPath)
+
+def padBody(body, payloadSize) :
+  """Return the encoded body, padded (if possible) to about payloadSize
+  bytes."""
+
+  bodyBytes = json.dumps(body).encode('utf-8')
+  if not payloadSize or payloadSize <= len(bodyBytes) : return bodyBytes
+  if isinstance(body, dict) :
+    padded = dict(body)
+    entryNum = 0
+    size = len(bodyBytes)
+    while size < payloadSize :
+      aKey   = "standin-{:07d}".format(entryNum)
+      aValue = "/nonexistent/standin/{:07d}".format(entryNum)
+      padded[aKey] = aValue
+      size     = size + len(aKey) + len(aValue) + 8
+      entryNum = entryNum + 1
+    return json.dumps(padded).encode('utf-8')
+  if isinstance(body, list) and body :
+    numCopies = payloadSize // max(1, len(bodyBytes)) + 1
+    return json.dumps(body * numCopies).encode('utf-8')
+  return bodyBytes
+
+class Endpoint :
+  """One (pre-encoded) response of the stand-in."""
+
+  def __init__(self, anEndpoint, defaultLatency) :
+    self.method  = anEndpoint.get('method', 'GET').upper()
+    self.url     = anEndpoint['url']
+    self.prefix  = self.url[:-1] if self.url.endswith('*') else None
+    self.status  = anEndpoint.get('status', 200)
+    self.latency = anEndpoint.get('latency', defaultLatency) or 0
+    self.body    = padBody(anEndpoint.get('body'), anEndpoint.get('payloadSize'))
+
+def socketIsLive(socketPath) :
+  """Return True if something is accepting connections on socketPath."""
+
+  aSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try :
+    aSocket.connect(socketPath)
+    return True
+  except OSError :
+    return False
+  finally :
+    aSocket.close()
+
+class StandinServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer) :
+  """A threaded HTTP/1.1 server listening on a Unix domain socket."""
+
+  daemon_threads     = True
+  request_queue_size = 128
+
+  def __init__(self, socketPath, fixturesPath, latency=None, upstream=None,
+    force=False) :
+    self.socketPath   = os.path.abspath(os.path.expanduser(socketPath))
+    self.fixturesPath = fixturesPath
+    self.latency      = latency
+    self.upstream     = None
+    self.lock         = threading.Lock()
+    self.requests     = 0
+    self.recorded     = 0
+    self.ownsSocket   = False
+    self.fixtures     = loadFixtures(fixturesPath)
+    self.recordedEndpoints = {
+      (anEndpoint.get('method', 'GET').upper(), anEndpoint['url']) : anEndpoint
+        for anEndpoint in self.fixtures['endpoints']
+    }
+    self.loadEndpoints()
+    if os.path.exists(self.socketPath) :
+      if not force :
+        raise FileExistsError("[{}] already exists{}; use '--force' to replace it".format(
+          self.socketPath,
+          " (and is accepting connections)" if socketIsLive(self.socketPath) else ""
+        ))
+      os.unlink(self.socketPath)
+    if upstream :
+      from cpcli.httpUnixDomainClient import HTTPUnixDomainPool
+      self.upstream = HTTPUnixDomainPool(upstream, maxIdle=32)
+    os.makedirs(os.path.dirname(self.socketPath), exist_ok=True)
+    super().__init__(self.socketPath, StandinRequestHandler)
+    self.ownsSocket = True
+
+  def loadEndpoints(self) :
+    defaultLatency = self.fixtures.get('defaultLatency', 0)
+    if self.latency is not None : defaultLatency = self.latency
+    self.exact    = { }
+    self.prefixes = [ ]
+    for anEndpoint in self.fixtures['endpoints'] :
+      anEndpoint = Endpoint(anEndpoint, defaultLatency)
+      if self.latency is not None : anEndpoint.latency = self.latency
+      if anEndpoint.prefix is None :
+        self.exact[(anEndpoint.method, anEndpoint.url)] = anEndpoint
+      else :
+        self.prefixes.append(anEndpoint)
+    # match the longest prefixes first
+    self.prefixes.sort(key=lambda anEndpoint : -len(anEndpoint.prefix))
+
+  def findEndpoint(self, method, url) :
+    anEndpoint = self.exact.get((method, url))
+    if anEndpoint is not None : return anEndpoint
+    for anEndpoint in self.prefixes :
+      if anEndpoint.method == method and url.startswith(anEndpoint.prefix) :
+        return anEndpoint
+    return None
+
+  def record(self, method, url, status, body, latency) :
+    """Record (or update) the endpoint for a proxied request. (The
+    fixtures are saved when the stand-in is shut down.)"""
+
+    try :
+      body = json.loads(body)
+    except ValueError :
+      body = body.decode('utf-8', errors='replace')
+    with self.lock :
+      anEndpoint = self.recordedEndpoints.get((method, url))
+      if anEndpoint is None :
+        anEndpoint = { 'method' : method, 'url' : url }
+        self.fixtures['endpoints'].append(anEndpoint)
+        self.recordedEndpoints[(method, url)] = anEndpoint
+      anEndpoint['status']  = status
+      anEndpoint['latency'] = round(latency, 6)
+      anEndpoint['body']    = body
+      self.recorded = self.recorded + 1
+
+  def get_request(self) :
+    aRequest, _ = super().get_request()
+    # BaseHTTPRequestHandler expects a (host, port) client address
+    return aRequest, ('standin', 0)
+
+  def server_close(self) :
+    super().server_close()
+    if self.ownsSocket and os.path.exists(self.socketPath) :
+      os.unlink(self.socketPath)
+    if self.upstream is not None : self.upstream.close()
+    if self.recorded :
+      with self.lock : saveFixtures(self.fixturesPath, self.fixtures)
+
+class StandinRequestHandler(BaseHTTPRequestHandler) :
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, format, *args) :
+    pass
+
+  def sendResponse(self, status, body) :
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def handleRequest(self) :
+    server = self.server
+    body   = None
+    if 'Content-Length' in self.headers :
+      body = self.rfile.read(int(self.headers['Content-Length']))
+    with server.lock : server.requests = server.requests + 1
+
+    if server.upstream is not None :
+      startTime = time.monotonic()
+      try :
+        response, respBody = server.upstream.request(
+          self.command, self.path, body=body
+        )
+      except Exception as err :
+        self.sendResponse(502, json.dumps({ 'error' : repr(err) }).encode('utf-8'))
+        return
+      server.record(self.command, self.path, response.status, respBody,
+        time.monotonic() - startTime)
+      self.sendResponse(response.status, respBody)
+      return
+
+    anEndpoint = server.findEndpoint(self.command, self.path)
+    if anEndpoint is None :
+      self.sendResponse(404, json.dumps({
+        'error' : f"no fixture for {self.command} {self.path}"
+      }).encode('utf-8'))
+      return
+    if anEndpoint.latency : time.sleep(anEndpoint.latency)
+    self.sendResponse(anEndpoint.status, anEndpoint.body)
+
+  do_GET  = handleRequest
+  do_POST = handleRequest
@@ -0,0 +1,216 @@
+"""Run (tester mode) tests concurrently in one event loop.
+
+All of the tests are run as tasks in one event loop, sharing one NATS
+connection (which is only made if some test needs it). At most 'jobs'
+tests run at any one time. Python tests which are not coroutines, and
+yaml tests, are run in threads so that they do not block the event loop.
+
+When more than one test may run at once, everything a test prints is
+collected (using a context variable to identify the test) and printed
+as one block when the test finishes.
+
+The results (including each test's wall clock time) can be written as a
+JUnit XML or JSON report. """
+
+import contextvars
+import sys
+import time
+
+currentOutput = contextvars.ContextVar('currentOutput', default=None)
+
+class OutputRouter :
+  """Replaces sys.stdout, sending anything printed by a test (in any task
+  or thread) to that test's output buffer."""
+
+  def __init__(self, out) :
+    self.out = out
+
+  def write(self, text) :
+    testOutput = currentOutput.get()
+    if testOutput is None : return self.out.write(text)
+    testOutput.append(text)
+    return len(text)
+
+  def flush(self) :
+    if currentOutput.get() is None : self.out.flush()
+
+  def __getattr__(self, name) :
+    return getattr(self.out, name)
+
+def selectShard(tests, shard) :
+  """Return the tests (a sequence of (name, test) pairs) in the i-th of n
+  shards, where shard is 'i/n' (1 <= i <= n). Tests are assigned to
+  shards by their (sorted) names, so every process agrees on the split."""
+
+  try :
+    shardIndex, numShards = [ int(aPart) for aPart in shard.split('/') ]
+  except ValueError :
+    raise ValueError(f"shard [{shard}] is not of the form i/n")
+  if numShards < 1 or shardIndex < 1 or numShards < shardIndex :
+    raise ValueError(f"shard [{shard}] must have 1 <= i <= n")
+  testNames = sorted(aTestName for aTestName, aTest in tests)
+  inShard   = set(testNames[shardIndex-1::numShards])
+  return [ aTest for aTest in tests if aTest[0] in inShard ]
+
+async def runOneTest(testName, testMethod, config, getNatsClient, buffered) :
+  """Run one test and return its result."""
+
+  import asyncio
+  import traceback
+  from cpcli.utils import runYamlTest
+
+  testOutput = None
+  if buffered :
+    testOutput = [ ]
+    currentOutput.set(testOutput)
+  print("\n==========================================================")
+  print(f"running test: {testName}")
+  result    = { 'name' : testName, 'status' : 'passed', 'message' : None }
+  startTime = time.monotonic()
+  try :
+    if callable(testMethod) :
+      if asyncio.iscoroutinefunction(testMethod) :
+        await testMethod(config, await getNatsClient())
+      else :
+        await asyncio.to_thread(testMethod, config)
+    else :
+      passed = await asyncio.to_thread(runYamlTest, testMethod)
+      if passed is None :
+        result['status']  = 'skipped'
+        result['message'] = "nothing to do"
+      elif not passed :
+        result['status']  = 'failed'
+        result['message'] = "the result was not the expected result"
+  except AssertionError as err :
+    result['status']  = 'failed'
+    result['message'] = str(err) or "assertion failed"
+    result['details'] = traceback.format_exc()
+  except Exception as err :
+    result['status']  = 'error'
+    result['message'] = repr(err)
+    result['details'] = traceback.format_exc()
+  result['time'] = round(time.monotonic() - startTime, 4)
+  print(f"test {testName} {result['status']} in {result['time']:.3f} seconds")
+  if testOutput is not None :
+    currentOutput.set(None)
+    result['output'] = "".join(testOutput)
+    sys.stdout.write(result['output'])
+  return result
+
+async def runTestsAsync(tests, config, jobs) :
+  import asyncio
+  from cpcli.utils import closeAsyncMajorDomoClient, connectToNatsServer
+
+  from cpcli.utils import shellSession
+
+  natsClient = None
+  natsLock   = asyncio.Lock()
+
+  async def getNatsClient() :
+    nonlocal natsClient
+    # (the cpcli shell's session keeps its connection open)
+    if shellSession is not None : return await shellSession.getNatsClient()
+    async with natsLock :
+      if natsClient is None : natsClient = await connectToNatsServer()
+    return natsClient
+
+  jobLimit = asyncio.Semaphore(max(1, jobs))
+  buffered = 1 < jobs
+
+  async def runLimitedTest(testName, testMethod) :
+    async with jobLimit :
+      return await runOneTest(
+        testName, testMethod, config, getNatsClient, buffered
+      )
+
+  try :
+    return await asyncio.gather(*[
+      runLimitedTest(testName, testMethod) for testName, testMethod in tests
+    ])
+  finally :
+    if shellSession is None : await closeAsyncMajorDomoClient()
+    if natsClient is not None : await natsClient.closeConnection()
+
+def writeJUnitReport(reportPath, summary, results) :
+  import xml.etree.ElementTree as ET
+
+  testSuites = ET.Element('testsuites')
+  testSuite  = ET.SubElement(testSuites, 'testsuite', {
+    'name'     : 'cpcli',
+    'tests'    : str(summary['tests']),
+    'failures' : str(summary['failed']),
+    'errors'   : str(summary['error']),
+    'skipped'  : str(summary['skipped']),
+    'time'     : f"{summary['time']:.4f}",
+  })
+  for aResult in results :
+    testCase = ET.SubElement(testSuite, 'testcase', {
+      'classname' : 'cpcli',
+      'name'      : aResult['name'],
+      'time'      : f"{aResult['time']:.4f}",
+    })
+    if aResult['status'] in ('failed', 'error', 'skipped') :
+      element = {
+        'failed' : 'failure', 'error' : 'error', 'skipped' : 'skipped'
+      }[aResult['status']]
+      anElement = ET.SubElement(testCase, element, {
+        'message' : aResult['message'] or ''
+      })
+      anElement.text = aResult.get('details')
+    if aResult.get('output') :
+      ET.SubElement(testCase, 'system-out').text = aResult['output']
+  ET.ElementTree(testSuites).write(
+    reportPath, encoding='utf-8', xml_declaration=True
+  )
+
+def writeReport(reportPath, summary, results) :
+  """Write the results as JUnit XML (if reportPath ends in '.xml') or
+  JSON."""
+
+  if reportPath.endswith('.xml') :
+    writeJUnitReport(reportPath, summary, results)
+    return
+  import json
+  with open(reportPath, 'w') as reportFile :
+    json.dump(dict(summary, results=results), reportFile, indent=2)
+    reportFile.write("\n")
+
+def runTests(tests, config, jobs=1, reportPath=None, shard=None) :
+  """Run the tests (a sequence of (name, test) pairs), print a summary,
+  and write a report if requested. Returns True if no test failed."""
+
+  import asyncio
+
+  startTime = time.monotonic()
+  origStdout = sys.stdout
+  sys.stdout = OutputRouter(origStdout)
+  try :
+    from cpcli.utils import shellSession
+    if shellSession is not None :
+      results = shellSession.run(runTestsAsync(tests, config, jobs))
+    else :
+      results = asyncio.run(runTestsAsync(tests, config, jobs))
+  finally :
+    sys.stdout = origStdout
+  summary = {
+    'tests'   : len(results),
+    'passed'  : 0,
+    'failed'  : 0,
+    'error'   : 0,
+    'skipped' : 0,
+    'time'    : round(time.monotonic() - startTime, 4),
+    'jobs'    : jobs,
+    'shard'   : shard,
+  }
+  for aResult in results :
+    summary[aResult['status']] = summary[aResult['status']] + 1
+
+  if 1 < len(results) :
+    print("\n==========================================================")
+    for aResult in sorted(results, key=lambda aResult : -aResult['time']) :
+      print("{:>9.3f}s {:8} {}".format(
+        aResult['time'], aResult['status'], aResult['name']
+      ))
+    print("{tests} tests: {passed} passed, {failed} failed, {error} errors, {skipped} skipped in {time:.3f} seconds".format(**summary))
+  if reportPath : writeReport(reportPath, summary, results)
+  return summary['failed'] == 0 and summary['error'] == 0
@@ -1,22 +1,25 @@
-""" A collection of utilities for cpcli."""
+""" A collection of utilities for cpcli.
+
+NOTE: cpcli.utils is imported before click has even parsed the command
+line, so any of the heavier dependencies (asyncio, deepdiff, the NATS
+client, http.client, pprint, traceback and yaml) are only imported inside
+the functions which actually use them. Please use
+'./scripts/checkImportTime' to check that this remains true. """
 
-import asyncio
 import click
-from deepdiff import DeepDiff
+import functools
 import inspect
 import importlib
 import json
 import logging
 import os
 import pkgutil
-from pprint import pprint
 import signal
 import sys
-import traceback
-import yaml
 
-from cputils.natsClient import NatsClient
-from cpcli.httpUnixDomainClient import HTTPUnixDomainConnection
+from cpcli.lazyGroup import LazyGroup, \
+  loadCommandManifest, saveCommandManifest
+from cpcli.yamlCache import loadYamlFile, saveYamlCache
 
 defaultConfig = {
   'socketPath'  : '~/.local/cpmd/server.socket',
@@ -25,6 +28,10 @@ defaultConfig = {
 
 config = { }
 
+# The cpcli shell's session (see cpcli.shell), if we are in one
+#
+shellSession = None
+
 def loadConfiguration() :
   """Prescan the command line arguments for configuration and verbose
   switches. Load any specified yaml configuration files and turn on
@@ -66,8 +73,7 @@ def loadConfiguration() :
 
   config = defaultConfig
   try :
-    with open(configPath) as configFile :
-      config = yaml.safe_load(configFile.read())
+    config = loadYamlFile(configPath)
     if 0 < verbosity : print(f"Loaded configuration from [{configPath}]")
   except FileNotFoundError :
     if 0 < verbosity : print(f"Could not load configuration from [{configPath}]")
@@ -108,32 +114,93 @@ def loadConfiguration() :
     logging.basicConfig(level=logging.DEBUG)
 
   if 0 < verbosity :
+    import yaml
     print("--------------------------------------------------------------")
     print(yaml.dump(config))
     print("--------------------------------------------------------------")
   return config
 
 loadedTests = { }
+lazyTests   = { }
+
+def registerModuleCommands(theModule, aCommandDir, theCli) :
+  """Register all python based click commands and tests found in an
+  (already imported) module."""
+
+  if hasattr(theModule, 'registerCommands') :
+    theModule.registerCommands(theCli)
+  else :
+    for (aName, anObj) in inspect.getmembers(theModule) :
+      if hasattr(anObj, 'cpTest') :
+        if 0 < config['verbosity'] :
+          print(f"adding test [{aName}] from {aCommandDir}")
+        loadedTests[aName] = anObj
+        continue
+      if isinstance(anObj, click.Command) :
+        if 0 < config['verbosity'] :
+          print(f"adding click command [{aName}] from [{theModule.__name__}]")
+        theCli.add_command(anObj)
+
+def loadPythonModule(aModuleName, aCommandDir, theCli) :
+  """Import a python module and register its click commands and tests."""
+
+  theModule = importlib.import_module(aModuleName)
+  registerModuleCommands(theModule, aCommandDir, theCli)
+
+def loadLazyTests() :
+  """Import any modules which provide (as yet) lazily loaded tests."""
+
+  loaders = []
+  for aLoader in lazyTests.values() :
+    if aLoader not in loaders : loaders.append(aLoader)
+  lazyTests.clear()
+  for aLoader in loaders : aLoader()
 
 def loadPythonCommandsIn(aCommandDir, aPkgPath, theCli) :
   """Load/import all python based click commands found in the aCommandDir
-  directory. """
-
-  for (_, module_name, _) in pkgutil.iter_modules([aCommandDir]) :
-    theModule = importlib.import_module(aPkgPath+'.'+module_name)
-    if hasattr(theModule, 'registerCommands') :
-      theModule.registerCommands(theCli)
-    else :
-      for (aName, anObj) in inspect.getmembers(theModule) :
-        if hasattr(anObj, 'cpTest') :
-          if 0 < config['verbosity'] :
-            print(f"adding test [{aName}] from {aCommandDir}")
-          loadedTests[aName] = anObj
-          continue
-        if isinstance(anObj, click.Command) :
+  directory.
+
+  If theCli is a LazyGroup and there is an up to date manifest for this
+  directory, the commands and tests are only registered by name, and the
+  modules are imported when a command (or test) is actually used.
+  Otherwise all modules are imported and a new manifest is saved. """
+
+  lazyCli = isinstance(theCli, LazyGroup) and config.get('lazyCommands', True)
+  if lazyCli :
+    manifest = loadCommandManifest(aCommandDir, aPkgPath)
+    if manifest is not None :
+      for aModuleName, aModuleDesc in manifest['modules'].items() :
+        aLoader = functools.partial(
+          loadPythonModule, aModuleName, aCommandDir, theCli
+        )
+        for aCmdName, aCmdDesc in aModuleDesc['commands'].items() :
           if 0 < config['verbosity'] :
-            print(f"adding click command [{aName}] from [{aPkgPath}.{module_name}]")
-          theCli.add_command(anObj)
+            print(f"adding lazy click command [{aCmdName}] from [{aModuleName}]")
+          theCli.addLazyCommand(
+            aCmdName, aCmdDesc['help'], aCmdDesc['shortHelp'], aLoader
+          )
+        for aTestName in aModuleDesc['tests'] :
+          lazyTests[aTestName] = aLoader
+      return
+
+  modules = { }
+  for (_, module_name, _) in pkgutil.iter_modules([aCommandDir]) :
+    aModuleName = aPkgPath+'.'+module_name
+    oldCommands = dict(theCli.commands)
+    oldTests    = dict(loadedTests)
+    loadPythonModule(aModuleName, aCommandDir, theCli)
+    newCommands = { }
+    for aCmdName, aCmd in theCli.commands.items() :
+      if oldCommands.get(aCmdName) is not aCmd :
+        newCommands[aCmdName] = {
+          'help'      : aCmd.help,
+          'shortHelp' : aCmd.short_help
+        }
+    newTests = [ aTestName for aTestName, aTest in loadedTests.items()
+      if oldTests.get(aTestName) is not aTest ]
+    modules[aModuleName] = { 'commands' : newCommands, 'tests' : newTests }
+  if lazyCli :
+    saveCommandManifest(aCommandDir, aPkgPath, modules)
 
 def loadYamlCommandsIn(aCommandDir, theCli) :
   """Load all yaml based click command files found in the aCommandDir
@@ -142,9 +209,8 @@ def loadYamlCommandsIn(aCommandDir, theCli) :
   for aFile in os.listdir(aCommandDir) :
     if aFile.endswith('.yaml') :
       try :
-        with open(os.path.join(aCommandDir, aFile)) as yamlCmdFile :
-          yamlCmd = yaml.safe_load(yamlCmdFile.read())
-          if not isinstance(yamlCmd, dict) : yamlCmd = {}
+        yamlCmd = loadYamlFile(os.path.join(aCommandDir, aFile))
+        if not isinstance(yamlCmd, dict) : yamlCmd = {}
       except Exception as err :
         print(repr(err))
         yamlCmd = { }
@@ -169,6 +235,7 @@ def loadYamlCommandsIn(aCommandDir, theCli) :
           epilog=yamlCmd['epilogHelp']
         )
         def yamlCallback(*args, **kwargs) :
+          import yaml
           print(f"Running {yamlCmd['name']}...")
           print("--------------------------------------------------------")
           print(yaml.dump(args))
@@ -213,26 +280,44 @@ def signalHandler(signum, frame) :
 signal.signal(signal.SIGTERM, signalHandler)
 signal.signal(signal.SIGHUP, signalHandler)
 
+def getNatsServerUrl() :
+  """Return the url of the configured NATS server."""
+
+  host = "127.0.0.1"
+  port = 4222
+  if 'natsServer' in config :
+    natsServerConfig = config['natsServer']
+    if 'host' in natsServerConfig : host = natsServerConfig['host']
+    if 'port' in natsServerConfig : port = natsServerConfig['port']
+  return f"nats://{host}:{port}"
+
+async def connectToNatsServer() :
+  """Return a new NatsClient connected to the configured NATS server."""
+
+  from cputils.natsClient import NatsClient
+  natsClient = NatsClient("majorDomo", 10)
+  natsServerUrl = getNatsServerUrl()
+  print(f"connecting to nats server: [{natsServerUrl}]")
+  await natsClient.connectToServers([ natsServerUrl ])
+  return natsClient
+
 def runCommandWithNatsServer(data, commandMethod) :
+  import asyncio
+  import traceback
   if callable(commandMethod)                      :
     if asyncio.iscoroutinefunction(commandMethod) :
       async def runCommand() :
-        natsClient = NatsClient("majorDomo", 10)
-        host = "127.0.0.1"
-        port = 4222
-        if 'natsServer' in config :
-          natsServerConfig = config['natsServer']
-          if 'host' in natsServerConfig : host = natsServerConfig['host']
-          if 'port' in natsServerConfig : port = natsServerConfig['port']
-        natsServerUrl = f"nats://{host}:{port}"
-        print(f"connecting to nats server: [{natsServerUrl}]")
-        await natsClient.connectToServers([ natsServerUrl ])
+        natsClient = await connectToNatsServer()
         try:
           await commandMethod(data, config, natsClient)
         finally:
+          await closeAsyncMajorDomoClient()
           await natsClient.closeConnection()
       try :
-        asyncio.run(runCommand())
+        if shellSession is not None :
+          shellSession.runNatsCommand(data, config, commandMethod)
+        else :
+          asyncio.run(runCommand())
       except SignalException as err :
         print("")
         print("Shutting down: {}".format(str(err)))
@@ -246,63 +331,88 @@ def runCommandWithNatsServer(data, commandMethod) :
   else : print("command MUST be an asyncio coroutine")
 
 def runYamlTest(yamlTest) :
+  """Run a yaml test. Returns None if there is nothing to do, otherwise
+  whether or not the result was the expected result."""
+
   if 'request' not in yamlTest :
     print("No request found in {}.... nothing to do!".format(
       yamlTest['testName']))
-    return
-  request = yamlTest['request']
-  if request is not None and (
-    'method' not in request or 'url' not in request) :
+    return None
+  from cpcli.benchmark import yamlTestRequest
+  try :
+    request = yamlTestRequest(yamlTest)
+  except ValueError as err :
+    print(f"Could not run {yamlTest['testName']}: {err}")
+    return False
+  if request is None :
     print("No method or url specified in request for {}... nothing to do!".format(
       yamlTest['testName']
     ))
-    return
-  result = getDataFromMajorDomo(request['method'], request['url'])
+    return None
+  method, url, body = request
+  if method == 'GET' :
+    result = getDataFromMajorDomo(url)
+  else :
+    result = postDataToMajorDomo(url, yamlTest['request'].get('data'))
 
   if 'expected' in yamlTest :
-    diff   = DeepDiff(result, yamlTest['expected'])
+    from cpcli.resultCompare import compareResults
+    diffs = compareResults(result, yamlTest['expected'],
+      ignorePaths=yamlTest.get('ignorePaths'),
+      ignoreOrder=yamlTest.get('ignoreOrder')
+    )
     print("---------------------------------------------------------------")
-    pprint(diff, indent=2)
+    if diffs :
+      from pprint import pprint
+      for aPath, aDiff in diffs :
+        print(f"{aPath}:")
+        pprint(aDiff, indent=2)
+    else :
+      print("the result is the expected result")
     print("---------------------------------------------------------------")
+    return not diffs
+  return True
 
 def runASingleTest(testName, testMethod) :
-  print("\n==========================================================")
-  print(f"running test: {testName}")
-  if callable(testMethod)                      :
-    if asyncio.iscoroutinefunction(testMethod) :
-      async def runATest() :
-        print("RUNNING A TEST")
-        natsClient = NatsClient("majorDomo", 10)
-        host = "127.0.0.1"
-        port = 4222
-        if 'natsServer' in config :
-          natsServerConfig = config['natsServer']
-          if 'host' in natsServerConfig : host = natsServerConfig['host']
-          if 'port' in natsServerConfig : port = natsServerConfig['port']
-        natsServerUrl = f"nats://{host}:{port}"
-        print(f"connecting to nats server: [{natsServerUrl}]")
-        await natsClient.connectToServers([ natsServerUrl ])
-        try:
-          await testMethod(config, natsClient)
-        finally:
-          await natsClient.closeConnection()
-        print("RAN A TEST")
-      asyncio.run(runATest())
-    else                                  : testMethod(config)
-  else                                    : runYamlTest(testMethod)
+  from cpcli.testRunner import runTests
+  return runTests([ (testName, testMethod) ], config)
 
 def addRunAllTests(theCli) :
   if 'testerMode' in config :
     if 0 < config['verbosity'] :
       print("Adding runAllTests command")
     @theCli.command('runAllTests',
-      help="Run all known tests",
+      help="""Run all known tests.
+
+      All tests share one event loop and (if any of them need it) one
+      NATS connection. Up to JOBS tests are run concurrently (the output
+      of each test is then printed once it has finished). A REPORT whose
+      name ends in '.xml' is written as JUnit XML, otherwise as JSON.""",
       short_help="Run all known tests"
     )
-    def runAllTestsCallback(*args, **kwargs) :
-      sys.argv.remove('runAllTests')
-      for aTestName, aTest in loadedTests.items() :
-        runASingleTest(aTestName, aTest)
+    @click.option('-j', '--jobs', type=int, default=1,
+      help="the number of tests run concurrently [default: 1]"
+    )
+    @click.option('--shard', default=None,
+      help="only run the i-th of n (i/n) shards of the tests"
+    )
+    @click.option('-r', '--report', default=None,
+      help="write a (JUnit XML or JSON) report of the results to this file"
+    )
+    def runAllTestsCallback(jobs, shard, report) :
+      from cpcli.testRunner import runTests, selectShard
+      if 'runAllTests' in sys.argv : sys.argv.remove('runAllTests')
+      loadLazyTests()
+      tests = tuple(loadedTests.items())
+      if shard :
+        try :
+          tests = selectShard(tests, shard)
+        except ValueError as err :
+          raise click.BadParameter(str(err), param_hint="'--shard'")
+      allPassed = runTests(
+        tests, config, jobs=jobs, reportPath=report, shard=shard
+      )
+      if not allPassed : sys.exit(1)
 
 def addRunTest(theCli) :
   if 'testerMode' in config :
@@ -314,11 +424,69 @@ def addRunTest(theCli) :
     )
     @click.argument('testName')
     def runTestCallback(testname) :
+      if testname in lazyTests : loadLazyTests()
       if testname in loadedTests :
-        runASingleTest(testname, loadedTests[testname])
+        if not runASingleTest(testname, loadedTests[testname]) : sys.exit(1)
       else :
         print(f"test [{testname}] not found")
 
+def addBench(theCli) :
+  if 'testerMode' in config :
+    if 0 < config['verbosity'] :
+      print("Adding bench command")
+    @theCli.command('bench',
+      help="""Load test the MajorDomo using the requests of yaml tests.
+
+      The requests of the named yaml tests (or of all yaml tests) are
+      made in turn, by CONCURRENCY concurrent workers, for DURATION
+      seconds (or COUNT requests). The throughput, latencies and error
+      rates are reported using the global '--output' format.""",
+      short_help="Load test the MajorDomo using yaml tests"
+    )
+    @click.argument('testNames', nargs=-1)
+    @click.option('-j', '--concurrency', type=int, default=8,
+      help="the number of concurrent requests [default: 8]"
+    )
+    @click.option('-d', '--duration', type=float, default=10.0,
+      help="the number of seconds to run for [default: 10]"
+    )
+    @click.option('-n', '--count', type=int, default=None,
+      help="the total number of requests to make (instead of a duration)"
+    )
+    def benchCallback(testnames, concurrency, duration, count) :
+      import asyncio
+      from cpcli.benchmark import runBenchmark, yamlTestRequest
+      from cpcli.output import getRenderer
+
+      if any(aTestName in lazyTests for aTestName in testnames) :
+        loadLazyTests()
+      requests = [ ]
+      for aTestName in (testnames or tuple(loadedTests.keys())) :
+        if aTestName not in loadedTests :
+          print(f"test [{aTestName}] not found")
+          continue
+        try :
+          aRequest = yamlTestRequest(loadedTests[aTestName])
+        except ValueError as err :
+          raise click.UsageError(str(err))
+        if aRequest is None :
+          if testnames : print(f"test [{aTestName}] has no request")
+          continue
+        requests.append((aTestName, aRequest))
+      if not requests :
+        print("No yaml test requests to benchmark")
+        sys.exit(1)
+
+      renderer = getRenderer(config)
+      renderer.message("Benchmarking {} requests against [{}]".format(
+        len(requests), config['socketPath']
+      ))
+      benchStats = asyncio.run(runBenchmark(
+        requests, config['socketPath'], concurrency=concurrency,
+        duration=duration, count=count
+      ))
+      renderer.render(benchStats)
+
 def addListTests(theCli) :
   if 'testerMode' in config :
     if 0 < config['verbosity'] :
@@ -328,8 +496,10 @@ def addListTests(theCli) :
       short_help="List all known tests"
     )
     def listTestsCallback(*args, **kwargs) :
-      for aTestName, aTest in loadedTests.items() :
+      for aTestName in loadedTests.keys() :
         print(aTestName)
+      for aTestName in lazyTests.keys() :
+        if aTestName not in loadedTests : print(aTestName)
 
 def importCommands(cli) :
   """Import or load all python or yaml based click commands found in any
@@ -354,30 +524,179 @@ def importCommands(cli) :
     loadYamlCommandsIn(aCommandDir, cli)
   addRunAllTests(cli)
   addRunTest(cli)
+  addBench(cli)
   addListTests(cli)
+  if 'testerMode' in config :
+    # (tests can also be run, sharing connections, from the shell)
+    from cpcli.commands.shell import registerCommands
+    registerCommands(cli)
+  saveYamlCache()
+
+def reportMajorDomoStats() :
+  """Report the diagnostic counts of all MajorDomo connection pools."""
+
+  from cpcli.httpUnixDomainClient import pools
+  for aPool in pools.values() :
+    poolStats = aPool.stats()
+    sys.stderr.write(
+      "MajorDomo [{}]: {} requests, {} connects, {} reconnects\n".format(
+        poolStats['socketPath'], poolStats['requests'],
+        poolStats['connects'],   poolStats['reconnects']
+    ))
+
+def getMajorDomoPool() :
+  """Return the (per-process) pool of keep-alive connections to the
+  MajorDomo at config['socketPath']."""
+
+  from cpcli.httpUnixDomainClient import getPool, pools
+  if not pools and 0 < config.get('verbosity', 0) :
+    import atexit
+    atexit.register(reportMajorDomoStats)
+  return getPool(config['socketPath'])
+
+responseCache = None
+
+def getResponseCache() :
+  """Return the (opt-in) cache of MajorDomo GET responses, or None if the
+  configuration has no 'responseCache' section."""
+
+  global responseCache
+  cacheConfig = config.get('responseCache')
+  if not cacheConfig : return None
+  if responseCache is None :
+    from cpcli.responseCache import ResponseCache
+    if not isinstance(cacheConfig, dict) : cacheConfig = { }
+    responseCache = ResponseCache(config['socketPath'],
+      ttl=cacheConfig.get('ttl', 0),
+      versionUrl=cacheConfig.get('versionUrl'),
+      maxSize=cacheConfig.get('maxSize')
+    )
+  return responseCache
 
 def getDataFromMajorDomo(url) :
   method = 'GET'
   result = None
   try :
-    http = HTTPUnixDomainConnection(config['socketPath'])
-    http.request(method.upper(), url)
-    result = json.loads(http.getresponse().read())
+    theCache = getResponseCache()
+    if theCache is not None :
+      body = theCache.get(getMajorDomoPool(), url)
+    else :
+      _, body = getMajorDomoPool().request(method, url)
+    result = json.loads(body)
   except Exception as err :
     sys.stderr.write("\nERROR: Could not connect to a MajorDomo at [{}]\n".format(config['socketPath']))
     sys.stderr.write("  {}\n".format(repr(err)))
 
   return result
 
-def postDataToMajorDomo(url, data) :
+def streamDataFromMajorDomo(url) :
+  """Return a JsonEntryStream which yields the top level entries of the
+  (GET) response from the MajorDomo as soon as each has been received.
+  Connection errors are reported (as for getDataFromMajorDomo) and simply
+  end the stream."""
+
+  from cpcli.jsonStream import JsonEntryStream
+
+  def responseChunks() :
+    try :
+      theCache = getResponseCache()
+      if theCache is not None :
+        yield from theCache.stream(getMajorDomoPool(), url)
+      else :
+        yield from getMajorDomoPool().stream('GET', url)
+    except Exception as err :
+      sys.stderr.write("\nERROR: Could not connect to a MajorDomo at [{}]\n".format(config['socketPath']))
+      sys.stderr.write("  {}\n".format(repr(err)))
+
+  return JsonEntryStream(responseChunks())
+
+def invalidateResponseCache(url, data) :
+  """Invalidate any cached responses which a POST to url might change."""
+
+  theCache = getResponseCache()
+  if theCache is None or not url.startswith('/project/') : return
+  from cpcli.responseCache import projectUrlPrefixes
+  projectName = None
+  if isinstance(data, dict) : projectName = data.get('projectName')
+  theCache.invalidate(projectUrlPrefixes(projectName))
+
+def postDataToMajorDomo(url, data, failOnErrorStatus=False) :
+  """POST data to the MajorDomo, returning its (JSON) response, or None
+  if the request failed (or, if failOnErrorStatus, the response has an
+  error status)."""
+
   method = 'POST'
   result = None
   try :
-    http = HTTPUnixDomainConnection(config['socketPath'])
-    http.request(method.upper(), url, body=json.dumps(data))
-    result = json.loads(http.getresponse().read())
+    response, body = getMajorDomoPool().request(method, url, body=json.dumps(data))
+    invalidateResponseCache(url, data)
+    if failOnErrorStatus and 400 <= response.status :
+      sys.stderr.write("\nERROR: The MajorDomo at [{}] responded to {} with status {}\n".format(
+        config['socketPath'], url, response.status
+      ))
+      sys.stderr.write("  {}\n".format(body.decode('utf-8', errors='replace')))
+      return None
+    result = json.loads(body)
   except Exception as err :
     sys.stderr.write("\nERROR: Could not connect to a MajorDomo at [{}]\n".format(config['socketPath']))
     sys.stderr.write("  {}\n".format(repr(err)))
 
-  return result
\ No newline at end of file
+  return result
+
+asyncMajorDomoClients = { }
+
+def getAsyncMajorDomoClient() :
+  """Return the asyncio MajorDomo client for the running event loop. This
+  client MUST be used (rather than getDataFromMajorDomo or
+  postDataToMajorDomo) from inside asyncio commands or tests, since it
+  does not block the event loop (or any NATS subscriptions)."""
+
+  import asyncio
+  from cpcli.asyncHttpUnixDomainClient import AsyncHTTPUnixDomainClient
+  theLoop = asyncio.get_running_loop()
+  if theLoop not in asyncMajorDomoClients :
+    asyncMajorDomoClients[theLoop] = \
+      AsyncHTTPUnixDomainClient(config['socketPath'])
+  return asyncMajorDomoClients[theLoop]
+
+async def closeAsyncMajorDomoClient() :
+  """Close the asyncio MajorDomo client (if any) for the running event
+  loop."""
+
+  import asyncio
+  theClient = asyncMajorDomoClients.pop(asyncio.get_running_loop(), None)
+  if theClient is None : return
+  if 0 < config.get('verbosity', 0) :
+    clientStats = theClient.stats()
+    sys.stderr.write(
+      "MajorDomo [{}] (async): {} requests, {} connects, {} reconnects\n".format(
+        clientStats['socketPath'], clientStats['requests'],
+        clientStats['connects'],   clientStats['reconnects']
+    ))
+  await theClient.close()
+
+async def asyncGetDataFromMajorDomo(url) :
+  method = 'GET'
+  result = None
+  try :
+    _, _, body = await getAsyncMajorDomoClient().request(method, url)
+    result = json.loads(body)
+  except Exception as err :
+    sys.stderr.write("\nERROR: Could not connect to a MajorDomo at [{}]\n".format(config['socketPath']))
+    sys.stderr.write("  {}\n".format(repr(err)))
+
+  return result
+
+async def asyncPostDataToMajorDomo(url, data) :
+  method = 'POST'
+  result = None
+  try :
+    _, _, body = await getAsyncMajorDomoClient().request(
+      method, url, body=json.dumps(data)
+    )
+    result = json.loads(body)
+  except Exception as err :
+    sys.stderr.write("\nERROR: Could not connect to a MajorDomo at [{}]\n".format(config['socketPath']))
+    sys.stderr.write("  {}\n".format(repr(err)))
+
+  return result
@@ -0,0 +1,98 @@
+""" A persistent cache of parsed yaml files for cpcli.
+
+The configuration file, yaml based commands and yaml based tests are all
+re-read on every invocation of cpcli. This cache keeps the parsed
+contents of each yaml file (keyed by path, mtime and size) in one pickle
+file under ~/.cache/computePods, so that warm starts do not need to parse
+(or even import) yaml at all. When a file is not in the cache (or has
+changed) it is parsed using libyaml's CSafeLoader (when available). """
+
+import os
+import pickle
+
+cacheDir = '~/.cache/computePods'
+
+def yamlSafeLoader() :
+  """Return the fastest available yaml safe loader."""
+
+  import yaml
+  return getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+def parseYaml(yamlText) :
+  """Parse yaml text using the fastest available yaml safe loader."""
+
+  import yaml
+  return yaml.load(yamlText, Loader=yamlSafeLoader())
+
+class YamlCache :
+  """A persistent, mtime and size validated, cache of parsed yaml files."""
+
+  def __init__(self, cachePath) :
+    self.cachePath = os.path.abspath(os.path.expanduser(cachePath))
+    self.entries   = None
+    self.dirty     = False
+
+  def loadEntries(self) :
+    if self.entries is not None : return
+    self.entries = { }
+    try :
+      with open(self.cachePath, 'rb') as cacheFile :
+        entries = pickle.load(cacheFile)
+      if isinstance(entries, dict) : self.entries = entries
+    except Exception :
+      pass
+
+  def load(self, yamlPath) :
+    """Return the parsed contents of the yaml file at yamlPath, using the
+    cached copy if the file's mtime and size have not changed.
+
+    Any exception raised by reading or parsing the file is passed on to
+    the caller (in particular FileNotFoundError)."""
+
+    yamlPath = os.path.abspath(yamlPath)
+    yamlStat = os.stat(yamlPath)
+    self.loadEntries()
+    anEntry = self.entries.get(yamlPath)
+    if anEntry is not None \
+      and anEntry[0] == yamlStat.st_mtime_ns \
+      and anEntry[1] == yamlStat.st_size :
+      return pickle.loads(anEntry[2])
+
+    with open(yamlPath) as yamlFile :
+      yamlData = parseYaml(yamlFile.read())
+    # we store a pickled copy so that any changes the caller makes to the
+    # returned data do NOT end up in the cache
+    self.entries[yamlPath] = (
+      yamlStat.st_mtime_ns, yamlStat.st_size, pickle.dumps(yamlData)
+    )
+    self.dirty = True
+    return yamlData
+
+  def save(self) :
+    """Save the cache (if it has changed), dropping the entries for any
+    files which no longer exist. Any failure to save is ignored."""
+
+    if not self.dirty : return
+    for aPath in list(self.entries.keys()) :
+      if not os.path.exists(aPath) : del self.entries[aPath]
+    try :
+      os.makedirs(os.path.dirname(self.cachePath), mode=0o700, exist_ok=True)
+      tmpPath = self.cachePath+'.'+str(os.getpid())
+      with open(tmpPath, 'wb') as cacheFile :
+        pickle.dump(self.entries, cacheFile, pickle.HIGHEST_PROTOCOL)
+      os.replace(tmpPath, self.cachePath)
+      self.dirty = False
+    except Exception :
+      pass
+
+yamlCache = YamlCache(os.path.join(cacheDir, 'yamlCache.pickle'))
+
+def loadYamlFile(yamlPath) :
+  """Load (and parse) a yaml file using the persistent yaml cache."""
+
+  return yamlCache.load(yamlPath)
+
+def saveYamlCache() :
+  """Save the persistent yaml cache if it has changed."""
+
+  yamlCache.save()
@@ -5,21 +5,23 @@
 
 import argparse
 import datetime
+import fcntl
 from http.client import HTTPConnection
 import json
 import os
 import socket
 import sys
+import time
 
 # The one MOST important default
 #   the path to the user's MajorDomo server
 #
 defaultSocketPath = '~/.local/cpmd/server.socket'
 defaultLogPath    = '/tmp/cprsync.log'
-
-# Turn off tracebacks so that we DO NOT tell any end user about this code
-#
-sys.tracebacklimit = 0
+defaultIndexName  = 'cprsyncAllowedPaths'
+defaultMaxIndexAge = 10
+defaultMaxLogSize  = 10*1024*1024
+defaultLogBackups  = 3
 
 # We need to subclass the standard HttpConnection to allow the use of unix
 # domain sockets
@@ -43,9 +45,239 @@ class HTTPUnixDomainConnection(HTTPConnection) :
     self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
     self.sock.connect(self.socketPath)
 
+# Write (atomically) the index of the allowed project paths (name -> path)
+# for the MajorDomo at socketPath (see cpcli.allowedPaths for its format).
+#
+indexMagic   = 'cprsyncAllowedPaths'
+indexVersion = '1'
+
+def writeAllowedPathsIndex(indexPath, socketPath, projects) :
+  projectPaths = sorted(
+    (os.path.abspath(aPath), str(aName)) for aName, aPath in projects.items()
+    if isinstance(aPath, str) and '\n' not in aPath and '\t' not in aPath
+  )
+  lines = [ "\t".join([
+    indexMagic, indexVersion, repr(time.time()), socketPath
+  ]) ]
+  for aPath, aName in projectPaths :
+    lines.append(f"{aPath}\t{aName}")
+  tmpPath = indexPath+'.'+str(os.getpid())
+  with open(tmpPath, 'w') as indexFile :
+    indexFile.write("\n".join(lines)+"\n")
+  os.replace(tmpPath, indexPath)
+
+# Load the allowed project paths from the index maintained by cpcli (see
+# cpcli.allowedPaths for its format). Returns the projects (name -> path)
+# and a description of where they came from, or None (and the reason) if
+# the index is missing or stale. The index is stale if it is older than
+# maxIndexAge, or if the MajorDomo's socket, or any of the watchPaths
+# (such as the MajorDomo's own record of its projects), has changed since
+# the index was written.
+#
+def loadAllowedPathsIndex(indexPath, socketPath, maxIndexAge, watchPaths=()) :
+  try :
+    with open(indexPath) as indexFile :
+      indexLines = indexFile.read().split("\n")
+  except OSError as err :
+    return None, f"no index: {repr(err)}"
+  header = indexLines[0].split("\t")
+  if len(header) != 4 or header[0] != indexMagic \
+    or header[1] != indexVersion :
+    return None, "unknown index format"
+  try :
+    written = float(header[2])
+  except ValueError :
+    return None, "unknown index format"
+  if header[3] != socketPath :
+    return None, f"index is for another MajorDomo [{header[3]}]"
+  indexAge = time.time() - written
+  if maxIndexAge < indexAge :
+    return None, f"index is stale ({indexAge:.0f} seconds old)"
+  try :
+    # the socket is recreated whenever the MajorDomo (re)starts
+    if written < os.stat(socketPath).st_mtime :
+      return None, "the MajorDomo has restarted since the index was written"
+  except OSError as err :
+    return None, f"no MajorDomo: {repr(err)}"
+  for aWatchPath in watchPaths :
+    try :
+      if written < os.stat(aWatchPath).st_mtime :
+        return None, f"[{aWatchPath}] has changed since the index was written"
+    except OSError as err :
+      return None, f"can not check [{aWatchPath}]: {repr(err)}"
+  projects = { }
+  for anEntry in indexLines[1:] :
+    if not anEntry : continue
+    aPath, _, aName = anEntry.partition("\t")
+    projects[aName] = aPath
+  return projects, f"index [{indexPath}] ({indexAge:.0f} seconds old)"
+
+# A (component-wise) trie of the allowed directories. A target directory
+# is allowed if it is, or is inside, one of the allowed directories, so
+# checking it costs one dict lookup per component of the target's path
+# (however many projects there are), and only ever matches on real
+# directory boundaries ('/home/u/proj' does NOT allow '/home/u/project2').
+#
+# The trie is purely lexical, so (see isAllowed) a target must contain no
+# '..' components, and must also be inside its allowed directory once
+# any symbolic links have been resolved.
+#
+class AllowedPathTrie :
+  allowed = '/'  # (a component can never contain a '/')
+
+  def __init__(self, somePaths=()) :
+    self.root = { }
+    for aPath in somePaths : self.add(aPath)
+
+  @staticmethod
+  def components(aPath) :
+    return [ aPart for aPart in os.path.normpath(aPath).split('/') if aPart ]
+
+  def add(self, aPath) :
+    aNode = self.root
+    for aPart in self.components(aPath) :
+      aNode = aNode.setdefault(aPart, { })
+    aNode[self.allowed] = aPath
+
+  def match(self, aPath) :
+    """Return the (shortest) allowed directory containing aPath, or None."""
+    aNode = self.root
+    if self.allowed in aNode : return aNode[self.allowed]
+    for aPart in self.components(aPath) :
+      aNode = aNode.get(aPart)
+      if aNode is None : return None
+      if self.allowed in aNode : return aNode[self.allowed]
+    return None
+
+  def allows(self, aPath) :
+    return self.match(aPath) is not None
+
+def hasParentReferences(aPath) :
+  return '..' in aPath.split('/')
+
+def isInside(aPath, aDir) :
+  aDir = aDir.rstrip('/')
+  return aPath == aDir or aPath.startswith(aDir+'/')
+
+# Is the (absolute, fully resolved) realTargetDir allowed? The
+# (lexically normalised) targetDir is used to find the allowed directory
+# which might contain it, and then both are resolved (through any
+# symbolic links) before checking that it really does.
+#
+def isAllowed(allowedPaths, targetDir, realTargetDir) :
+  allowedDir = allowedPaths.match(targetDir)
+  if allowedDir is None : return False
+  return isInside(realTargetDir, os.path.realpath(allowedDir))
+
+# The log holds one JSON record (one line) for each session. Each record
+# is written with a single write to a file opened with O_APPEND, so the
+# records of concurrent sessions never interleave. Once the log reaches
+# maxLogSize it is rotated (log -> log.1 -> log.2 ...), keeping at most
+# logBackups old logs. Concurrent sessions rotate under an flock on the
+# (old) log, and only if no other session has already rotated it.
+#
+def rotatedLogPaths(logFilePath, logBackups) :
+  return [ logFilePath ] + \
+    [ f"{logFilePath}.{aNum}" for aNum in range(1, logBackups+1) ]
+
+def rotateLog(logFd, logFilePath, logBackups) :
+  fcntl.flock(logFd, fcntl.LOCK_EX)
+  try :
+    try :
+      if os.stat(logFilePath).st_ino != os.fstat(logFd).st_ino :
+        return # some other session has already rotated this log
+    except FileNotFoundError :
+      return
+    logPaths = rotatedLogPaths(logFilePath, logBackups)
+    if logBackups < 1 :
+      os.unlink(logFilePath)
+      return
+    for aNum in range(len(logPaths)-1, 0, -1) :
+      if os.path.exists(logPaths[aNum-1]) :
+        os.replace(logPaths[aNum-1], logPaths[aNum])
+  finally :
+    fcntl.flock(logFd, fcntl.LOCK_UN)
+
+def writeLogRecord(logFilePath, aRecord, maxLogSize, logBackups) :
+  logLine = (json.dumps(aRecord)+"\n").encode('utf-8')
+  logFlags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+  logFd = os.open(logFilePath, logFlags, 0o666)
+  try :
+    if 0 < maxLogSize and maxLogSize <= os.fstat(logFd).st_size :
+      rotateLog(logFd, logFilePath, logBackups)
+      os.close(logFd)
+      logFd = os.open(logFilePath, logFlags, 0o666)
+    os.write(logFd, logLine)
+  finally :
+    os.close(logFd)
+
+# Stream the log records (oldest first, from the rotated logs as well),
+# skipping any lines which are not JSON records (such as the free-form
+# blocks written by older versions of cprsyncctl).
+#
+def readLogRecords(logFilePath, logBackups) :
+  for aLogPath in reversed(rotatedLogPaths(logFilePath, logBackups)) :
+    try :
+      logFile = open(aLogPath, 'rb')
+    except FileNotFoundError :
+      continue
+    with logFile :
+      for aLine in logFile :
+        if not aLine.startswith(b'{') : continue
+        try :
+          aRecord = json.loads(aLine)
+        except ValueError :
+          continue
+        if isinstance(aRecord, dict) : yield aRecord
+
+# Report the sessions, denials and decision latency for each target
+# directory (keeping only running totals, so the logs are never loaded
+# into memory).
+#
+def stats(logFilePath, logBackups) :
+  dirStats = { }
+  for aRecord in readLogRecords(logFilePath, logBackups) :
+    aDir = str(aRecord.get('targetDir', '?'))
+    if aDir not in dirStats :
+      dirStats[aDir] = { 'sessions' : 0, 'denied' : 0, 'total' : 0.0, 'max' : 0.0 }
+    aDirStats = dirStats[aDir]
+    aDirStats['sessions'] = aDirStats['sessions'] + 1
+    if not aRecord.get('rsyncOK', False) :
+      aDirStats['denied'] = aDirStats['denied'] + 1
+    latency = aRecord.get('decisionMs', 0.0)
+    if not isinstance(latency, (int, float)) : latency = 0.0
+    aDirStats['total'] = aDirStats['total'] + latency
+    if aDirStats['max'] < latency : aDirStats['max'] = latency
+
+  if not dirStats :
+    print(f"No sessions logged in [{logFilePath}]")
+    return
+  allStats = { 'sessions' : 0, 'denied' : 0, 'total' : 0.0, 'max' : 0.0 }
+  for aDirStats in dirStats.values() :
+    for aKey in [ 'sessions', 'denied', 'total' ] :
+      allStats[aKey] = allStats[aKey] + aDirStats[aKey]
+    allStats['max'] = max(allStats['max'], aDirStats['max'])
+
+  rowFormat = "{:>9} {:>7} {:>9} {:>9}  {}"
+  print(rowFormat.format('sessions', 'denied', 'mean(ms)', 'max(ms)', 'directory'))
+  sortedDirs = sorted(dirStats.items(), key=lambda anItem : -anItem[1]['sessions'])
+  for aDir, aDirStats in sortedDirs + [ ('(all)', allStats) ] :
+    print(rowFormat.format(
+      aDirStats['sessions'], aDirStats['denied'],
+      "{:.3f}".format(aDirStats['total'] / aDirStats['sessions']),
+      "{:.3f}".format(aDirStats['max']), aDir
+    ))
+
 # Now we do the main task
 #
 def ctl() :
+  startTime = time.perf_counter()
+
+  # Turn off tracebacks so that we DO NOT tell any end user about this code
+  # (this is done here, rather than on import, so that the functions above
+  #  can be used by cpcli and the benchmarks)
+  #
+  sys.tracebacklimit = 0
 
   # Setup the command line argument parser
   #
@@ -61,12 +293,32 @@ def ctl() :
   parser.add_argument("-c", "--consult", action='store_true', default=False,
     help=f"whether or not to consult the local MajorDomo [default: False]"
   )
+  parser.add_argument("-i", "--index", type=str,
+    help=f"the allowed paths index used (when fresh) instead of consulting the MajorDomo [default: {defaultIndexName} next to the socket]"
+  )
+  parser.add_argument("-m", "--maxindexage", type=float,
+    default=defaultMaxIndexAge,
+    help=f"the maximum age (in seconds) of a fresh index, after which the MajorDomo is consulted instead [default: {defaultMaxIndexAge}]"
+  )
+  parser.add_argument("-w", "--indexwatch", action='append', default=[],
+    help="a file (or directory) whose modification makes the index stale, such as the MajorDomo's record of its projects"
+  )
   parser.add_argument("-r", "--restricteddir", type=str,
     help="a directory into/from which all rsync is restricted [no default]"
   )
   parser.add_argument("-a", "--alloweddir", action='append',
     help="an additional allowed directory"
   )
+  parser.add_argument("--maxlogsize", type=int, default=defaultMaxLogSize,
+    help=f"the size (in bytes) at which the log is rotated (0 never rotates) [default: {defaultMaxLogSize}]"
+  )
+  parser.add_argument("--logbackups", type=int, default=defaultLogBackups,
+    help=f"the number of rotated logs to keep [default: {defaultLogBackups}]"
+  )
+  subParsers = parser.add_subparsers(dest='command')
+  subParsers.add_parser("stats",
+    help="report the sessions, denials and decision latency for each directory in the logs"
+  )
   args = parser.parse_args()
 
   # normalise the command line arguments
@@ -79,6 +331,14 @@ def ctl() :
   if args.log :
     logFilePath = args.log
   logFilePath = os.path.abspath(os.path.expanduser(logFilePath))
+  indexPath = os.path.join(os.path.dirname(socketPath), defaultIndexName)
+  if args.index :
+    indexPath = args.index
+  indexPath = os.path.abspath(os.path.expanduser(indexPath))
+
+  if args.command == 'stats' :
+    stats(logFilePath, args.logbackups)
+    return
 
   # Get the original command
   #
@@ -93,27 +353,47 @@ def ctl() :
 
   # Normalise the rsync command
   #
-  targetDir = cmdParts.pop()
+  # (rsync is given the fully resolved target which is checked below, so
+  #  that symbolic links can not be used to escape an allowed directory)
+  #
+  origTargetDir = cmdParts.pop()
+  targetDir = origTargetDir
   if not targetDir.startswith('/') :
     targetDir = os.path.abspath(os.path.expanduser('~/'+targetDir))
-  cmdParts.append(targetDir)
+  targetDir = os.path.normpath(targetDir)
+  realTargetDir = os.path.realpath(targetDir)
+  if origTargetDir.endswith('/') and not realTargetDir.endswith('/') :
+    # (a trailing '/' matters to rsync)
+    cmdParts.append(realTargetDir+'/')
+  else :
+    cmdParts.append(realTargetDir)
   cmdParts[0] = '/usr/bin/rsync'
 
-  # Fail if this is NOT a path inside the restricted path
+  # Fail if the target uses '..' to leave a directory, or is NOT a path
+  # inside the restricted path
   # (fail fast)
   #
-  rsyncOK = True
-  if args.restricteddir :
-    if not targetDir.startswith(args.restricteddir) :
-      rsyncOK = False
+  rsyncOK = not hasParentReferences(origTargetDir)
+  if rsyncOK and args.restricteddir :
+    rsyncOK = isAllowed(
+      AllowedPathTrie([ args.restricteddir ]), targetDir, realTargetDir
+    )
 
   # Get the allowed project paths from this user's MajorDomo
+  # (using the index maintained by cpcli, if it is fresh)
   #
   projects = { }
-  if rsyncOK :
-    majorDomoOK = 'not consulted'
-    if args.consult :
-      majorDomoOK = socketPath
+  majorDomoOK = 'not consulted'
+  if rsyncOK and args.consult :
+    indexedProjects, indexStatus = \
+      loadAllowedPathsIndex(indexPath, socketPath, args.maxindexage, [
+        os.path.abspath(os.path.expanduser(aPath)) for aPath in args.indexwatch
+      ])
+    if indexedProjects is not None :
+      projects    = indexedProjects
+      majorDomoOK = indexStatus
+    else :
+      majorDomoOK = f"{socketPath} ({indexStatus})"
       try :
         http = HTTPUnixDomainConnection(socketPath)
         http.request('GET', '/projects')
@@ -121,6 +401,14 @@ def ctl() :
         projects = json.loads(result.read())
       except Exception as err :
         majorDomoOK = repr(err)
+      else :
+        # refresh the index, so that (for the next maxIndexAge seconds)
+        # the following sessions need not consult the MajorDomo
+        if result.status == 200 and isinstance(projects, dict) :
+          try :
+            writeAllowedPathsIndex(indexPath, socketPath, projects)
+          except OSError :
+            pass
 
   # Add in any allowed directories from the command line
   #
@@ -130,31 +418,27 @@ def ctl() :
       projects[str(pathNum)] = os.path.abspath(os.path.expanduser(aDir))
       pathNum = pathNum + 1
 
-  # Check if this targetDir is an allowed project path
+  # Check if this targetDir is (inside) an allowed project path
   #
   if rsyncOK :
-    rsyncOK = False
-    for anOkPath in projects.values() :
-      if targetDir.startswith(anOkPath) :
-        rsyncOK = True
-        break
+    rsyncOK = isAllowed(AllowedPathTrie(
+      aPath for aPath in projects.values() if isinstance(aPath, str)
+    ), targetDir, realTargetDir)
 
   # Log this result
   #
-  with open(logFilePath, 'a') as logFile :
-    logFile.write("---------------------------------------------------------\n")
-    logFile.write("time now: [{}]\n\n".format(datetime.datetime.now()))
-    logFile.write("original ssh command: \n  [{}]\n\n".format(origCmd))
-    logFile.write("new command: \n")
-    for aCmdPart in cmdParts :
-      logFile.write(f"  - {aCmdPart}\n")
-    logFile.write("\n")
-    logFile.write("majorDomoOK: {}\n".format(majorDomoOK))
-    logFile.write("rsyncOK:     {}\n".format(rsyncOK))
-    logFile.write("\nallowed projects:\n")
-    for aProjectName, aProjectPath in projects.items() :
-      logFile.write(f"  {aProjectName}: {aProjectPath}\n")
-    logFile.write("\n")
+  writeLogRecord(logFilePath, {
+    'time'          : datetime.datetime.now().isoformat(),
+    'pid'           : os.getpid(),
+    'origCmd'       : origCmd,
+    'command'       : cmdParts,
+    'targetDir'     : targetDir,
+    'realTargetDir' : realTargetDir,
+    'majorDomoOK'   : majorDomoOK,
+    'rsyncOK'       : rsyncOK,
+    'numProjects'   : len(projects),
+    'decisionMs'    : round((time.perf_counter() - startTime)*1000, 3),
+  }, args.maxlogsize, args.logbackups)
 
   # Now do the rsync IF we are allowed
   #
@@ -0,0 +1,19 @@
+# Shared fixtures for the cpcli and cprsync unit tests.
+
+import os
+import sys
+
+import pytest
+
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if repoDir not in sys.path : sys.path.insert(0, repoDir)
+
+@pytest.fixture
+def homeDir(tmp_path, monkeypatch) :
+  """Use an empty (temporary) home directory, so that the caches under
+  ~/.cache/computePods are empty."""
+
+  aHomeDir = tmp_path / 'home'
+  aHomeDir.mkdir()
+  monkeypatch.setenv('HOME', str(aHomeDir))
+  return aHomeDir
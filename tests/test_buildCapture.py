@@ -0,0 +1,94 @@
+import os
+
+from cpcli.buildCapture import CaptureReader, CaptureWriter, blockHeader, \
+  scanBlocks, subjectMatches
+
+def writeCapture(capturePath, numBlocks=3, blockSize=4) :
+  """Write numBlocks blocks of blockSize messages (one a second, with
+  alternating subjects) to a capture file."""
+
+  aWriter = CaptureWriter(str(capturePath), blockSize=blockSize, flushInterval=3600)
+  for aNum in range(numBlocks * blockSize) :
+    aWriter.append(f"logger.p.t{aNum % 2}", f"line {aNum}", timestamp=1000.0 + aNum)
+  aWriter.close()
+  return aWriter
+
+def readCapture(capturePath, **kwargs) :
+  aReader = CaptureReader(str(capturePath))
+  try :
+    return aReader.blocks, list(aReader.messages(**kwargs))
+  finally :
+    aReader.close()
+
+def test_subject_matches() :
+  assert subjectMatches('logger.p.t0', 'logger.p.t0')
+  assert subjectMatches('logger.*.t0', 'logger.p.t0')
+  assert subjectMatches('logger.>', 'logger.p.t0')
+  assert not subjectMatches('logger.>', 'logger')
+  assert not subjectMatches('logger.*', 'logger.p.t0')
+  assert not subjectMatches('logger.p.t0.x', 'logger.p.t0')
+
+def test_messages_are_replayed_in_order(tmp_path) :
+  capturePath = tmp_path / 'build.capture'
+  aWriter = writeCapture(capturePath)
+  assert (aWriter.blocks, aWriter.messages) == (3, 12)
+  blocks, messages = readCapture(capturePath)
+  with open(capturePath, 'rb') as captureFile :
+    assert blocks == scanBlocks(captureFile)
+  assert [ aMsg for timestamp, theSubject, aMsg in messages ] == \
+    [ f"line {aNum}" for aNum in range(12) ]
+
+def test_messages_are_selected_by_time_and_subject(tmp_path) :
+  capturePath = tmp_path / 'build.capture'
+  writeCapture(capturePath)
+  aReader = CaptureReader(str(capturePath))
+  assert aReader.startTime() == 1000.0
+  assert aReader.selectBlocks(since=1005.0, until=1006.0) == aReader.blocks[1:2]
+  assert [ aMsg for timestamp, theSubject, aMsg in aReader.messages(
+    since=1003.0, until=1008.0, subjectPatterns=[ 'logger.*.t1' ]
+  ) ] == [ 'line 3', 'line 5', 'line 7' ]
+  aReader.close()
+
+def test_a_missing_index_is_rebuilt(tmp_path) :
+  capturePath = tmp_path / 'build.capture'
+  writeCapture(capturePath)
+  indexedBlocks, indexedMessages = readCapture(capturePath)
+  os.unlink(str(capturePath)+'.idx')
+  assert readCapture(capturePath) == (indexedBlocks, indexedMessages)
+
+def test_a_partly_written_index_is_completed(tmp_path) :
+  capturePath = tmp_path / 'build.capture'
+  writeCapture(capturePath)
+  indexedBlocks, indexedMessages = readCapture(capturePath)
+  indexPath = str(capturePath)+'.idx'
+  with open(indexPath) as indexFile :
+    indexLines = indexFile.readlines()
+  # (the last index entry was only partly written)
+  with open(indexPath, 'w') as indexFile :
+    indexFile.writelines(indexLines[:1])
+    indexFile.write(indexLines[1][:10])
+  assert readCapture(capturePath) == (indexedBlocks, indexedMessages)
+
+def test_a_truncated_last_block_is_ignored(tmp_path) :
+  capturePath = tmp_path / 'build.capture'
+  writeCapture(capturePath)
+  indexedBlocks, indexedMessages = readCapture(capturePath)
+  # (the capture was killed while writing a fourth block, before its
+  # index entry was written)
+  with open(capturePath, 'rb') as captureFile :
+    aBlock = captureFile.read(indexedBlocks[1]['offset'])
+  with open(capturePath, 'ab') as captureFile :
+    captureFile.write(aBlock[:blockHeader.size + 20])
+
+  assert readCapture(capturePath) == (indexedBlocks, indexedMessages)
+  os.unlink(str(capturePath)+'.idx')
+  assert readCapture(capturePath) == (indexedBlocks, indexedMessages)
+
+def test_an_index_which_does_not_match_the_capture_is_rebuilt(tmp_path) :
+  capturePath = tmp_path / 'build.capture'
+  writeCapture(capturePath)
+  indexedBlocks, indexedMessages = readCapture(capturePath)
+  # (the index's last entry does not point at a block)
+  with open(str(capturePath)+'.idx', 'a') as indexFile :
+    indexFile.write('{"offset": 5, "first": 0, "last": 0, "count": 0, "subjects": []}\n')
+  assert readCapture(capturePath) == (indexedBlocks, indexedMessages)
@@ -0,0 +1,95 @@
+import asyncio
+import io
+
+from cpcli import buildMonitor
+from cpcli.buildMonitor import BuildMonitor, OutputQueue, parseTargets
+
+class FakeClock :
+  def __init__(self) :
+    self.now = 1000.0
+
+  def monotonic(self) :
+    return self.now
+
+def test_named_targets_complete_without_idling() :
+  aMonitor = BuildMonitor([ ('p', 't1'), ('p', 't2') ])
+  aMonitor.formatMessage('logger.p.t1', '"a log line"')
+  aMonitor.formatMessage('done.build.from.s.p.t1', { 'retCode' : 0 })
+  assert not aMonitor.allCompleted(idleTimeout=0)
+  aMonitor.formatMessage('done.build.from.s.p.t2', { 'retCode' : 1 })
+  assert aMonitor.allCompleted()
+
+def test_wildcard_targets_complete_once_idle(monkeypatch) :
+  clock = FakeClock()
+  monkeypatch.setattr(buildMonitor, 'time', clock)
+  aMonitor = BuildMonitor([ ('p', '*') ])
+  assert not aMonitor.allCompleted(idleTimeout=5)
+
+  aMonitor.formatMessage('logger.p.t1', '"a log line"')
+  aMonitor.formatMessage('logger.p.t2', '"a log line"')
+  aMonitor.formatMessage('done.build.from.s.p.t1', { 'retCode' : 0 })
+  clock.now = clock.now + 10
+  # (t2 has not completed)
+  assert not aMonitor.allCompleted(idleTimeout=5)
+
+  aMonitor.formatMessage('done.build.from.s.p.t2', { 'retCode' : 0 })
+  clock.now = clock.now + 1
+  assert not aMonitor.allCompleted(idleTimeout=5)
+  clock.now = clock.now + 5
+  assert aMonitor.allCompleted(idleTimeout=5)
+  # without an idle timeout, a wildcard monitor never completes
+  assert not aMonitor.allCompleted()
+
+def test_parse_targets() :
+  assert parseTargets([ 'p', 't' ]) == [ ('p', 't') ]
+  assert parseTargets([ 'p1:', 'p2:' ]) == [ ('p1', '*'), ('p2', '*') ]
+  assert parseTargets([ 'p1', 'p2', 'p3:t' ]) == \
+    [ ('p1', '*'), ('p2', '*'), ('p3', 't') ]
+  assert parseTargets([ ':t1', ':t1', '*:t1', 'p:t' ]) == [ ('*', 't1'), ('p', 't') ]
+  assert parseTargets([ 'p' ], allTargets=True) == [ ('*', '*') ]
+
+def queueMessages(aQueue, messages) :
+  """Put some (text, important) messages (of target p/t) onto aQueue."""
+
+  async def putAll() :
+    for msgText, important in messages :
+      await aQueue.put(('p', 't'), msgText, important)
+  asyncio.run(putAll())
+
+def test_output_queue_blocks_until_written() :
+  out    = io.StringIO()
+  aQueue = OutputQueue(maxSize=2, policy='block', batchSize=1, out=out)
+
+  async def putAll() :
+    writer = asyncio.create_task(aQueue.writer())
+    for aNum in range(5) :
+      await aQueue.put(('p', 't'), f"{aNum}\n")
+    while aQueue.entries : await asyncio.sleep(0.01)
+    writer.cancel()
+  asyncio.run(putAll())
+  aQueue.drain()
+
+  assert out.getvalue() == "0\n1\n2\n3\n4\n"
+  assert 0 < aQueue.blocked
+  assert (aQueue.queued, aQueue.dropped, aQueue.coalescedTotal) == (5, 0, 0)
+
+def test_output_queue_drops_the_oldest_unimportant_message() :
+  out    = io.StringIO()
+  aQueue = OutputQueue(maxSize=2, policy='drop-oldest', out=out)
+  queueMessages(aQueue, [
+    ("a\n", False), ("b\n", True), ("c\n", False), ("d\n", False), ("e\n", True)
+  ])
+  aQueue.drain()
+  assert out.getvalue() == "b\nd\ne\n"
+  assert (aQueue.queued, aQueue.dropped, aQueue.blocked) == (5, 2, 0)
+
+def test_output_queue_summarises_the_messages_it_discards() :
+  out    = io.StringIO()
+  aQueue = OutputQueue(maxSize=2, policy='summarise', out=out)
+  queueMessages(aQueue, [
+    ("a\n", False), ("b\n", False), ("c\n", False), ("d\n", False), ("done\n", True)
+  ])
+  aQueue.drain()
+  assert out.getvalue() == \
+    "a\nb\ndone\n[p/t] ... 2 messages coalesced ...\n"
+  assert (aQueue.queued, aQueue.coalescedTotal, aQueue.dropped) == (3, 2, 0)
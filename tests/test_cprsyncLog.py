@@ -0,0 +1,58 @@
+import json
+import os
+
+from cprsync import readLogRecords, rotatedLogPaths, stats, writeLogRecord
+
+def writeRecords(logPath, someRecords, maxLogSize=0, logBackups=0) :
+  for aRecord in someRecords :
+    writeLogRecord(str(logPath), aRecord, maxLogSize, logBackups)
+
+def test_log_records_are_read_back_oldest_first(tmp_path) :
+  logPath  = tmp_path / 'cprsync.log'
+  logPath.write_text("an old free-form block\n  with details\n")
+  records  = [ { 'targetDir' : f'/p/{aNum}', 'rsyncOK' : True } for aNum in range(5) ]
+  writeRecords(logPath, records)
+  with open(logPath, 'a') as logFile : logFile.write('{"truncated\n')
+  assert list(readLogRecords(str(logPath), 0)) == records
+
+def test_logs_are_rotated_keeping_some_backups(tmp_path) :
+  logPath    = tmp_path / 'cprsync.log'
+  records    = [ { 'targetDir' : '/p', 'session' : aNum } for aNum in range(10, 30) ]
+  recordSize = len(json.dumps(records[0])) + 1
+  writeRecords(logPath, records, maxLogSize=3*recordSize, logBackups=2)
+
+  logPaths = rotatedLogPaths(str(logPath), 2)
+  assert not os.path.exists(f"{logPath}.3")
+  assert [ os.path.getsize(aPath) for aPath in logPaths ] == \
+    [ 2*recordSize, 3*recordSize, 3*recordSize ]
+  # only the most recent records are kept, in order
+  sessions = [ aRecord['session'] for aRecord in readLogRecords(str(logPath), 2) ]
+  assert sessions == list(range(22, 30))
+
+def test_logs_without_backups_are_truncated(tmp_path) :
+  logPath    = tmp_path / 'cprsync.log'
+  records    = [ { 'session' : aNum } for aNum in range(10) ]
+  recordSize = len(json.dumps(records[0])) + 1
+  writeRecords(logPath, records, maxLogSize=4*recordSize, logBackups=0)
+  assert list(readLogRecords(str(logPath), 0)) == records[8:]
+
+def test_stats_summarise_each_target_directory(tmp_path, capsys) :
+  logPath = tmp_path / 'cprsync.log'
+  writeRecords(logPath, [
+    { 'targetDir' : '/p/a', 'rsyncOK' : True,  'decisionMs' : 1.0 },
+    { 'targetDir' : '/p/a', 'rsyncOK' : False, 'decisionMs' : 3.0 },
+    { 'targetDir' : '/p/b', 'rsyncOK' : True,  'decisionMs' : 2.0 },
+    { 'targetDir' : '/p/a', 'rsyncOK' : True,  'decisionMs' : 'unknown' },
+  ])
+  stats(str(logPath), 0)
+  lines = capsys.readouterr().out.splitlines()
+  assert lines[0].split() == [ 'sessions', 'denied', 'mean(ms)', 'max(ms)', 'directory' ]
+  assert [ aLine.split() for aLine in lines[1:] ] == [
+    [ '3', '1', '1.333', '3.000', '/p/a' ],
+    [ '1', '0', '2.000', '2.000', '/p/b' ],
+    [ '4', '1', '1.500', '3.000', '(all)' ],
+  ]
+
+def test_stats_of_an_empty_log(tmp_path, capsys) :
+  stats(str(tmp_path / 'missing.log'), 3)
+  assert 'No sessions logged' in capsys.readouterr().out
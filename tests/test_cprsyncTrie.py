@@ -0,0 +1,52 @@
+import os
+
+from cprsync import AllowedPathTrie, hasParentReferences, isAllowed
+
+def test_trie_matches_whole_components() :
+  allowedPaths = AllowedPathTrie([ '/projects/a', '/projects/b/', '/data/shared' ])
+  assert allowedPaths.match('/projects/a') == '/projects/a'
+  assert allowedPaths.match('/projects/a/build/x') == '/projects/a'
+  assert allowedPaths.match('/projects/b/y/') == '/projects/b/'
+  assert allowedPaths.match('/projects/ab') is None
+  assert allowedPaths.match('/projects') is None
+  assert allowedPaths.match('/data/shared2') is None
+  assert allowedPaths.allows('//data//shared/./z')
+  assert not allowedPaths.allows('/')
+
+def test_trie_returns_the_shortest_allowed_directory() :
+  allowedPaths = AllowedPathTrie([ '/projects/a/build', '/projects/a' ])
+  assert allowedPaths.match('/projects/a/build/x') == '/projects/a'
+
+def test_trie_allowing_the_root() :
+  assert AllowedPathTrie([ '/' ]).allows('/anything/at/all')
+  assert not AllowedPathTrie().allows('/anything/at/all')
+
+def test_parent_references() :
+  assert hasParentReferences('/projects/a/../../etc')
+  assert hasParentReferences('../x')
+  assert not hasParentReferences('/projects/a..b/c..')
+
+def test_is_allowed_resolves_symbolic_links(tmp_path) :
+  projectDir = tmp_path / 'projects' / 'a'
+  outsideDir = tmp_path / 'outside'
+  (projectDir / 'build').mkdir(parents=True)
+  outsideDir.mkdir()
+  (projectDir / 'escape').symlink_to(outsideDir)
+  allowedPaths = AllowedPathTrie([ str(projectDir) ])
+
+  inside = str(projectDir / 'build' / 'new')
+  assert isAllowed(allowedPaths, inside, os.path.realpath(inside))
+  escape = str(projectDir / 'escape' / 'new')
+  assert not isAllowed(allowedPaths, escape, os.path.realpath(escape))
+  sibling = str(projectDir)+'x'
+  assert not isAllowed(allowedPaths, sibling, os.path.realpath(sibling))
+
+def test_is_allowed_with_a_symbolically_linked_project(tmp_path) :
+  realProjectDir = tmp_path / 'real' / 'a'
+  realProjectDir.mkdir(parents=True)
+  projectDir = tmp_path / 'a'
+  projectDir.symlink_to(realProjectDir)
+  allowedPaths = AllowedPathTrie([ str(projectDir) ])
+
+  target = str(projectDir / 'build')
+  assert isAllowed(allowedPaths, target, os.path.realpath(target))
@@ -0,0 +1,104 @@
+from http.client import RemoteDisconnected
+
+import pytest
+
+from cpcli import httpUnixDomainClient
+from cpcli.httpUnixDomainClient import HTTPUnixDomainPool
+
+class FakeResponse :
+  will_close = False
+
+  def read(self, size=None) :
+    return b'{}'
+
+class FakeConnection :
+  """A connection which fails (as a connection closed by the server
+  would) either while sending the request ('send') or while reading the
+  response ('response'), or which succeeds (None)."""
+
+  def __init__(self, failWhen=None) :
+    self.failWhen = failWhen
+    self.sock     = object()
+    self.sent     = [ ]
+    self.closed   = False
+
+  def request(self, method, url, body=None, headers=None) :
+    if self.failWhen == 'send' : raise BrokenPipeError("stale connection")
+    self.sent.append((method, url))
+
+  def getresponse(self) :
+    if self.failWhen == 'response' :
+      raise RemoteDisconnected("Remote end closed connection without response")
+    return FakeResponse()
+
+  def close(self) :
+    self.closed = True
+    self.sock   = None
+
+@pytest.fixture
+def newConnections(monkeypatch) :
+  """Make the pool's new connections FakeConnections (which fail as
+  listed in the returned list, and otherwise succeed), and treat every
+  idle connection as still open (as if the server closed it just after
+  the pool checked it)."""
+
+  failures = [ ]
+  made     = [ ]
+  def newConnection(socketPath) :
+    aConnection = FakeConnection(failures.pop(0) if failures else None)
+    made.append(aConnection)
+    return aConnection
+  monkeypatch.setattr(httpUnixDomainClient, 'HTTPUnixDomainConnection', newConnection)
+  monkeypatch.setattr(httpUnixDomainClient, 'isClosedByServer', lambda http : False)
+  return failures, made
+
+def staleIdlePool(failWhen) :
+  pool = HTTPUnixDomainPool('/tmp/majorDomo.socket')
+  staleConnection = FakeConnection(failWhen)
+  pool.idle.append(staleConnection)
+  return pool, staleConnection
+
+def test_a_get_on_a_stale_connection_is_retried_once(newConnections) :
+  failures, made = newConnections
+  pool, staleConnection = staleIdlePool('response')
+  response, body = pool.request('GET', '/projects')
+  assert body == b'{}'
+  assert staleConnection.closed
+  assert [ aConnection.sent for aConnection in made ] == [ [ ('GET', '/projects') ] ]
+  assert pool.stats()['reconnects'] == 1
+  assert pool.idle == made
+
+def test_a_get_is_only_retried_once(newConnections) :
+  failures, made = newConnections
+  failures.append('response')
+  pool, staleConnection = staleIdlePool('response')
+  with pytest.raises(RemoteDisconnected) :
+    pool.request('GET', '/projects')
+  assert len(made) == 1
+  assert pool.idle == [ ]
+
+def test_a_sent_post_is_never_resent(newConnections) :
+  failures, made = newConnections
+  pool, staleConnection = staleIdlePool('response')
+  with pytest.raises(RemoteDisconnected) :
+    pool.request('POST', '/project/add', body=b'{}')
+  assert staleConnection.sent == [ ('POST', '/project/add') ]
+  assert made == [ ]
+  assert pool.stats()['reconnects'] == 0
+
+def test_an_unsent_post_is_retried(newConnections) :
+  failures, made = newConnections
+  pool, staleConnection = staleIdlePool('send')
+  response, body = pool.request('POST', '/project/add', body=b'{}')
+  assert body == b'{}'
+  assert staleConnection.sent == [ ]
+  assert [ aConnection.sent for aConnection in made ] == [ [ ('POST', '/project/add') ] ]
+  assert pool.stats()['reconnects'] == 1
+
+def test_a_failure_on_a_new_connection_is_not_retried(newConnections) :
+  failures, made = newConnections
+  failures.append('send')
+  pool = HTTPUnixDomainPool('/tmp/majorDomo.socket')
+  with pytest.raises(BrokenPipeError) :
+    pool.request('GET', '/projects')
+  assert len(made) == 1
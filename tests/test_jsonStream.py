@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from cpcli.jsonStream import JsonEntryStream
+
+def inChunks(someBytes, chunkSize) :
+  return [
+    someBytes[aPos:aPos+chunkSize] for aPos in range(0, len(someBytes), chunkSize)
+  ]
+
+documents = [
+  { 'a' : 1, 'b' : [ 1, 2, { 'c' : 'x\\"y,]}' } ], 'é' : 'ü\\', 'd' : { } },
+  [ 1, "a\\", { "x" : [ ] }, "\"]", None, [ [ ], { } ] ],
+  "a string\n",
+  12.5,
+  { },
+  [ ],
+]
+
+@pytest.mark.parametrize('aDocument', documents)
+@pytest.mark.parametrize('chunkSize', [ 1, 2, 3, 7, 65536 ])
+def test_entries_do_not_depend_on_chunking(aDocument, chunkSize) :
+  someBytes = json.dumps(aDocument, ensure_ascii=False, indent=1).encode('utf-8')
+  entries   = JsonEntryStream(inChunks(someBytes, chunkSize))
+  decoded   = list(entries)
+  if isinstance(aDocument, dict) :
+    assert entries.kind == 'object'
+    assert dict(decoded) == aDocument
+    assert [ aKey for aKey, _ in decoded ] == list(aDocument.keys())
+  elif isinstance(aDocument, list) :
+    assert entries.kind == 'array'
+    assert decoded == list(enumerate(aDocument))
+  else :
+    assert entries.kind == 'scalar'
+    assert decoded == [ (None, aDocument) ]
+
+def test_entries_are_yielded_as_they_arrive() :
+  def chunks() :
+    yield b'[{"a": 1}, '
+    yield b'{"b": 2}, '
+    raise AssertionError("read past the entries needed")
+  entries = iter(JsonEntryStream(chunks()))
+  assert next(entries) == (0, { 'a' : 1 })
+  assert next(entries) == (1, { 'b' : 2 })
+
+def test_many_entries_in_large_chunks() :
+  aDocument = [ { 'i' : anIndex, 's' : 'x' * 50 } for anIndex in range(20000) ]
+  someBytes = json.dumps(aDocument).encode('utf-8')
+  decoded   = list(JsonEntryStream(inChunks(someBytes, 65536)))
+  assert [ aValue for _, aValue in decoded ] == aDocument
+
+def test_an_entry_spanning_many_chunks() :
+  aDocument = { 'small' : 1, 'large' : 'y' * 1000000, 'last' : [ 2 ] }
+  someBytes = json.dumps(aDocument).encode('utf-8')
+  assert dict(JsonEntryStream(inChunks(someBytes, 4096))) == aDocument
+
+@pytest.mark.parametrize('chunks', [ [ ], [ b'' ], [ b'  \n', b'' ] ])
+def test_no_document(chunks) :
+  entries = JsonEntryStream(chunks)
+  assert list(entries) == [ ]
+  assert entries.kind is None
+
+@pytest.mark.parametrize('someBytes', [
+  b'[1, 2', b'{"a": ', b'[1] x', b'{"a": 1} {', b'[1, {"a": }]', b'"unterminated',
+  b'["\xff"]',
+])
+def test_malformed_documents_raise_value_errors(someBytes) :
+  with pytest.raises(ValueError) :
+    list(JsonEntryStream(inChunks(someBytes, 2)))
@@ -0,0 +1,90 @@
+import os
+
+import click
+import pytest
+from click.testing import CliRunner
+
+from cpcli.lazyGroup import LazyGroup, loadCommandManifest, saveCommandManifest
+
+modules = { 'hello' : { 'help' : "Say hello.", 'shortHelp' : "say hello" } }
+
+def makeCommandDir(tmp_path) :
+  aCommandDir = tmp_path / 'commands'
+  aCommandDir.mkdir()
+  (aCommandDir / 'hello.py').write_text("# hello\n")
+  (aCommandDir / 'notes.txt').write_text("not a module\n")
+  return str(aCommandDir)
+
+def test_the_manifest_is_reused_while_the_modules_are_unchanged(homeDir, tmp_path) :
+  aCommandDir = makeCommandDir(tmp_path)
+  assert loadCommandManifest(aCommandDir, 'pkg') is None
+  saveCommandManifest(aCommandDir, 'pkg', modules)
+  assert loadCommandManifest(aCommandDir, 'pkg')['modules'] == modules
+  # (each package path has its own manifest)
+  assert loadCommandManifest(aCommandDir, 'otherPkg') is None
+  # (only python modules and packages are signed)
+  (tmp_path / 'commands' / 'notes.txt').write_text("changed notes\n")
+  assert loadCommandManifest(aCommandDir, 'pkg')['modules'] == modules
+
+def test_the_manifest_is_rebuilt_when_the_modules_change(homeDir, tmp_path) :
+  aCommandDir = makeCommandDir(tmp_path)
+  saveCommandManifest(aCommandDir, 'pkg', modules)
+  helloPath = os.path.join(aCommandDir, 'hello.py')
+  aStat = os.stat(helloPath)
+  os.utime(helloPath, ns=(aStat.st_atime_ns, aStat.st_mtime_ns + 10**9))
+  assert loadCommandManifest(aCommandDir, 'pkg') is None
+
+  saveCommandManifest(aCommandDir, 'pkg', modules)
+  (tmp_path / 'commands' / 'goodbye').mkdir()
+  (tmp_path / 'commands' / 'goodbye' / '__init__.py').write_text("")
+  assert loadCommandManifest(aCommandDir, 'pkg') is None
+
+@pytest.fixture
+def prefixAliases(monkeypatch) :
+  """Dispatch commands (by unique prefix) as cpcli's (monkey patched)
+  aliased_get_command does, without importing (and so configuring) the
+  cli itself."""
+
+  def aliasedGetCommand(self, ctx, cmdName) :
+    matches = [ aCmdName for aCmdName in self.list_commands(ctx)
+      if aCmdName.startswith(cmdName) ]
+    if cmdName in matches : matches = [ cmdName ]
+    if len(matches) != 1 : return None
+    return self.orig_get_command(ctx, matches[0])
+  monkeypatch.setattr(click.Group, 'get_command', aliasedGetCommand)
+
+def makeLazyCli() :
+  loaded = [ ]
+
+  @click.group(cls=LazyGroup)
+  def cli() :
+    pass
+
+  def loadGreetings() :
+    loaded.append('greetings')
+    @cli.command(help="Say hello.")
+    def hello() :
+      click.echo("hello")
+    @cli.command(help="Say goodbye.")
+    def goodbye() :
+      click.echo("goodbye")
+
+  cli.addLazyCommand('hello',   "Say hello.",   "say hello",   loadGreetings)
+  cli.addLazyCommand('goodbye', "Say goodbye.", "say goodbye", loadGreetings)
+  return cli, loaded
+
+def test_help_lists_lazy_commands_without_loading_them() :
+  cli, loaded = makeLazyCli()
+  result = CliRunner().invoke(cli, [ '--help' ])
+  assert result.exit_code == 0
+  assert 'say hello' in result.output and 'say goodbye' in result.output
+  assert loaded == [ ]
+
+def test_a_lazy_command_is_loaded_when_dispatched(prefixAliases) :
+  cli, loaded = makeLazyCli()
+  result = CliRunner().invoke(cli, [ 'hel' ])
+  assert (result.exit_code, result.output) == (0, "hello\n")
+  # (the loader also registered goodbye, so it is no longer lazy)
+  assert cli.lazyCommands == { }
+  assert CliRunner().invoke(cli, [ 'goodbye' ]).output == "goodbye\n"
+  assert loaded == [ 'greetings' ]
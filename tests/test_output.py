@@ -0,0 +1,30 @@
+import io
+import json
+
+import pytest
+import yaml
+
+from cpcli.jsonStream import JsonEntryStream
+from cpcli.output import YamlRenderer
+
+results = [
+  { 'zeta' : { 'dir' : '/z', 'b' : 2, 'a' : 1 }, 'alpha' : [ 3, 1, { 'y' : 1, 'x' : 2 } ] },
+  [ { 'b' : 1, 'a' : 2 }, 'x', [ ] ],
+  'a string',
+  42,
+  None,
+  { },
+  [ ],
+]
+
+@pytest.mark.parametrize('aResult', results)
+def test_yaml_is_rendered_as_yaml_dump_would(aResult) :
+  out = io.StringIO()
+  YamlRenderer(out).render(aResult)
+  assert out.getvalue() == yaml.dump(aResult)
+
+@pytest.mark.parametrize('aResult', results)
+def test_streamed_yaml_is_rendered_as_yaml_dump_would(aResult) :
+  out = io.StringIO()
+  YamlRenderer(out).renderStream(JsonEntryStream([ json.dumps(aResult).encode('utf-8') ]))
+  assert out.getvalue() == yaml.dump(aResult)
@@ -0,0 +1,82 @@
+import os
+
+from cpcli.projectIndex import loadYamlFrom, mergeYamlData
+
+def writeYaml(aPath, text) :
+  aPath.parent.mkdir(parents=True, exist_ok=True)
+  aPath.write_text(text)
+
+def fixUp(yamlData, yamlPath, newYamlData) :
+  newYamlData['fixedUp'] = [ yamlPath.name ]
+
+def loadProjects(yamlDir) :
+  yamlData = { }
+  index = loadYamlFrom(yamlData, str(yamlDir), [ '.PYML' ], fixUp)
+  return yamlData, index
+
+def test_merge_yaml_data() :
+  yamlData = { 'a' : { 'b' : 1 }, 'l' : [ 1 ], 's' : 'old' }
+  mergeYamlData(yamlData, { 'a' : { 'c' : 2 }, 'l' : [ 2 ], 's' : 'new' })
+  assert yamlData == { 'a' : { 'b' : 1, 'c' : 2 }, 'l' : [ 1, 2 ], 's' : 'new' }
+
+def test_unchanged_files_are_not_reparsed(homeDir, tmp_path) :
+  yamlDir = tmp_path / 'projects'
+  writeYaml(yamlDir / 'one' / 'one.PYML', "one:\n  dir: /one\n")
+  writeYaml(yamlDir / 'two' / 'two.PYML', "two:\n  dir: /two\n")
+  writeYaml(yamlDir / 'two' / 'notes.txt', "not: yaml\n")
+
+  yamlData, index = loadProjects(yamlDir)
+  assert (index.parsed, index.reused) == (2, 0)
+  assert yamlData == {
+    'one' : { 'dir' : '/one' }, 'two' : { 'dir' : '/two' },
+    'fixedUp' : [ 'one.PYML', 'two.PYML' ]
+  }
+
+  cachedData, index = loadProjects(yamlDir)
+  assert (index.parsed, index.reused) == (0, 2)
+  assert cachedData == yamlData
+
+def test_touched_files_are_rehashed_not_reparsed(homeDir, tmp_path) :
+  yamlDir  = tmp_path / 'projects'
+  yamlPath = yamlDir / 'one.PYML'
+  writeYaml(yamlPath, "one:\n  dir: /one\n")
+  loadProjects(yamlDir)
+
+  aStat = os.stat(yamlPath)
+  os.utime(yamlPath, ns=(aStat.st_atime_ns, aStat.st_mtime_ns + 10**9))
+  yamlData, index = loadProjects(yamlDir)
+  assert (index.parsed, index.reused) == (0, 1)
+  assert yamlData['one'] == { 'dir' : '/one' }
+
+def test_modified_and_removed_files(homeDir, tmp_path) :
+  yamlDir = tmp_path / 'projects'
+  writeYaml(yamlDir / 'one.PYML', "one:\n  dir: /one\n")
+  writeYaml(yamlDir / 'two.PYML', "two:\n  dir: /two\n")
+  loadProjects(yamlDir)
+
+  writeYaml(yamlDir / 'one.PYML', "one:\n  dir: /a/much/longer/path\n")
+  (yamlDir / 'two.PYML').unlink()
+  yamlData, index = loadProjects(yamlDir)
+  assert (index.parsed, index.reused) == (1, 0)
+  assert yamlData == {
+    'one' : { 'dir' : '/a/much/longer/path' }, 'fixedUp' : [ 'one.PYML' ]
+  }
+  assert list(index.entries.keys()) == [ str(yamlDir / 'one.PYML') ]
+
+def test_a_different_fix_up_ignores_the_index(homeDir, tmp_path) :
+  yamlDir = tmp_path / 'projects'
+  writeYaml(yamlDir / 'one.PYML', "one:\n  dir: /one\n")
+  loadProjects(yamlDir)
+
+  yamlData = { }
+  index = loadYamlFrom(yamlData, str(yamlDir), [ '.PYML' ])
+  assert (index.parsed, index.reused) == (1, 0)
+  assert yamlData == { 'one' : { 'dir' : '/one' } }
+
+def test_unreadable_files_are_reported(homeDir, tmp_path, capsys) :
+  yamlDir = tmp_path / 'projects'
+  writeYaml(yamlDir / 'bad.PYML', "one: [ unterminated\n")
+  writeYaml(yamlDir / 'good.PYML', "good: 1\n")
+  yamlData, index = loadProjects(yamlDir)
+  assert yamlData == { 'good' : 1, 'fixedUp' : [ 'good.PYML' ] }
+  assert 'bad.PYML' in capsys.readouterr().err
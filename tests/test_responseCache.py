@@ -0,0 +1,86 @@
+import os
+
+from cpcli.responseCache import ResponseCache
+
+class FakeResponse :
+  def __init__(self, status, body, etag=None) :
+    self.status = status
+    self.body   = body
+    self.etag   = etag
+
+  def getheader(self, aName) :
+    return self.etag if aName == 'ETag' else None
+
+  def read(self, size=None) :
+    aChunk, self.body = self.body, b''
+    return aChunk
+
+class FakePool :
+  """Serve each url from a dict of (status, body, etag) responses,
+  counting the requests made."""
+
+  def __init__(self, responses, version=None) :
+    self.responses = responses
+    self.version   = version
+    self.requests  = [ ]
+
+  def request(self, method, url) :
+    self.requests.append(url)
+    return FakeResponse(200, self.version), self.version
+
+  def sendRequest(self, method, url, body, headers) :
+    self.requests.append(url)
+    status, body, etag = self.responses[url]
+    if etag is not None and headers.get('If-None-Match') == etag :
+      return None, FakeResponse(304, b'', etag)
+    return None, FakeResponse(status, body, etag)
+
+  def finishResponse(self, http, response) :
+    pass
+
+def makeCache(**kwargs) :
+  return ResponseCache('/tmp/majorDomo.socket', **kwargs)
+
+def cachedUrls(aCache) :
+  try :
+    return os.listdir(aCache.cachePath)
+  except FileNotFoundError :
+    return [ ]
+
+def test_unreusable_responses_are_not_stored(homeDir) :
+  aCache = makeCache()
+  pool   = FakePool({ '/projects' : (200, b'{}', None) })
+  assert aCache.get(pool, '/projects') == b'{}'
+  assert aCache.get(pool, '/projects') == b'{}'
+  assert pool.requests == [ '/projects', '/projects' ]
+  assert cachedUrls(aCache) == [ ]
+
+def test_responses_are_reused_within_the_ttl(homeDir) :
+  aCache = makeCache(ttl=60)
+  pool   = FakePool({ '/projects' : (200, b'{"a": 1}', None) })
+  assert aCache.get(pool, '/projects') == b'{"a": 1}'
+  assert aCache.get(pool, '/projects') == b'{"a": 1}'
+  assert pool.requests == [ '/projects' ]
+
+def test_responses_with_etags_are_revalidated(homeDir) :
+  aCache = makeCache()
+  pool   = FakePool({ '/projects' : (200, b'{"a": 1}', '"v1"') })
+  assert aCache.get(pool, '/projects') == b'{"a": 1}'
+  pool.responses['/projects'] = (200, b'{"a": 2}', '"v1"')
+  # (the MajorDomo says the cached response is still current)
+  assert aCache.get(pool, '/projects') == b'{"a": 1}'
+  assert len(cachedUrls(aCache)) == 1
+
+def test_responses_are_reused_while_the_version_is_unchanged(homeDir) :
+  aCache = makeCache(versionUrl='/version')
+  pool   = FakePool({ '/projects' : (200, b'{"a": 1}', None) }, version=b'1')
+  assert aCache.get(pool, '/projects') == b'{"a": 1}'
+  aCache.version = None
+  assert aCache.get(pool, '/projects') == b'{"a": 1}'
+  assert pool.requests == [ '/version', '/projects', '/version' ]
+
+def test_error_responses_are_not_stored(homeDir) :
+  aCache = makeCache(ttl=60)
+  pool   = FakePool({ '/projects' : (500, b'{}', '"v1"') })
+  aCache.get(pool, '/projects')
+  assert cachedUrls(aCache) == [ ]
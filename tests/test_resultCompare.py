@@ -0,0 +1,82 @@
+import pytest
+from deepdiff import DeepDiff
+
+from cpcli.resultCompare import compareResults, strictlyEqual
+
+scalars = [ 1, 1.0, True, '1', None, 0, False ]
+
+@pytest.mark.parametrize('aResult', scalars)
+@pytest.mark.parametrize('anExpected', scalars)
+def test_scalars_agree_with_deepdiff(aResult, anExpected) :
+  assert bool(compareResults(aResult, anExpected)) == bool(DeepDiff(aResult, anExpected))
+  assert strictlyEqual(aResult, anExpected) == (not DeepDiff(aResult, anExpected))
+
+@pytest.mark.parametrize('aResult, anExpected', [
+  ({ 'a' : [ 1, 2 ] },          { 'a' : [ 1, 2 ] }),
+  ({ 'a' : [ 1, 2 ] },          { 'a' : [ 1.0, 2 ] }),
+  ({ 'a' : [ 1, 2 ] },          { 'a' : [ True, 3 ] }),
+  ([ [ 1 ], { 'b' : 1 } ],      [ [ 1.0 ], { 'b' : 1.0 } ]),
+  ([ { 'b' : 1 }, 2 ],          [ { 'b' : True }, 2.0 ]),
+  ({ 'a' : { 'b' : True } },    { 'a' : { 'b' : 1 } }),
+  ({ 'a' : 1, 'b' : 2 },        { 'b' : 2, 'a' : 1 }),
+  ({ 'a' : 1 },                 { 'a' : 1, 'b' : 2 }),
+  ([ { 'x' : 1 }, 'y' ],        [ { 'x' : 1 }, 'z' ]),
+  ([ 1, 2 ],                    ( 1, 2 )),
+])
+def test_containers_agree_with_deepdiff(aResult, anExpected) :
+  assert bool(compareResults(aResult, anExpected)) == bool(DeepDiff(aResult, anExpected))
+
+def test_differences_are_reported_by_subtree() :
+  expected = { 'projects' : { f"p{aNum}" : { 'dir' : f"/p{aNum}", 'n' : aNum }
+    for aNum in range(100) } }
+  result = { 'projects' : dict(expected['projects']) }
+  result['projects']['p7']  = { 'dir' : '/p7', 'n' : 7.0 }
+  result['projects']['p42'] = { 'dir' : '/moved', 'n' : 42 }
+  diffs = compareResults(result, expected)
+  assert [ aPath for aPath, aDiff in diffs ] == [ 'projects.p7.n', 'projects.p42.dir' ]
+  assert 'type_changes' in diffs[0][1]
+  assert 'values_changed' in diffs[1][1]
+
+ignorePathCases = [
+  # (result, expected, ignorePaths, the equivalent DeepDiff exclusions)
+  ({ 'a' : 1, 'when' : 2 }, { 'a' : 1, 'when' : 3 }, [ 'when' ], [ r"root\['when'\]" ]),
+  ({ 'a' : 1, 'when' : 2 }, { 'a' : 2, 'when' : 3 }, [ 'when' ], [ r"root\['when'\]" ]),
+  (
+    { 'p' : { 'x' : { 'built' : 1, 'ok' : True }, 'y' : { 'built' : 2, 'ok' : True } } },
+    { 'p' : { 'x' : { 'built' : 5, 'ok' : True }, 'y' : { 'built' : 6, 'ok' : True } } },
+    [ 'p.*.built' ], [ r"root\['p'\]\[[^\]]+\]\['built'\]" ]
+  ),
+  (
+    { 'p' : { 'x' : { 'built' : 1, 'ok' : True } } },
+    { 'p' : { 'x' : { 'built' : 5, 'ok' : 1 } } },
+    [ 'p.*.built' ], [ r"root\['p'\]\[[^\]]+\]\['built'\]" ]
+  ),
+  ({ 'l' : [ { 't' : 1 }, { 't' : 2 } ] }, { 'l' : [ { 't' : 3 }, { 't' : 4 } ] },
+    [ 'l.*.t' ], [ r"root\['l'\]\[\d+\]\['t'\]" ]),
+]
+
+@pytest.mark.parametrize('aResult, anExpected, ignorePaths, excludePaths', ignorePathCases)
+def test_ignore_paths_agree_with_deepdiff(aResult, anExpected, ignorePaths, excludePaths) :
+  assert bool(compareResults(aResult, anExpected, ignorePaths=ignorePaths)) == \
+    bool(DeepDiff(aResult, anExpected, exclude_regex_paths=excludePaths))
+
+ignoreOrderCases = [
+  ({ 'l' : [ 3, 1, 2 ] },              { 'l' : [ 1, 2, 3 ] }),
+  ({ 'l' : [ 3, 1, 2 ] },              { 'l' : [ 1, 2, 4 ] }),
+  ({ 'l' : [ 1, 1.0 ] },               { 'l' : [ 1.0, 1 ] }),
+  ({ 'l' : [ 1, True ] },              { 'l' : [ 1, 1 ] }),
+  ({ 'l' : [ { 'a' : 1 }, 'x', 2 ] },  { 'l' : [ 2, 'x', { 'a' : 1 } ] }),
+  ({ 'l' : [ [ 2, 1 ], [ 3 ] ] },      { 'l' : [ [ 3 ], [ 1, 2 ] ] }),
+]
+
+@pytest.mark.parametrize('aResult, anExpected', ignoreOrderCases)
+def test_ignore_order_agrees_with_deepdiff(aResult, anExpected) :
+  assert bool(compareResults(aResult, anExpected, ignoreOrder=True)) == \
+    bool(DeepDiff(aResult, anExpected, ignore_order=True))
+
+def test_ignore_order_of_some_paths() :
+  result   = { 'sets' : [ 2, 1 ], 'lists' : [ 2, 1 ] }
+  expected = { 'sets' : [ 1, 2 ], 'lists' : [ 1, 2 ] }
+  assert [ aPath for aPath, aDiff in
+    compareResults(result, expected, ignoreOrder=[ 'sets' ]) ] == [ 'lists' ]
+  assert compareResults(result, expected, ignoreOrder=[ 'sets', 'lists' ]) == [ ]
@@ -0,0 +1,44 @@
+import json
+import threading
+
+from cpcli.testRunner import runTests
+
+def interleavedTests(numTests) :
+  """Return numTests (name, test) pairs whose tests each print three
+  lines, waiting (at a barrier) for all of the others between lines."""
+
+  barrier = threading.Barrier(numTests, timeout=5)
+  def makeTest(aName) :
+    def aTest(config) :
+      for aLine in range(3) :
+        print(f"{aName} line {aLine}")
+        barrier.wait()
+    return aTest
+  return [ (f"test{aNum}", makeTest(f"test{aNum}")) for aNum in range(numTests) ]
+
+def runAndReport(tmp_path, tests, jobs) :
+  reportPath = str(tmp_path / 'report.json')
+  assert runTests(tests, { }, jobs=jobs, reportPath=reportPath)
+  with open(reportPath) as reportFile :
+    return json.load(reportFile)
+
+def test_concurrent_output_is_printed_one_test_at_a_time(tmp_path, capsys) :
+  report = runAndReport(tmp_path, interleavedTests(3), jobs=3)
+  out = capsys.readouterr().out
+
+  assert report['passed'] == 3
+  for aResult in report['results'] :
+    aName = aResult['name']
+    testLines = [ f"{aName} line {aLine}\n" for aLine in range(3) ]
+    # each test's output holds only (all of) its own lines...
+    assert [ aLine+"\n" for aLine in aResult['output'].splitlines()
+      if ' line ' in aLine ] == testLines
+    # ...and is printed as one block
+    assert "".join(testLines) in out
+
+def test_output_is_not_buffered_without_concurrency(tmp_path, capsys) :
+  def aTest(config) :
+    print("printed directly")
+  report = runAndReport(tmp_path, [ ('test0', aTest) ], jobs=1)
+  assert 'output' not in report['results'][0]
+  assert "printed directly\n" in capsys.readouterr().out
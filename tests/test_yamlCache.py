@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from cpcli import yamlCache
+from cpcli.yamlCache import YamlCache
+
+@pytest.fixture
+def parsed(monkeypatch) :
+  """Record the text of every yaml file which is actually parsed."""
+
+  parsedTexts = [ ]
+  origParseYaml = yamlCache.parseYaml
+  def parseYaml(yamlText) :
+    parsedTexts.append(yamlText)
+    return origParseYaml(yamlText)
+  monkeypatch.setattr(yamlCache, 'parseYaml', parseYaml)
+  return parsedTexts
+
+def makeCache(tmp_path) :
+  return YamlCache(str(tmp_path / 'cache' / 'yamlCache.pickle'))
+
+def test_unchanged_files_are_not_reparsed(tmp_path, parsed) :
+  yamlPath = tmp_path / 'config.yaml'
+  yamlPath.write_text("a: 1\n")
+  aCache = makeCache(tmp_path)
+  assert aCache.load(str(yamlPath)) == { 'a' : 1 }
+  assert aCache.load(str(yamlPath)) == { 'a' : 1 }
+  aCache.save()
+  # (a new invocation of cpcli)
+  assert makeCache(tmp_path).load(str(yamlPath)) == { 'a' : 1 }
+  assert parsed == [ "a: 1\n" ]
+
+def test_changed_files_are_reparsed(tmp_path, parsed) :
+  yamlPath = tmp_path / 'config.yaml'
+  yamlPath.write_text("a: 1\n")
+  aCache = makeCache(tmp_path)
+  aCache.load(str(yamlPath))
+
+  yamlPath.write_text("a: 22\n")
+  assert aCache.load(str(yamlPath)) == { 'a' : 22 }
+
+  # (the same size, but a new mtime)
+  aStat = os.stat(yamlPath)
+  yamlPath.write_text("a: 33\n")
+  os.utime(yamlPath, ns=(aStat.st_atime_ns, aStat.st_mtime_ns + 10**9))
+  assert aCache.load(str(yamlPath)) == { 'a' : 33 }
+  assert len(parsed) == 3
+
+def test_changes_to_the_loaded_data_are_not_cached(tmp_path, parsed) :
+  yamlPath = tmp_path / 'config.yaml'
+  yamlPath.write_text("l: [ 1 ]\n")
+  aCache = makeCache(tmp_path)
+  aCache.load(str(yamlPath))['l'].append(2)
+  assert aCache.load(str(yamlPath)) == { 'l' : [ 1 ] }
+
+def test_missing_files_are_dropped_from_the_cache(tmp_path, parsed) :
+  keptPath    = tmp_path / 'kept.yaml'
+  removedPath = tmp_path / 'removed.yaml'
+  keptPath.write_text("a: 1\n")
+  removedPath.write_text("b: 2\n")
+  aCache = makeCache(tmp_path)
+  aCache.load(str(keptPath))
+  aCache.load(str(removedPath))
+  removedPath.unlink()
+  with pytest.raises(FileNotFoundError) :
+    aCache.load(str(removedPath))
+  aCache.save()
+
+  aCache = makeCache(tmp_path)
+  aCache.loadEntries()
+  assert list(aCache.entries.keys()) == [ str(keptPath) ]
+
+def test_a_corrupt_cache_is_ignored(tmp_path, parsed) :
+  yamlPath = tmp_path / 'config.yaml'
+  yamlPath.write_text("a: 1\n")
+  aCache = makeCache(tmp_path)
+  os.makedirs(os.path.dirname(aCache.cachePath))
+  with open(aCache.cachePath, 'wb') as cacheFile :
+    cacheFile.write(b"not a pickle")
+  assert aCache.load(str(yamlPath)) == { 'a' : 1 }
+  aCache.save()
+  assert makeCache(tmp_path).load(str(yamlPath)) == { 'a' : 1 }
+  assert len(parsed) == 1